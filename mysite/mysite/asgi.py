@@ -0,0 +1,40 @@
+"""
+ASGI config for mysite project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Requests are resolved with mysite/asgi_urls.py, so redirects are served by
+async views, e.g. ``uvicorn mysite.asgi:application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+
+ASGI_URLCONF = 'mysite.asgi_urls'
+
+
+class ShortUrlASGIHandler(ASGIHandler):
+
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+        if request is not None:
+            request.urlconf = ASGI_URLCONF
+
+        return request, error_response
+
+
+django.setup(set_prefix=False)
+
+application = ShortUrlASGIHandler()
+
+if settings.ENABLE_REDIRECT_FAST_PATH:
+    from shorten_urls.fast_path import RedirectFastPathASGI
+
+    application = RedirectFastPathASGI(application)
@@ -0,0 +1,16 @@
+"""
+URL configuration of the ASGI entry point, see mysite/asgi.py.
+
+The redirect and original url lookup are served by async views, every
+other url is the same as in mysite/urls.py.
+"""
+from django.urls import re_path
+
+from shorten_urls import api_views, views
+
+from .urls import urlpatterns as wsgi_urlpatterns
+
+urlpatterns = [
+    re_path(r'^(?P<short_url>[a-zA-Z0-9]{5})$', views.AsyncShortUrlRedirectView.as_view()),
+    re_path(r'^api/v1/short_urls/?original_url$', api_views.AsyncGetOriginalUrlView.as_view()),
+] + wsgi_urlpatterns
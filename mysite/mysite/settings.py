@@ -45,6 +45,7 @@ LOCAL_APPS = [
 INSTALLED_APPS = DJANGO_APPS + LOCAL_APPS
 
 MIDDLEWARE = [
+    'shorten_urls.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +86,18 @@ DATABASES = {
     }
 }
 
+# keep the 32-bit ids of the existing tables
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+DATABASE_ROUTERS = ['shorten_urls.sharding.ShortUrlShardRouter']
+
+# DATABASES aliases holding short urls, see shorten_urls/sharding.py
+SHORT_URL_SHARDS = ['default']
+
+# read-only DATABASES aliases per shard used by redirects and lookups,
+# e.g. {'default': ['replica_1', 'replica_2']}
+SHORT_URL_READ_REPLICAS = {}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -140,3 +153,19 @@ CACHES = {
 }
 
 ENABLE_CACHE = False
+
+# manifest written by `manage.py build_redirect_snapshot`, redirects are
+# looked up in its segments before Redis and the database
+REDIRECT_SNAPSHOT_PATH = None
+
+# answer redirects before the middleware, see shorten_urls.fast_path
+ENABLE_REDIRECT_FAST_PATH = True
+
+# count redirects per short url and hour, see shorten_urls.clicks
+ENABLE_CLICK_TRACKING = False
+
+# client addresses allowed to read GET /metrics, others get a 404
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# expose per-component durations of tracked views in a Server-Timing header
+ENABLE_SERVER_TIMING = False
@@ -0,0 +1,27 @@
+"""
+Settings for running ``manage.py run_benchmarks`` offline against a local
+SQLite file and an in-memory cache.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'benchmark.sqlite3'),
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'TIMEOUT': 86400,
+        'KEY_PREFIX': 'shorten_urls',
+    }
+}
+
+ENABLE_CACHE = True
+
+RATELIMIT_ENABLE = False
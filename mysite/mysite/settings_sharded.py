@@ -0,0 +1,23 @@
+"""
+Settings for running the app locally with short urls split across several
+SQLite files, e.g. ``manage.py migrate --database=shard_1``.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    },
+    'shard_1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'shard_1.sqlite3'),
+    },
+    'shard_2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'shard_2.sqlite3'),
+    },
+}
+
+SHORT_URL_SHARDS = ['default', 'shard_1', 'shard_2']
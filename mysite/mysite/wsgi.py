@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/2.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_wsgi_application()
+
+if settings.ENABLE_REDIRECT_FAST_PATH:
+    from shorten_urls.fast_path import RedirectFastPathWSGI
+
+    application = RedirectFastPathWSGI(application)
@@ -1,20 +1,33 @@
 import http.client as httplib
+import json
 
 from django.conf import settings
-from django.core.cache import cache
+from django.core.cache import cache as default_cache
 from django.http import JsonResponse
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
+from django.views.generic import View
 from django.views.generic.detail import BaseDetailView
 from django.views.generic.edit import BaseFormView
 from ratelimit.decorators import ratelimit
 
-from .configs import CREATE_SHORT_URL_RATE_LIMIT, PREVIEW_URL_REDIS_PREFIX
-from .forms import GetOriginalUrlForm, ShortUrlForm, UrlPreviewForm
-from .logics import ShortUrlLogics, UrlPreviewDataLogic, decode_short_url
-from .models import ShortUrl
+from .async_utils import AsyncViewMixin, run_in_thread
+from .clicks import get_click_hour
+from .configs import (BULK_CREATE_SHORT_URL_RATE_LIMIT,
+                      CREATE_SHORT_URL_RATE_LIMIT, PREVIEW_CACHE_TIMEOUT,
+                      PREVIEW_URL_REDIS_PREFIX)
+from .forms import (ClickStatsForm, GetOriginalUrlForm, ShortUrlBulkForm,
+                    ShortUrlForm, UrlPreviewForm)
+from .logics import (ShortUrlBulkLogics, ShortUrlLogics, UrlPreviewDataLogic,
+                     get_click_stats, get_short_url_object_for_read)
+from .metrics import TimedCache
+from .models import UrlPreviewCrawlTask
+from .single_flight import get_or_refresh
 from .utils import b62_encode
 
+cache = TimedCache(default_cache)
+
 
 @method_decorator(ratelimit(key='ip', rate=CREATE_SHORT_URL_RATE_LIMIT, method='POST', block=False), 'post')
 @method_decorator(csrf_exempt, name='dispatch')
@@ -47,45 +60,106 @@ class ShortUrlView(BaseFormView):
         return JsonResponse(form.errors, status=httplib.BAD_REQUEST)
 
 
+@method_decorator(ratelimit(key='ip', rate=BULK_CREATE_SHORT_URL_RATE_LIMIT, method='POST', block=False), 'post')
 @method_decorator(csrf_exempt, name='dispatch')
-class ShortUrlPreviewView(BaseFormView):
+class ShortUrlBulkView(BaseFormView):
     http_method_names = ['post']
-    form_class = UrlPreviewForm
+    form_class = ShortUrlBulkForm
+
+    def post(self, request, *args, **kwargs):
+        if request.limited:
+            response = {
+                'message': 'Rate limit exceed'
+            }
+            return JsonResponse(response, status=httplib.FORBIDDEN)
+
+        return super(ShortUrlBulkView, self).post(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super(ShortUrlBulkView, self).get_form_kwargs()
+
+        try:
+            data = json.loads(self.request.body.decode('utf-8'))
+        except ValueError:
+            data = {}
+
+        kwargs['data'] = data if isinstance(data, dict) else {}
+        return kwargs
 
     def form_valid(self, form):
         response = {}
 
+        urls = form.cleaned_data['urls']
+
+        logic = ShortUrlBulkLogics(urls)
+
+        response['data'] = logic.get_short_url_infos()
+        response['message'] = 'success'
+
+        return JsonResponse(response, status=httplib.OK)
+
+    def form_invalid(self, form):
+        return JsonResponse(form.errors, status=httplib.BAD_REQUEST)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ShortUrlPreviewView(BaseFormView):
+    http_method_names = ['post']
+    form_class = UrlPreviewForm
+
+    def form_valid(self, form):
         url_input = form.cleaned_data['url_input']
 
-        cache_key = PREVIEW_URL_REDIS_PREFIX + url_input
+        if not settings.ENABLE_CACHE:
+            return self.get_preview_response(url_input)[0]
+
+        # set when this request is the one that looked the preview up
+        preview_response = None
+
+        def get_preview_data():
+            nonlocal preview_response
+            preview_response, preview_data = self.get_preview_response(url_input)
+            return preview_data, PREVIEW_CACHE_TIMEOUT
+
+        preview_data = get_or_refresh(
+            cache, PREVIEW_URL_REDIS_PREFIX + url_input, get_preview_data)
 
-        if settings.ENABLE_CACHE:
-            cached_preview_data = cache.get(cache_key)
-            if cached_preview_data:
-                response['data'] = cached_preview_data
-                response['message'] = 'success'
-                return JsonResponse(response, status=httplib.OK)
+        if preview_response is not None:
+            return preview_response
+        elif preview_data:
+            return JsonResponse({'data': preview_data, 'message': 'success'}, status=httplib.OK)
+
+        # the request that looked it up had no preview to share
+        return self.get_preview_response(url_input)[0]
+
+    def get_preview_response(self, url_input):
+        """
+        Return the response and the preview data worth caching, None while
+        there is no preview.
+        """
+        response = {}
 
         logic = UrlPreviewDataLogic(url_input)
 
-        info = logic.get_url_preview_data_info()
-        if not info:
+        status, info = logic.get_or_enqueue_url_preview_data_info()
+        if status == UrlPreviewCrawlTask.STATUS_PENDING:
+            response['data'] = {}
+            response['message'] = 'pending'
+            return JsonResponse(response, status=httplib.ACCEPTED), None
+        elif not info:
             response['data'] = {}
             response['message'] = 'failed'
-        else:
-            response['data'] = {
-                'title': info['title'],
-                'description': info['description'],
-                'url': info['url'],
-                'image_url': info['image_url']
-            }
-
-            if settings.ENABLE_CACHE:
-                cache.set(cache_key, response['data'])
-
-            response['message'] = 'success'
+            return JsonResponse(response, status=httplib.OK), None
+
+        response['data'] = {
+            'title': info['title'],
+            'description': info['description'],
+            'url': info['url'],
+            'image_url': info['image_url']
+        }
+        response['message'] = 'success'
 
-        return JsonResponse(response, status=httplib.OK)
+        return JsonResponse(response, status=httplib.OK), response['data']
 
     def form_invalid(self, form):
         return JsonResponse(form.errors, status=httplib.BAD_REQUEST)
@@ -98,15 +172,17 @@ class GetOriginalUrlView(BaseDetailView):
 
         if form.is_valid():
             short_url = form.cleaned_data['short_url']
-            url_id = decode_short_url(short_url)
 
-            short_url_object = ShortUrl.objects.filter(id=url_id)
-            return short_url_object.first()
+            return get_short_url_object_for_read(short_url)
 
         return
 
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
+
+        return self.get_original_url_response()
+
+    def get_original_url_response(self):
         response = {}
 
         if self.object:
@@ -121,3 +197,51 @@ class GetOriginalUrlView(BaseDetailView):
             response['message'] = 'failed'
 
             return JsonResponse(response, status=httplib.BAD_REQUEST)
+
+
+class AsyncGetOriginalUrlView(AsyncViewMixin, GetOriginalUrlView):
+    """
+    GetOriginalUrlView for the ASGI entry point, the lookup runs in a
+    worker thread.
+    """
+    http_method_names = ['get']
+
+    async def get(self, request, *args, **kwargs):
+        self.object = None
+
+        form = GetOriginalUrlForm(request.GET)
+        if form.is_valid():
+            self.object = await run_in_thread(
+                get_short_url_object_for_read, form.cleaned_data['short_url'])
+
+        return self.get_original_url_response()
+
+
+class ClickStatsView(View):
+    http_method_names = ['get']
+
+    def get(self, request, *args, **kwargs):
+        form = ClickStatsForm(request.GET)
+        response = {}
+
+        if not form.is_valid():
+            response['data'] = {}
+            response['message'] = 'failed'
+            return JsonResponse(response, status=httplib.BAD_REQUEST)
+
+        short_url = form.cleaned_data['short_url']
+        # the current hour counts as one of the requested hours
+        since = get_click_hour() - timezone.timedelta(hours=form.cleaned_data['hours'] - 1)
+
+        hourly_clicks = [
+            {'hour': hour.strftime('%Y-%m-%d %H:%M:%S'), 'clicks': clicks}
+            for hour, clicks in get_click_stats(short_url, since)
+        ]
+        response['data'] = {
+            'short_url_path': short_url,
+            'clicks': sum(item['clicks'] for item in hourly_clicks),
+            'hourly_clicks': hourly_clicks,
+        }
+        response['message'] = 'success'
+
+        return JsonResponse(response, status=httplib.OK)
@@ -0,0 +1,151 @@
+import asyncio
+import contextvars
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import close_old_connections
+
+from .configs import ASYNC_THREAD_POOL_MAX_WORKERS
+from .metrics import COMPONENT_CACHE, timed, timed_queries
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+REDIS_CACHE_BACKEND = 'django_redis.cache.RedisCache'
+
+thread_pool = ThreadPoolExecutor(
+    max_workers=ASYNC_THREAD_POOL_MAX_WORKERS, thread_name_prefix='shorten_urls_async')
+
+
+def _call_in_thread(func, args, kwargs):
+    # like a request in a WSGI worker, drop connections past CONN_MAX_AGE
+    close_old_connections()
+
+    with timed_queries():
+        return func(*args, **kwargs)
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """
+    Run blocking code, e.g. an ORM lookup, from an async view.
+
+    sync_to_async runs every call of the process in one shared thread, so
+    lookups of concurrent requests would queue behind each other. This uses
+    a pool instead, which also means consecutive calls may run on different
+    threads and connections: only pass self-contained reads.
+    """
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, _call_in_thread, func, args, kwargs)
+
+    return await asyncio.get_running_loop().run_in_executor(thread_pool, call)
+
+
+class AsyncViewMixin:
+    """
+    Lets a class-based view define ``async def`` handlers.
+
+    Django 3.2 only awaits views that are coroutine functions, which the
+    callable of as_view() never is, so it is marked as one here.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view._is_coroutine = asyncio.coroutines._is_coroutine
+
+        return view
+
+
+class AsyncCache:
+    """
+    Awaitable get, set, add and delete on a configured Django cache.
+
+    django-redis only has a blocking client, so for it the same keys are
+    read and written with redis.asyncio, reusing the backend's own key and
+    value encoding. Other backends are called in the thread pool.
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _get_client(self):
+        config = settings.CACHES[self.alias]
+        if aioredis is None or config['BACKEND'] != REDIS_CACHE_BACKEND:
+            return None
+
+        # connections of redis.asyncio are bound to the loop they were made on
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            location = config['LOCATION']
+            if not isinstance(location, str):
+                location = location[0]
+            client = self._clients[loop] = aioredis.Redis.from_url(location.split(',')[0])
+
+        return client
+
+    async def get(self, key, default=None):
+        client = self._get_client()
+
+        with timed(COMPONENT_CACHE):
+            if client is None:
+                return await run_in_thread(self.cache.get, key, default)
+
+            redis_cache = self.cache.client
+            value = await client.get(redis_cache.make_key(key))
+
+        if value is None:
+            return default
+
+        return redis_cache.decode(value)
+
+    async def set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        client = self._get_client()
+
+        with timed(COMPONENT_CACHE):
+            if client is None:
+                return await run_in_thread(self.cache.set, key, value, timeout=timeout)
+
+            if timeout is DEFAULT_TIMEOUT:
+                timeout = self.cache.default_timeout
+
+            redis_cache = self.cache.client
+            await client.set(
+                redis_cache.make_key(key), redis_cache.encode(value),
+                ex=None if timeout is None else max(int(timeout), 1))
+
+    async def add(self, key, value, timeout=DEFAULT_TIMEOUT):
+        client = self._get_client()
+
+        with timed(COMPONENT_CACHE):
+            if client is None:
+                return await run_in_thread(self.cache.add, key, value, timeout=timeout)
+
+            if timeout is DEFAULT_TIMEOUT:
+                timeout = self.cache.default_timeout
+
+            redis_cache = self.cache.client
+            return bool(await client.set(
+                redis_cache.make_key(key), redis_cache.encode(value), nx=True,
+                ex=None if timeout is None else max(int(timeout), 1)))
+
+    async def delete(self, key):
+        client = self._get_client()
+
+        with timed(COMPONENT_CACHE):
+            if client is None:
+                return await run_in_thread(self.cache.delete, key)
+
+            return bool(await client.delete(self.cache.client.make_key(key)))
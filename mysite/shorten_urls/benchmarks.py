@@ -0,0 +1,252 @@
+import platform
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.db import connection, transaction
+from django.test import Client
+from django.utils import timezone
+
+from .configs import ENCODE_NUM_MAX, URL_B62_BASE_NUM
+from .logics import ShortUrlLogics, decode_short_url
+from .models import (ShortUrl, get_hashed_url_from_original_url,
+                     get_hashed_urls_from_original_urls, get_random_offset)
+from .utils import (b62_decode, b62_decode_many, b62_encode, b62_encode_many,
+                    canonicalize_url)
+
+BENCHMARK_URL_TEMPLATE = 'https://bench.example.com/{}'
+BENCHMARK_NEW_URL_TEMPLATE = 'https://bench.example.com/new/{}'
+BENCHMARK_SAMPLE_SIZE = 1000
+
+
+def percentile(samples, percent):
+    if not samples:
+        return 0
+
+    ordered = sorted(samples)
+    index = int(round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summarize_latencies(latencies, elapsed):
+    return {
+        'count': len(latencies),
+        'p50_us': round(percentile(latencies, 50) * 1E6, 2),
+        'p99_us': round(percentile(latencies, 99) * 1E6, 2),
+        'mean_us': round(sum(latencies) / len(latencies) * 1E6, 2) if latencies else 0,
+        'ops_per_sec': round(len(latencies) / elapsed, 2) if elapsed else 0,
+    }
+
+
+def time_calls(func, args_list, number):
+    calls = [args_list[index % len(args_list)] for index in range(number)]
+
+    start = time.perf_counter()
+    for args in calls:
+        func(args)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'count': number,
+        'ns_per_op': round(elapsed / number * 1E9, 2),
+        'ops_per_sec': round(number / elapsed, 2),
+    }
+
+
+def time_each_call(func, args_list):
+    latencies = []
+
+    start = time.perf_counter()
+    for args in args_list:
+        call_start = time.perf_counter()
+        func(args)
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+
+    return summarize_latencies(latencies, elapsed)
+
+
+def run_micro_benchmarks(number):
+    numbers = [
+        random.randint(URL_B62_BASE_NUM, ENCODE_NUM_MAX)
+        for _ in range(BENCHMARK_SAMPLE_SIZE)
+    ]
+    codes = [b62_encode(number) for number in numbers]
+    urls = [BENCHMARK_URL_TEMPLATE.format(index) for index in range(BENCHMARK_SAMPLE_SIZE)]
+
+    results = {
+        'b62_encode': time_calls(b62_encode, numbers, number),
+        'b62_decode': time_calls(b62_decode, codes, number),
+        'decode_short_url': time_calls(decode_short_url, codes, number),
+        'get_hashed_url_from_original_url': time_calls(
+            get_hashed_url_from_original_url, urls, number),
+    }
+
+    batches = max(1, number // len(numbers))
+    encode_many = time_calls(b62_encode_many, [numbers], batches)
+    decode_many = time_calls(b62_decode_many, [codes], batches)
+    hash_many = time_calls(get_hashed_urls_from_original_urls, [urls], batches)
+    results['b62_encode_many'] = {
+        'count': batches * len(numbers),
+        'ns_per_op': round(encode_many['ns_per_op'] / len(numbers), 2),
+        'ops_per_sec': round(encode_many['ops_per_sec'] * len(numbers), 2),
+    }
+    results['b62_decode_many'] = {
+        'count': batches * len(codes),
+        'ns_per_op': round(decode_many['ns_per_op'] / len(codes), 2),
+        'ops_per_sec': round(decode_many['ops_per_sec'] * len(codes), 2),
+    }
+    results['get_hashed_urls_from_original_urls'] = {
+        'count': batches * len(urls),
+        'ns_per_op': round(hash_many['ns_per_op'] / len(urls), 2),
+        'ops_per_sec': round(hash_many['ops_per_sec'] * len(urls), 2),
+    }
+
+    return results
+
+
+def populate_short_urls(rows, batch_size=10000, stdout=None):
+    existing = ShortUrl.objects.filter(
+        original_url__startswith=BENCHMARK_URL_TEMPLATE.format('')).count()
+
+    for start in range(existing, rows, batch_size):
+        urls = [
+            BENCHMARK_URL_TEMPLATE.format(index)
+            for index in range(start, min(start + batch_size, rows))
+        ]
+
+        canonical_urls = [canonicalize_url(url) for url in urls]
+        hashed_urls = get_hashed_urls_from_original_urls(canonical_urls)
+        objs = [
+            ShortUrl(
+                original_url=url,
+                canonical_url=canonical_url,
+                hashed_url=hashed_url,
+                random_offset=get_random_offset(),
+            )
+            for url, canonical_url, hashed_url in zip(urls, canonical_urls, hashed_urls)
+        ]
+        objs_by_shard = ShortUrl.objects.assign_short_url_paths(objs)
+
+        for shard, shard_objs in objs_by_shard.items():
+            with transaction.atomic(using=shard):
+                ShortUrl.objects.using(shard).bulk_create(shard_objs)
+
+        if stdout is not None:
+            stdout.write('populated {} / {} rows'.format(start + len(urls), rows))
+
+
+def cleanup_new_short_urls():
+    ShortUrl.objects.filter(
+        original_url__startswith=BENCHMARK_NEW_URL_TEMPLATE.format('')).delete()
+
+
+def new_benchmark_url():
+    return BENCHMARK_NEW_URL_TEMPLATE.format(uuid.uuid4().hex)
+
+
+def sample_short_url_objects(rows, size):
+    urls = [
+        BENCHMARK_URL_TEMPLATE.format(random.randrange(rows))
+        for _ in range(size)
+    ]
+    return list(ShortUrl.objects.filter(original_url__in=urls))
+
+
+def run_db_benchmarks(rows, number, stdout=None):
+    populate_short_urls(rows, stdout=stdout)
+
+    hit_urls = [
+        BENCHMARK_URL_TEMPLATE.format(random.randrange(rows))
+        for _ in range(number)
+    ]
+    miss_urls = [new_benchmark_url() for _ in range(number)]
+
+    def get_or_create(url):
+        ShortUrlLogics(url).get_or_create_short_url()
+
+    try:
+        return {
+            'get_or_create_short_url_hit': time_each_call(get_or_create, hit_urls),
+            'get_or_create_short_url_miss': time_each_call(get_or_create, miss_urls),
+        }
+    finally:
+        cleanup_new_short_urls()
+
+
+def _run_requests(send_request, requests, concurrency):
+    def worker(count):
+        client = Client()
+        latencies = []
+        try:
+            for _ in range(count):
+                start = time.perf_counter()
+                send_request(client)
+                latencies.append(time.perf_counter() - start)
+        finally:
+            if concurrency > 1:
+                connection.close()
+
+        return latencies
+
+    counts = [requests // concurrency] * concurrency
+    for index in range(requests % concurrency):
+        counts[index] += 1
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(worker, counts))
+    else:
+        results = [worker(counts[0])]
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for result in results for latency in result]
+    return summarize_latencies(latencies, elapsed)
+
+
+def run_load_benchmarks(rows, requests, concurrency):
+    short_url_paths = [
+        short_url_object.short_url_path
+        for short_url_object in sample_short_url_objects(
+            rows, min(rows, BENCHMARK_SAMPLE_SIZE))
+    ]
+
+    def redirect(client):
+        client.get('/' + random.choice(short_url_paths))
+
+    def create(client):
+        client.post('/api/v1/short_urls', {'url_input': new_benchmark_url()})
+
+    try:
+        return {
+            'redirect_view': _run_requests(redirect, requests, concurrency),
+            'short_url_view': _run_requests(create, requests, concurrency),
+        }
+    finally:
+        cleanup_new_short_urls()
+
+
+def get_environment():
+    return {
+        'timestamp': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+    }
+
+
+def compare_results(previous, current):
+    changes = {}
+    for group, results in current.items():
+        for name, result in results.items():
+            previous_result = previous.get(group, {}).get(name)
+            if not previous_result or not previous_result.get('ops_per_sec'):
+                continue
+
+            ratio = result['ops_per_sec'] / previous_result['ops_per_sec']
+            changes['{}.{}'.format(group, name)] = round((ratio - 1) * 100, 2)
+
+    return changes
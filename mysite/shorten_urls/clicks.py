@@ -0,0 +1,105 @@
+import atexit
+import os
+import threading
+from collections import Counter
+
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from .configs import CLICK_BUFFER_MAX_SIZE, CLICK_FLUSH_INTERVAL
+from .logics import get_shard_for_short_url
+from .models import ClickStats
+
+
+def get_click_hour(now=None):
+    now = now or timezone.now()
+    return now.replace(minute=0, second=0, microsecond=0)
+
+
+class ClickBuffer:
+    """
+    Counts redirects in memory and writes them to ClickStats in batches.
+
+    ``record`` only bumps a counter under a lock, so the redirect path
+    never waits on the database. A daemon thread flushes the counters
+    every ``flush_interval`` seconds, or earlier once ``max_size`` codes
+    are buffered. Clicks of a failed flush are kept for the next one;
+    clicks buffered when the process is killed are lost.
+    """
+
+    def __init__(self, flush_interval=CLICK_FLUSH_INTERVAL, max_size=CLICK_BUFFER_MAX_SIZE):
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def __len__(self):
+        return len(self._counts)
+
+    def record(self, short_url_path, now=None):
+        key = (short_url_path, get_click_hour(now))
+
+        with self._lock:
+            self._counts[key] += 1
+            size = len(self._counts)
+
+        if self.flush_interval is not None:
+            self._start_flusher()
+            if size >= self.max_size:
+                self._wakeup.set()
+
+    def drain(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+
+        return counts
+
+    def flush(self):
+        with self._flush_lock:
+            counts = self.drain()
+
+            counts_by_shard = {}
+            for key, clicks in counts.items():
+                shard = get_shard_for_short_url(key[0])
+                counts_by_shard.setdefault(shard, {})[key] = clicks
+
+            flushed = 0
+            for shard, shard_counts in counts_by_shard.items():
+                try:
+                    ClickStats.objects.db_manager(shard).add_clicks(shard_counts)
+                except DatabaseError:
+                    with self._lock:
+                        self._counts.update(shard_counts)
+                else:
+                    flushed += sum(shard_counts.values())
+
+        return flushed
+
+    def _start_flusher(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+
+        with self._lock:
+            # a forked worker inherits the parent's buffer, not its thread
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name='click-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+
+            close_old_connections()
+            self.flush()
+
+
+click_buffer = ClickBuffer()
+atexit.register(click_buffer.flush)
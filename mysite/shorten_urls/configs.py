@@ -6,17 +6,123 @@ REVERSE_B62_ALPHABET = {
 }
 
 SHORT_URL_MAX_LEN = 5
+B62_POWERS = tuple(pow(len(B62_ALPHABET), index) for index in range(SHORT_URL_MAX_LEN))
 ENCODE_NUM_MAX = int(8 * 1E8)
 
+SHORT_URL_ID_BLOCK_SIZE = 10000
+
 URL_B62_BASE_NUM = int(1E8)
 URL_B62_OFFSET_SIZE = int(1E8)
 URL_B62_OFFSET_RANGE = [0, 6]
 
 CRAWL_URL_PREVIEW_TIMEOUT = 3
 
-HASHED_URL_LENGTH = 32
+# 'single_pass' extracts preview fields in one html.parser walk,
+# 'soup' builds a full BeautifulSoup tree
+URL_PREVIEW_EXTRACTOR = 'single_pass'
+
+URL_PREVIEW_DATA_EXPIRE_DAYS = 1
+
+PREVIEW_CRAWL_BATCH_SIZE = 10
+PREVIEW_CRAWL_POLL_INTERVAL = 1
+PREVIEW_CRAWL_TASK_TIMEOUT = 60
+PREVIEW_CRAWL_MAX_ATTEMPTS = 3
+PREVIEW_CRAWL_RETRY_INTERVAL = 3600
+
+PREVIEW_FETCH_MAX_WORKERS = 32
+PREVIEW_FETCH_MAX_PER_HOST = 4
+PREVIEW_FETCH_MAX_HOSTS = 100
+PREVIEW_FETCH_CHUNK_SIZE = 8 * 1024
+PREVIEW_FETCH_MAX_BYTES = 512 * 1024
+PREVIEW_FETCH_BODY_MAX_BYTES = 64 * 1024
+
+# query params dropped before dedup, shell-style patterns
+URL_CANONICAL_DROP_PARAMS = [
+    'utm_*',
+    'fbclid',
+    'gclid',
+]
+
+# hashed urls are stored as a signed 64-bit fingerprint
+HASHED_URL_BYTES = 8
+
+# 'sha256', 'blake2b', or 'xxhash' when the xxhash package is installed;
+# existing rows keep their old fingerprint until `manage.py rehash_short_urls`
+URL_FINGERPRINT_ALGORITHM = 'sha256'
 
 CREATE_SHORT_URL_RATE_LIMIT = '5/m'
+BULK_CREATE_SHORT_URL_RATE_LIMIT = '5/m'
+
+BULK_SHORT_URL_MAX_SIZE = 50000
+BULK_SHORT_URL_QUERY_BATCH_SIZE = 500
+
+METRICS_VIEWS = [
+    'ShortUrlRedirectView',
+    'ShortUrlView',
+    'ShortUrlBulkView',
+    'ShortUrlPreviewView',
+    'GetOriginalUrlView',
+    'ClickStatsView',
+    'AsyncShortUrlRedirectView',
+    'AsyncGetOriginalUrlView',
+]
+METRICS_LATENCY_BUCKETS = [
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+]
 
 REDIRECT_URL_REDIS_PREFIX = 'REDIRECT:'
+REDIRECT_LOCAL_CACHE_MAX_SIZE = 10000
+REDIRECT_LOCAL_CACHE_TIMEOUT = 300
+REDIRECT_NOT_FOUND_CACHE_VALUE = '<NOT_FOUND>'
+REDIRECT_NOT_FOUND_CACHE_TIMEOUT = 60
+
+# threads running blocking lookups of the async views, see async_utils
+ASYNC_THREAD_POOL_MAX_WORKERS = 32
+
+# 'round_robin' or 'least_loaded' (fewest reads in flight from this process)
+READ_REPLICA_SELECTION = 'round_robin'
+
+# seconds between checks for new redirect snapshot segments, see snapshot.py
+REDIRECT_SNAPSHOT_RELOAD_INTERVAL = 1
+REDIRECT_SNAPSHOT_CHUNK_SIZE = 10000
+# `build_redirect_snapshot --follow` appends a delta segment every interval
+# and compacts once there are more than REDIRECT_SNAPSHOT_MAX_SEGMENTS
+REDIRECT_SNAPSHOT_DELTA_INTERVAL = 5
+REDIRECT_SNAPSHOT_MAX_SEGMENTS = 8
+# seconds of already exported rows read again by each delta
+REDIRECT_SNAPSHOT_DELTA_OVERLAP = 60
+
+REDIRECT_ID_RANGE_FILTER_ENABLED = True
+REDIRECT_ID_RANGE_FILTER_REFRESH_INTERVAL = 1
+REDIRECT_ID_RANGE_FILTER_MARGIN = 10000
 PREVIEW_URL_REDIS_PREFIX = 'GETPREVIEW:'
+
+# seconds until cached redirects and previews are refreshed
+REDIRECT_CACHE_TIMEOUT = 86400
+PREVIEW_CACHE_TIMEOUT = 86400
+
+# stampede protection of cached keys, see single_flight.py
+CACHE_LOCK_PREFIX = 'LOCK:'
+# the lock is released early once the value is written
+CACHE_LOCK_TIMEOUT = 10
+# how long a request without a stale value waits for another one's refresh
+CACHE_LOCK_WAIT_TIMEOUT = 1
+CACHE_LOCK_POLL_INTERVAL = 0.02
+# seconds a value past its refresh time is still served while one request
+# refreshes it
+CACHE_STALE_TIMEOUT = 300
+# > 1 refreshes earlier, 0 only once due
+CACHE_EARLY_REFRESH_BETA = 1
+# refresh times are shortened by up to this fraction
+CACHE_TTL_JITTER = 0.1
+
+# seconds between background flushes of buffered clicks
+CLICK_FLUSH_INTERVAL = 5
+# buffered (code, hour) counters that wake the flusher early
+CLICK_BUFFER_MAX_SIZE = 10000
+CLICK_FLUSH_BATCH_SIZE = 500
+CLICK_STATS_DEFAULT_HOURS = 24
+CLICK_STATS_MAX_HOURS = 24 * 30
+
+# rows read per query and keys written per set_many by warm_cache
+CACHE_WARM_CHUNK_SIZE = 5000
@@ -0,0 +1,52 @@
+import hashlib
+
+from .configs import HASHED_URL_BYTES, URL_FINGERPRINT_ALGORITHM
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def _to_fingerprint(digest):
+    return int.from_bytes(digest[:HASHED_URL_BYTES], 'big', signed=True)
+
+
+def sha256_fingerprint(data):
+    return _to_fingerprint(hashlib.sha256(data).digest())
+
+
+def blake2b_fingerprint(data):
+    return _to_fingerprint(hashlib.blake2b(data, digest_size=HASHED_URL_BYTES).digest())
+
+
+URL_FINGERPRINT_FUNCTIONS = {
+    'sha256': sha256_fingerprint,
+    'blake2b': blake2b_fingerprint,
+}
+
+if xxhash is not None:
+    def xxhash_fingerprint(data):
+        return _to_fingerprint(xxhash.xxh64_digest(data))
+
+    URL_FINGERPRINT_FUNCTIONS['xxhash'] = xxhash_fingerprint
+
+
+def get_fingerprint_function(algorithm=None):
+    if algorithm is None:
+        algorithm = URL_FINGERPRINT_ALGORITHM
+
+    try:
+        return URL_FINGERPRINT_FUNCTIONS[algorithm]
+    except KeyError:
+        raise ValueError(
+            'unknown or unavailable url fingerprint algorithm: {}'.format(algorithm))
+
+
+def fingerprint_url(url, algorithm=None):
+    return get_fingerprint_function(algorithm)(url.encode('utf-8'))
+
+
+def fingerprint_urls(urls, algorithm=None):
+    fingerprint = get_fingerprint_function(algorithm)
+    return [fingerprint(url.encode('utf-8')) for url in urls]
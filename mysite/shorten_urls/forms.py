@@ -1,6 +1,7 @@
 from django import forms
 
-from .configs import SHORT_URL_MAX_LEN
+from .configs import (BULK_SHORT_URL_MAX_SIZE, CLICK_STATS_DEFAULT_HOURS,
+                      CLICK_STATS_MAX_HOURS, SHORT_URL_MAX_LEN)
 from .logics import decode_short_url
 
 
@@ -9,6 +10,38 @@ class ShortUrlForm(forms.Form):
     url_input = forms.URLField()
 
 
+class ShortUrlBulkForm(forms.Form):
+
+    urls = forms.Field()
+
+    def clean_urls(self):
+        urls = self.cleaned_data['urls']
+
+        if not isinstance(urls, list):
+            raise forms.ValidationError('urls should be a list')
+        elif len(urls) > BULK_SHORT_URL_MAX_SIZE:
+            raise forms.ValidationError(
+                'urls should have at most {} items, not {}'.format(
+                    BULK_SHORT_URL_MAX_SIZE, len(urls))
+            )
+
+        url_field = forms.URLField()
+        cleaned_urls = []
+        errors = []
+        for index, url in enumerate(urls):
+            try:
+                if not isinstance(url, str):
+                    raise forms.ValidationError('invalid url')
+                cleaned_urls.append(url_field.clean(url))
+            except forms.ValidationError:
+                errors.append('invalid url at index {}'.format(index))
+
+        if errors:
+            raise forms.ValidationError(errors)
+
+        return cleaned_urls
+
+
 class UrlPreviewForm(forms.Form):
 
     url_input = forms.URLField()
@@ -31,3 +64,12 @@ class GetOriginalUrlForm(forms.Form):
             )
 
         return short_url
+
+
+class ClickStatsForm(GetOriginalUrlForm):
+
+    hours = forms.IntegerField(
+        min_value=1, max_value=CLICK_STATS_MAX_HOURS, required=False)
+
+    def clean_hours(self):
+        return self.cleaned_data['hours'] or CLICK_STATS_DEFAULT_HOURS
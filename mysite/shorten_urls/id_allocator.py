@@ -0,0 +1,39 @@
+import os
+import threading
+
+
+class IdBlockAllocator:
+
+    def __init__(self, reserve_block, block_size):
+        self.reserve_block = reserve_block
+        self.block_size = block_size
+
+        self._next_id = 0
+        self._end_id = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def allocate(self, count=1):
+        ids = []
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # a forked worker must not hand out its parent's block
+                self._next_id = self._end_id = 0
+                self._pid = os.getpid()
+
+            while len(ids) < count:
+                if self._next_id >= self._end_id:
+                    size = max(self.block_size, count - len(ids))
+                    self._next_id = self.reserve_block(size)
+                    self._end_id = self._next_id + size
+
+                taken = min(count - len(ids), self._end_id - self._next_id)
+                ids.extend(range(self._next_id, self._next_id + taken))
+                self._next_id += taken
+
+        return ids
+
+    def reset(self):
+        with self._lock:
+            self._next_id = self._end_id = 0
@@ -1,22 +1,50 @@
-import hashlib
-
+import threading
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
 from django.utils import timezone
 
-from .configs import (CRAWL_URL_PREVIEW_TIMEOUT, SHORT_URL_MAX_LEN,
-                      URL_B62_BASE_NUM, URL_B62_OFFSET_SIZE)
-from .models import ShortUrl, UrlPreviewData, get_hashed_url_from_original_url
-from .utils import UrlPreview, b62_decode, b62_encode
+from .configs import (BULK_SHORT_URL_QUERY_BATCH_SIZE, CACHE_WARM_CHUNK_SIZE,
+                      CRAWL_URL_PREVIEW_TIMEOUT, PREVIEW_CACHE_TIMEOUT,
+                      PREVIEW_CRAWL_MAX_ATTEMPTS, PREVIEW_CRAWL_RETRY_INTERVAL,
+                      PREVIEW_CRAWL_TASK_TIMEOUT, PREVIEW_URL_REDIS_PREFIX,
+                      REDIRECT_CACHE_TIMEOUT, REDIRECT_URL_REDIS_PREFIX,
+                      SHORT_URL_MAX_LEN, URL_B62_BASE_NUM, URL_B62_OFFSET_SIZE,
+                      URL_PREVIEW_DATA_EXPIRE_DAYS)
+from .metrics import COMPONENT_CRAWL, timed
+from .models import (ClickStats, ShortUrl, UrlPreviewCrawlTask, UrlPreviewData,
+                     get_hashed_url_from_original_url,
+                     get_hashed_urls_from_original_urls, get_random_offset)
+from .replicas import replica_selector
+from .sharding import (get_shard_aliases, get_shard_for_hashed_url,
+                       get_shard_for_id)
+from .single_flight import get_cache_timeout, make_cache_entry
+from .utils import (UrlPreviewFetcher, b62_decode, b62_encode,
+                    canonicalize_url, get_url_preview_class)
+
+
+def forget_cached_redirects(short_url_paths):
+    """
+    Drop the cached redirects of newly created short urls. Their ids come
+    from blocks reserved ahead, so a code can be looked up, and cached as
+    not found, before its row exists.
+    """
+    if settings.ENABLE_CACHE:
+        cache.delete_many([
+            REDIRECT_URL_REDIS_PREFIX + short_url_path for short_url_path in short_url_paths
+        ])
 
 
 class ShortUrlLogics:
 
-    def __init__(self, url, hash_algo=None, *args, **kwargs):
+    def __init__(self, url, fingerprint_algorithm=None, *args, **kwargs):
         self.url = url
-
-        if hash_algo is None:
-            hash_algo = hashlib.sha256()
-
-        self.hash_algo = hash_algo
+        self.canonical_url = canonicalize_url(url)
+        self.fingerprint_algorithm = fingerprint_algorithm
 
     def get_short_url_info(self):
         short_url_object = self.get_or_create_short_url()
@@ -26,29 +54,143 @@ class ShortUrlLogics:
         }
 
     def get_or_create_short_url(self):
-        hashed_url = get_hashed_url_from_original_url(self.url, self.hash_algo)
-        qs = ShortUrl.objects.filter(hashed_url=hashed_url)
+        # urls are deduplicated on their canonical form, so variants of a
+        # url share one row that keeps the first variant as original_url
+        hashed_url = get_hashed_url_from_original_url(
+            self.canonical_url, self.fingerprint_algorithm)
+        shard = get_shard_for_hashed_url(hashed_url)
 
-        if not qs.exists():
-            short_url_object = ShortUrl.objects.create(
-                original_url=self.url,
-                hashed_url=hashed_url,
-            )
-        elif qs.count() > 1:
-            short_url_object = qs.get(original_url=self.url)
+        short_url_object = ShortUrl.objects.using(shard).filter(
+            hashed_url=hashed_url, canonical_url=self.canonical_url).first()
+        if short_url_object:
+            return short_url_object
+
+        # the id is reserved before the transaction so that a rollback
+        # cannot undo the block reservation
+        id = ShortUrl.objects.allocate_ids(using=shard)[0]
+
+        try:
+            with transaction.atomic(using=shard):
+                short_url_object = ShortUrl.objects.create(
+                    id=id,
+                    original_url=self.url,
+                    hashed_url=hashed_url,
+                    canonical_url=self.canonical_url,
+                )
+        except IntegrityError:
+            # a concurrent request inserted the same url first
+            short_url_object = ShortUrl.objects.using(shard).get(
+                canonical_url=self.canonical_url)
         else:
-            short_url_object = qs[0]
+            forget_cached_redirects([short_url_object.short_url_path])
 
         return short_url_object
 
 
+class ShortUrlBulkLogics:
+
+    def __init__(self, urls, batch_size=BULK_SHORT_URL_QUERY_BATCH_SIZE):
+        self.urls = urls
+        self.batch_size = batch_size
+
+    def get_short_url_infos(self):
+        short_url_objects = self.get_or_create_short_urls()
+        return [
+            {
+                'short_url_path': short_url_objects[url].short_url_path,
+                'original_url': url,
+            }
+            for url in self.urls
+        ]
+
+    def get_or_create_short_urls(self):
+        canonical_urls = {url: canonicalize_url(url) for url in self.urls}
+
+        # the first url of each canonical form becomes its original_url
+        original_urls = {}
+        for url, canonical_url in canonical_urls.items():
+            original_urls.setdefault(canonical_url, url)
+
+        hashed_urls = dict(zip(
+            original_urls, get_hashed_urls_from_original_urls(list(original_urls))))
+
+        short_url_objects = self._get_existing_short_urls(hashed_urls)
+
+        missing_urls = [url for url in hashed_urls if url not in short_url_objects]
+        if missing_urls:
+            missing_hashed_urls = {url: hashed_urls[url] for url in missing_urls}
+            short_url_objects.update(
+                self._create_short_urls(missing_hashed_urls, original_urls))
+
+        return {
+            url: short_url_objects[canonical_url]
+            for url, canonical_url in canonical_urls.items()
+        }
+
+    def _get_existing_short_urls(self, hashed_urls):
+        hashes_by_shard = {}
+        for hashed_url in set(hashed_urls.values()):
+            hashes_by_shard.setdefault(
+                get_shard_for_hashed_url(hashed_url), []).append(hashed_url)
+
+        short_url_objects = {}
+        for shard, hashes in hashes_by_shard.items():
+            for start in range(0, len(hashes), self.batch_size):
+                qs = ShortUrl.objects.using(shard).filter(
+                    hashed_url__in=hashes[start:start + self.batch_size])
+
+                # hash collisions are resolved by matching the full url
+                for short_url_object in qs:
+                    if short_url_object.canonical_url in hashed_urls:
+                        short_url_objects[short_url_object.canonical_url] = short_url_object
+
+        return short_url_objects
+
+    def _create_short_urls(self, hashed_urls, original_urls):
+        short_url_objects = [
+            ShortUrl(
+                original_url=original_urls[canonical_url],
+                canonical_url=canonical_url,
+                hashed_url=hashed_url,
+                random_offset=get_random_offset(),
+            )
+            for canonical_url, hashed_url in hashed_urls.items()
+        ]
+        objs_by_shard = ShortUrl.objects.assign_short_url_paths(short_url_objects)
+
+        created_objects = {}
+        for shard, shard_objs in objs_by_shard.items():
+            try:
+                with transaction.atomic(using=shard):
+                    ShortUrl.objects.using(shard).bulk_create(
+                        shard_objs, batch_size=self.batch_size)
+            except IntegrityError:
+                # a concurrent request inserted some of these urls first
+                shard_objs = [
+                    ShortUrlLogics(obj.original_url).get_or_create_short_url()
+                    for obj in shard_objs
+                ]
+            else:
+                forget_cached_redirects([obj.short_url_path for obj in shard_objs])
+
+            for short_url_object in shard_objs:
+                created_objects[short_url_object.canonical_url] = short_url_object
+
+        return created_objects
+
+
 class UrlPreviewDataLogic:
 
-    def __init__(self, url):
+    def __init__(self, url, short_url_object=None):
         self.url = url
 
-        short_url_logic = ShortUrlLogics(self.url)
-        self.short_url_object = short_url_logic.get_or_create_short_url()
+        if short_url_object is None:
+            short_url_logic = ShortUrlLogics(self.url)
+            short_url_object = short_url_logic.get_or_create_short_url()
+
+        self.short_url_object = short_url_object
+        # preview rows live on the shard of their short url
+        self.db = short_url_object._state.db
 
     def get_url_preview_data_info(self):
         preview_data = self.get_or_create_url_preview_data()
@@ -57,6 +199,24 @@ class UrlPreviewDataLogic:
 
         return {}
 
+    def get_or_enqueue_url_preview_data_info(self):
+        try:
+            preview_data = self.short_url_object.preview_data
+        except UrlPreviewData.DoesNotExist:
+            preview_data = None
+
+        if preview_data:
+            if preview_data.is_expired:
+                UrlPreviewCrawlQueue().enqueue(self.short_url_object, refresh=True)
+
+            return UrlPreviewCrawlTask.STATUS_DONE, preview_data.as_dict()
+
+        task = UrlPreviewCrawlQueue().enqueue(self.short_url_object)
+        if task.status == UrlPreviewCrawlTask.STATUS_FAILED:
+            return UrlPreviewCrawlTask.STATUS_FAILED, {}
+
+        return UrlPreviewCrawlTask.STATUS_PENDING, {}
+
     def get_or_create_url_preview_data(self):
         short_url_object = self.short_url_object
         try:
@@ -64,17 +224,26 @@ class UrlPreviewDataLogic:
         except UrlPreviewData.DoesNotExist:
             preview_data = self.create_url_preview_data()
         else:
-            if preview_data.last_update - timezone.now() > timezone.timedelta(days=1):
+            if preview_data.is_expired:
                 preview_data = self.update_url_preview_data()
 
         return preview_data
 
-    def update_url_preview_data(self):
-        preview_data = self.get_url_preview_data()
+    def save_url_preview_data(self, preview_data):
+        if UrlPreviewData.objects.using(self.db).filter(
+                from_url=self.short_url_object).exists():
+            return self.update_url_preview_data(preview_data)
+
+        return self.create_url_preview_data(preview_data)
+
+    def update_url_preview_data(self, preview_data=None):
+        if preview_data is None:
+            preview_data = self.get_url_preview_data()
+
         if not preview_data:
             return None
 
-        url_preview_data = UrlPreviewData.objects.get(
+        url_preview_data = UrlPreviewData.objects.using(self.db).get(
             from_url=self.short_url_object)
 
         url_preview_data.title = preview_data['title']
@@ -85,13 +254,14 @@ class UrlPreviewDataLogic:
         url_preview_data.save()
         return url_preview_data
 
-    def create_url_preview_data(self):
-        preview_data = self.get_url_preview_data()
+    def create_url_preview_data(self, preview_data=None):
+        if preview_data is None:
+            preview_data = self.get_url_preview_data()
 
         if not preview_data:
             return None
 
-        url_preview_data = UrlPreviewData.objects.create(
+        url_preview_data = UrlPreviewData.objects.using(self.db).create(
             from_url=self.short_url_object,
             title=preview_data['title'],
             description=preview_data['description'],
@@ -101,8 +271,10 @@ class UrlPreviewDataLogic:
         return url_preview_data
 
     def get_url_preview_data(self):
-        preview = UrlPreview(self.url, timeout=CRAWL_URL_PREVIEW_TIMEOUT)
-        preview.fire()
+        preview_class = get_url_preview_class()
+        preview = preview_class(self.url, timeout=CRAWL_URL_PREVIEW_TIMEOUT)
+        with timed(COMPONENT_CRAWL):
+            preview.fire()
 
         preview_data = {}
         if preview.success:
@@ -111,6 +283,235 @@ class UrlPreviewDataLogic:
         return preview_data
 
 
+class UrlPreviewCrawlQueue:
+
+    def __init__(self, task_timeout=PREVIEW_CRAWL_TASK_TIMEOUT,
+                 max_attempts=PREVIEW_CRAWL_MAX_ATTEMPTS,
+                 retry_interval=PREVIEW_CRAWL_RETRY_INTERVAL,
+                 preview_fetcher=None):
+        self.task_timeout = task_timeout
+        self.max_attempts = max_attempts
+        self.retry_interval = retry_interval
+        self._preview_fetcher = preview_fetcher
+
+    @property
+    def preview_fetcher(self):
+        if self._preview_fetcher is None:
+            self._preview_fetcher = UrlPreviewFetcher()
+
+        return self._preview_fetcher
+
+    def enqueue(self, short_url_object, refresh=False):
+        db = short_url_object._state.db
+        task, created = UrlPreviewCrawlTask.objects.using(db).get_or_create(
+            from_url=short_url_object)
+        if created:
+            return task
+
+        retry_after = timezone.now() - timezone.timedelta(seconds=self.retry_interval)
+        requeue = (
+            (task.status == UrlPreviewCrawlTask.STATUS_DONE and refresh) or
+            (task.status == UrlPreviewCrawlTask.STATUS_FAILED and task.last_update < retry_after)
+        )
+
+        if requeue:
+            updated = UrlPreviewCrawlTask.objects.using(db).filter(
+                id=task.id, status=task.status
+            ).update(
+                status=UrlPreviewCrawlTask.STATUS_PENDING, attempts=0,
+                last_update=timezone.now())
+
+            if updated:
+                task.status = UrlPreviewCrawlTask.STATUS_PENDING
+                task.attempts = 0
+
+        return task
+
+    def _claimable_tasks(self, using):
+        expired = timezone.now() - timezone.timedelta(seconds=self.task_timeout)
+
+        # running tasks whose worker died are handed out again
+        return UrlPreviewCrawlTask.objects.using(using).filter(
+            Q(status=UrlPreviewCrawlTask.STATUS_PENDING) |
+            Q(status=UrlPreviewCrawlTask.STATUS_RUNNING, last_update__lt=expired)
+        )
+
+    def claim(self, batch_size, using=None):
+        if using is None:
+            # each shard keeps its own queue
+            tasks = []
+            for shard in get_shard_aliases():
+                tasks.extend(self.claim(batch_size - len(tasks), using=shard))
+                if len(tasks) >= batch_size:
+                    break
+
+            return tasks
+
+        task_ids = list(
+            self._claimable_tasks(using).order_by('id').values_list('id', flat=True)[:batch_size])
+
+        # a conditional update per task keeps concurrent workers from
+        # claiming the same task without relying on row locks
+        claimed_ids = [
+            task_id for task_id in task_ids
+            if self._claimable_tasks(using).filter(id=task_id).update(
+                status=UrlPreviewCrawlTask.STATUS_RUNNING,
+                attempts=F('attempts') + 1,
+                last_update=timezone.now())
+        ]
+
+        return list(
+            UrlPreviewCrawlTask.objects.using(using).filter(
+                id__in=claimed_ids).select_related('from_url').order_by('id')
+        )
+
+    def process(self, task, preview_data):
+        short_url_object = task.from_url
+        logic = UrlPreviewDataLogic(
+            short_url_object.original_url, short_url_object=short_url_object)
+
+        if preview_data and logic.save_url_preview_data(preview_data):
+            status = UrlPreviewCrawlTask.STATUS_DONE
+        elif task.attempts >= self.max_attempts:
+            status = UrlPreviewCrawlTask.STATUS_FAILED
+        else:
+            status = UrlPreviewCrawlTask.STATUS_PENDING
+
+        UrlPreviewCrawlTask.objects.using(task._state.db).filter(id=task.id).update(
+            status=status, last_update=timezone.now())
+        task.status = status
+
+        return status
+
+    def run_once(self, batch_size):
+        tasks = self.claim(batch_size)
+        if not tasks:
+            return 0
+
+        # fetch the whole batch concurrently, then write results serially
+        # so the ORM stays on this thread's connection
+        previews = self.preview_fetcher.fetch_previews(
+            [task.from_url.original_url for task in tasks])
+
+        for task, preview_data in zip(tasks, previews):
+            self.process(task, preview_data)
+
+        return len(tasks)
+
+
+class ShortUrlIdRangeFilter:
+
+    def __init__(self, refresh_interval, margin=0):
+        self.refresh_interval = refresh_interval
+        self.margin = margin
+
+        self._max_id = 0
+        self._last_refresh = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        max_id = ShortUrl.objects.get_max_id()
+
+        with self._lock:
+            self._max_id = max(self._max_id, max_id)
+            self._last_refresh = time.monotonic()
+
+    def might_exist(self, url_id):
+        if url_id < 1:
+            return False
+        elif url_id <= self._max_id + self.margin:
+            return True
+
+        # ids beyond the known max may belong to rows created since the
+        # last refresh, so re-read it unless that happened very recently
+        last_refresh = self._last_refresh
+        if last_refresh is None or time.monotonic() - last_refresh >= self.refresh_interval:
+            self.refresh()
+
+        return url_id <= self._max_id + self.margin
+
+
+class CacheWarmer:
+    """
+    Refills the REDIRECT and GETPREVIEW keys straight from the database.
+
+    Rows are streamed per shard and written with one set_many per chunk,
+    as the entries single_flight.get_or_refresh reads; the warm_* methods
+    yield the number of keys written for each chunk.
+    """
+
+    def __init__(self, cache, chunk_size=CACHE_WARM_CHUNK_SIZE, top=None):
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.top = top
+
+        self._min_id = None
+
+    @property
+    def min_id(self):
+        # only the newest `top` short urls are warmed, so they are the
+        # ones at or above the top-th largest id over all shards
+        if self.top is None:
+            return None
+
+        if self._min_id is None:
+            ids = []
+            for shard in get_shard_aliases():
+                ids.extend(
+                    ShortUrl.objects.using(shard).order_by('-id').values_list(
+                        'id', flat=True)[:self.top])
+            ids.sort(reverse=True)
+            self._min_id = ids[:self.top][-1] if ids else 0
+
+        return self._min_id
+
+    def _set_many(self, items, timeout):
+        while True:
+            chunk = {
+                key: make_cache_entry(value, timeout)
+                for key, value in islice(items, self.chunk_size)
+            }
+            if not chunk:
+                break
+
+            self.cache.set_many(chunk, timeout=get_cache_timeout(timeout))
+            yield len(chunk)
+
+    def warm_redirects(self):
+        for shard in get_shard_aliases():
+            qs = ShortUrl.objects.using(shard)
+            if self.min_id is not None:
+                qs = qs.filter(id__gte=self.min_id)
+
+            rows = qs.values_list('short_url_path', 'original_url').iterator(
+                chunk_size=self.chunk_size)
+            yield from self._set_many((
+                (REDIRECT_URL_REDIS_PREFIX + short_url_path, original_url)
+                for short_url_path, original_url in rows
+            ), REDIRECT_CACHE_TIMEOUT)
+
+    def warm_previews(self):
+        expire_time = timezone.now() - timezone.timedelta(days=URL_PREVIEW_DATA_EXPIRE_DAYS)
+
+        for shard in get_shard_aliases():
+            qs = UrlPreviewData.objects.using(shard).filter(last_update__gte=expire_time)
+            if self.min_id is not None:
+                qs = qs.filter(from_url_id__gte=self.min_id)
+
+            rows = qs.values_list(
+                'from_url__original_url', 'title', 'description', 'url', 'image_url',
+            ).iterator(chunk_size=self.chunk_size)
+            yield from self._set_many((
+                (PREVIEW_URL_REDIS_PREFIX + original_url, {
+                    'title': title,
+                    'description': description,
+                    'url': url,
+                    'image_url': image_url,
+                })
+                for original_url, title, description, url, image_url in rows
+            ), PREVIEW_CACHE_TIMEOUT)
+
+
 def decode_short_url(short_url):
     if len(short_url) != SHORT_URL_MAX_LEN:
         raise ValueError(
@@ -121,3 +522,39 @@ def decode_short_url(short_url):
     raw_url_number = b62_decode(short_url)
     real_url_number = (raw_url_number - URL_B62_BASE_NUM) % URL_B62_OFFSET_SIZE
     return real_url_number
+
+
+def get_shard_for_short_url(short_url):
+    return get_shard_for_id(decode_short_url(short_url))
+
+
+def get_short_url_object_for_read(short_url, url_id=None):
+    if url_id is None:
+        url_id = decode_short_url(short_url)
+
+    primary = get_shard_for_id(url_id)
+    db = replica_selector.select(primary)
+
+    with replica_selector.reading(db):
+        short_url_object = ShortUrl.objects.using(db).filter(
+            short_url_path=short_url).first()
+
+    if short_url_object is None and db != primary:
+        # a code created moments ago may not have reached the replica yet
+        short_url_object = ShortUrl.objects.using(primary).filter(
+            short_url_path=short_url).first()
+
+    return short_url_object
+
+
+def get_click_stats(short_url, since):
+    # clicks still buffered in the web processes are not counted yet
+    primary = get_shard_for_short_url(short_url)
+    db = replica_selector.select(primary)
+
+    with replica_selector.reading(db):
+        return list(
+            ClickStats.objects.using(db).filter(
+                short_url_path=short_url, hour__gte=since,
+            ).order_by('hour').values_list('hour', 'clicks')
+        )
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from shorten_urls.configs import (REDIRECT_SNAPSHOT_CHUNK_SIZE,
+                                  REDIRECT_SNAPSHOT_DELTA_INTERVAL,
+                                  REDIRECT_SNAPSHOT_MAX_SEGMENTS)
+from shorten_urls.snapshot import (append_redirect_snapshot,
+                                   build_redirect_snapshot,
+                                   compact_redirect_snapshot, read_manifest)
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Export short urls into the memory-mapped redirect snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=None,
+            help='manifest file, defaults to settings.REDIRECT_SNAPSHOT_PATH')
+        parser.add_argument(
+            '--chunk-size', type=int, default=REDIRECT_SNAPSHOT_CHUNK_SIZE,
+            help='rows read per query')
+
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument(
+            '--delta', action='store_true',
+            help='only append the short urls created since the last export')
+        mode.add_argument(
+            '--compact', action='store_true',
+            help='merge the segments into one')
+        mode.add_argument(
+            '--follow', action='store_true',
+            help='keep appending deltas and compact in the background')
+
+        parser.add_argument(
+            '--interval', type=float, default=REDIRECT_SNAPSHOT_DELTA_INTERVAL,
+            help='seconds between deltas with --follow')
+
+    def handle(self, *args, **options):
+        path = options['output'] or getattr(settings, 'REDIRECT_SNAPSHOT_PATH', None)
+        if not path:
+            raise CommandError('set REDIRECT_SNAPSHOT_PATH or pass --output')
+
+        chunk_size = options['chunk_size']
+        start = time.perf_counter()
+
+        if options['compact']:
+            merged = compact_redirect_snapshot(path, chunk_size)
+            self.stdout.write('compacted {} segments in {:.1f}s'.format(
+                merged, time.perf_counter() - start))
+        elif options['delta']:
+            count = append_redirect_snapshot(path, chunk_size)
+            self.stdout.write('appended {} short urls to {} in {:.1f}s'.format(
+                count, path, time.perf_counter() - start))
+        elif options['follow']:
+            self.follow(path, chunk_size, options['interval'])
+        else:
+            count = build_redirect_snapshot(path, chunk_size)
+            self.stdout.write('wrote {} short urls to {} in {:.1f}s'.format(
+                count, path, time.perf_counter() - start))
+
+    def follow(self, path, chunk_size, interval):
+        compaction = None
+
+        while True:
+            try:
+                compaction = self.follow_once(path, chunk_size, compaction)
+            except Exception:
+                # e.g. the database went away, the next round tries again
+                logger.exception('Failed to append to the redirect snapshot %s', path)
+                close_old_connections()
+
+            time.sleep(interval)
+
+    def follow_once(self, path, chunk_size, compaction):
+        count = append_redirect_snapshot(path, chunk_size)
+        if count:
+            self.stdout.write('appended {} short urls'.format(count))
+
+        # merging large segments takes a while, deltas go on meanwhile
+        manifest = read_manifest(path)
+        segments = len(manifest['segments']) if manifest else 0
+        if segments > REDIRECT_SNAPSHOT_MAX_SEGMENTS and not (
+                compaction and compaction.is_alive()):
+            compaction = threading.Thread(
+                target=self.compact, args=(path, chunk_size), daemon=True)
+            compaction.start()
+
+        return compaction
+
+    def compact(self, path, chunk_size):
+        try:
+            compact_redirect_snapshot(path, chunk_size)
+        except Exception:
+            logger.exception('Failed to compact the redirect snapshot %s', path)
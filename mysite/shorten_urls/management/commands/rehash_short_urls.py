@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shorten_urls.models import ShortUrl, get_hashed_urls_from_original_urls
+from shorten_urls.sharding import get_shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Recompute hashed urls after changing URL_FINGERPRINT_ALGORITHM'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='rows read and updated per round')
+
+    def handle(self, *args, **options):
+        shards = get_shard_aliases()
+        if len(shards) > 1:
+            # the hash decides the shard of a row, so rows would have to move
+            raise CommandError('rehashing is only supported with a single shard')
+
+        qs = ShortUrl.objects.using(shards[0])
+
+        last_id = 0
+        updated = 0
+        while True:
+            objs = list(
+                qs.filter(id__gt=last_id).order_by('id').only(
+                    'id', 'original_url', 'canonical_url', 'hashed_url')[:options['batch_size']]
+            )
+            if not objs:
+                break
+
+            hashed_urls = get_hashed_urls_from_original_urls(
+                [obj.canonical_url or obj.original_url for obj in objs])
+
+            changed_objs = []
+            for obj, hashed_url in zip(objs, hashed_urls):
+                if obj.hashed_url != hashed_url:
+                    obj.hashed_url = hashed_url
+                    changed_objs.append(obj)
+
+            qs.bulk_update(changed_objs, ['hashed_url'])
+            updated += len(changed_objs)
+            last_id = objs[-1].id
+
+        self.stdout.write('rehashed {} short urls'.format(updated))
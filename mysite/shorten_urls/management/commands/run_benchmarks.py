@@ -0,0 +1,67 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from shorten_urls.benchmarks import (compare_results, get_environment,
+                                     run_db_benchmarks, run_load_benchmarks,
+                                     run_micro_benchmarks)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the codec, create and redirect paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, nargs='+', default=[1000000],
+            help='table sizes for the DB and load benchmarks')
+        parser.add_argument(
+            '--number', type=int, default=10000,
+            help='calls per micro and DB benchmark')
+        parser.add_argument(
+            '--requests', type=int, default=2000,
+            help='requests per load benchmark')
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='client threads for the load benchmarks')
+        parser.add_argument('--skip-db', action='store_true')
+        parser.add_argument('--skip-load', action='store_true')
+        parser.add_argument(
+            '--output', help='write the results as JSON to this path')
+        parser.add_argument(
+            '--compare', help='JSON results of a previous run to compare with')
+
+    def handle(self, *args, **options):
+        results = {
+            'environment': get_environment(),
+            'micro': run_micro_benchmarks(options['number']),
+        }
+
+        rows = sorted(options['rows'])
+
+        if not options['skip_db']:
+            results['db'] = {}
+            for row_count in rows:
+                db_results = run_db_benchmarks(
+                    row_count, options['number'], stdout=self.stdout)
+                for name, result in db_results.items():
+                    results['db']['{}@{}'.format(name, row_count)] = result
+
+        if not options['skip_load']:
+            results['load'] = run_load_benchmarks(
+                rows[-1], options['requests'], options['concurrency'])
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        self.stdout.write(output)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)
+
+            results.pop('environment')
+            changes = compare_results(previous, results)
+            for name, change in sorted(changes.items()):
+                self.stdout.write('{}: {:+.2f}% ops/sec'.format(name, change))
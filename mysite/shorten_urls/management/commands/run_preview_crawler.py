@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shorten_urls.configs import (PREVIEW_CRAWL_BATCH_SIZE,
+                                  PREVIEW_CRAWL_POLL_INTERVAL)
+from shorten_urls.logics import UrlPreviewCrawlQueue
+
+
+class Command(BaseCommand):
+    help = 'Crawl queued url previews in the background'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=PREVIEW_CRAWL_BATCH_SIZE,
+            help='number of tasks claimed per round')
+        parser.add_argument(
+            '--poll-interval', type=float, default=PREVIEW_CRAWL_POLL_INTERVAL,
+            help='seconds to sleep when the queue is empty')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='process a single batch and exit')
+
+    def handle(self, *args, **options):
+        queue = UrlPreviewCrawlQueue()
+
+        while True:
+            processed = queue.run_once(options['batch_size'])
+
+            if processed:
+                self.stdout.write('crawled {} previews'.format(processed))
+
+            if options['once']:
+                break
+
+            if not processed:
+                time.sleep(options['poll_interval'])
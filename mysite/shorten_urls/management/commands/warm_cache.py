@@ -0,0 +1,44 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from shorten_urls.configs import CACHE_WARM_CHUNK_SIZE
+from shorten_urls.logics import CacheWarmer
+
+
+class Command(BaseCommand):
+    help = 'Fill the redirect and preview caches from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=CACHE_WARM_CHUNK_SIZE,
+            help='rows read and keys written per round')
+        parser.add_argument(
+            '--top', type=int, default=None,
+            help='only warm the newest N short urls')
+        parser.add_argument(
+            '--skip-previews', action='store_true',
+            help='only warm redirects')
+
+    def handle(self, *args, **options):
+        if options['top'] is not None and options['top'] < 1:
+            raise CommandError('--top should be a positive number')
+
+        warmer = CacheWarmer(cache, chunk_size=options['chunk_size'], top=options['top'])
+
+        self.warm('redirect', warmer.warm_redirects())
+        if not options['skip_previews']:
+            self.warm('preview', warmer.warm_previews())
+
+    def warm(self, name, chunks):
+        start = time.perf_counter()
+        total = 0
+
+        for count in chunks:
+            total += count
+            elapsed = time.perf_counter() - start
+            self.stdout.write('warmed {} {} keys ({:.0f} keys/s)'.format(
+                total, name, total / elapsed if elapsed else 0))
+
+        self.stdout.write('warmed {} {} keys'.format(total, name))
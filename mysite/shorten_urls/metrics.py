@@ -0,0 +1,192 @@
+import bisect
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+
+from .configs import METRICS_LATENCY_BUCKETS
+
+METRICS_PREFIX = 'shorten_urls'
+
+COMPONENT_TOTAL = 'total'
+COMPONENT_CACHE = 'cache'
+COMPONENT_DB = 'db'
+COMPONENT_CRAWL = 'crawl'
+
+BACKGROUND_VIEW = 'background'
+
+_current_timings = ContextVar('shorten_urls_request_timings', default=None)
+
+
+class Histogram:
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+class MetricsRegistry:
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._db_queries = {}
+
+    def observe(self, view, component, seconds):
+        key = (view, component)
+
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def observe_request(self, view, total, timings):
+        self.observe(view, COMPONENT_TOTAL, total)
+        for component, seconds in timings.durations.items():
+            self.observe(view, component, seconds)
+
+        with self._lock:
+            self._db_queries[view] = self._db_queries.get(view, 0) + timings.db_queries
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._db_queries.clear()
+
+    def render_prometheus(self):
+        name = '{}_duration_seconds'.format(METRICS_PREFIX)
+        lines = [
+            '# HELP {} Time spent per view and component.'.format(name),
+            '# TYPE {} histogram'.format(name),
+        ]
+
+        with self._lock:
+            for (view, component), histogram in sorted(self._histograms.items()):
+                labels = 'view="{}",component="{}"'.format(view, component)
+
+                bounds = [repr(float(bucket)) for bucket in histogram.buckets] + ['+Inf']
+                for bound, count in zip(bounds, histogram.cumulative_counts()):
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, count))
+
+                lines.append('{}_sum{{{}}} {}'.format(name, labels, repr(histogram.sum)))
+                lines.append('{}_count{{{}}} {}'.format(name, labels, histogram.count))
+
+            queries_name = '{}_db_queries_total'.format(METRICS_PREFIX)
+            lines.append('# HELP {} DB queries executed per view.'.format(queries_name))
+            lines.append('# TYPE {} counter'.format(queries_name))
+            for view, count in sorted(self._db_queries.items()):
+                lines.append('{}{{view="{}"}} {}'.format(queries_name, view, count))
+
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTimings:
+
+    def __init__(self):
+        self.durations = {}
+        self.db_queries = 0
+
+    def add(self, component, seconds):
+        self.durations[component] = self.durations.get(component, 0.0) + seconds
+
+    def db_execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add(COMPONENT_DB, time.perf_counter() - start)
+            self.db_queries += 1
+
+    def server_timing(self, total):
+        entries = []
+        for component in (COMPONENT_CACHE, COMPONENT_DB, COMPONENT_CRAWL):
+            if component not in self.durations:
+                continue
+
+            entry = '{};dur={:.3f}'.format(component, self.durations[component] * 1000)
+            if component == COMPONENT_DB:
+                entry += ';desc="{} queries"'.format(self.db_queries)
+            entries.append(entry)
+
+        entries.append('{};dur={:.3f}'.format(COMPONENT_TOTAL, total * 1000))
+        return ', '.join(entries)
+
+
+def start_request_timings():
+    timings = RequestTimings()
+    return timings, _current_timings.set(timings)
+
+
+def end_request_timings(token):
+    _current_timings.reset(token)
+
+
+@contextmanager
+def timed(component):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(component, seconds)
+        else:
+            # outside a request, e.g. in the preview crawler
+            registry.observe(BACKGROUND_VIEW, component, seconds)
+
+
+@contextmanager
+def timed_queries():
+    # connections belong to a thread, so code running the ORM in a worker
+    # thread has to hook its own connections into the request timings
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timings.db_execute_wrapper))
+
+        yield
+
+
+class TimedCache:
+
+    def __init__(self, cache, component=COMPONENT_CACHE):
+        self._cache = cache
+        self._component = component
+
+    def __getattr__(self, name):
+        attr = getattr(self._cache, name)
+        if not callable(attr):
+            return attr
+
+        def timed_call(*args, **kwargs):
+            with timed(self._component):
+                return attr(*args, **kwargs)
+
+        return timed_call
+
+
+registry = MetricsRegistry()
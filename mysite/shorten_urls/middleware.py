@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+from django.conf import settings
+
+from .configs import METRICS_VIEWS
+from .metrics import (end_request_timings, registry, start_request_timings,
+                      timed_queries)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        if asyncio.iscoroutinefunction(get_response):
+            # lets Django await this middleware instead of running it in a
+            # thread under ASGI
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        timings, token = start_request_timings()
+        start = time.perf_counter()
+
+        try:
+            with timed_queries():
+                response = self.get_response(request)
+        finally:
+            end_request_timings(token)
+
+        return self.observe(request, response, timings, start)
+
+    async def __acall__(self, request):
+        timings, token = start_request_timings()
+        start = time.perf_counter()
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request_timings(token)
+
+        return self.observe(request, response, timings, start)
+
+    def observe(self, request, response, timings, start):
+        view_name = self.get_view_name(request)
+        if view_name:
+            total = time.perf_counter() - start
+            registry.observe_request(view_name, total, timings)
+
+            if settings.ENABLE_SERVER_TIMING:
+                response['Server-Timing'] = timings.server_timing(total)
+
+        return response
+
+    def get_view_name(self, request):
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is None:
+            return None
+
+        view_class = getattr(resolver_match.func, 'view_class', None)
+        view_name = view_class.__name__ if view_class else resolver_match.func.__name__
+
+        return view_name if view_name in METRICS_VIEWS else None
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shorten_urls', '0005_urlpreviewdata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UrlPreviewCrawlTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='pending', max_length=16)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_update', models.DateTimeField(auto_now=True)),
+                ('from_url', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='crawl_task', to='shorten_urls.ShortUrl')),
+            ],
+        ),
+    ]
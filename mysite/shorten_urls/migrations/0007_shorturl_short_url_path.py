@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:57
+
+from django.db import migrations, models
+
+BATCH_SIZE = 10000
+
+
+def fill_short_url_paths(apps, schema_editor):
+    from shorten_urls.configs import URL_B62_BASE_NUM, URL_B62_OFFSET_SIZE
+    from shorten_urls.utils import b62_encode_many
+
+    ShortUrl = apps.get_model('shorten_urls', 'ShortUrl')
+    db_alias = schema_editor.connection.alias
+
+    last_id = 0
+    while True:
+        objs = list(
+            ShortUrl.objects.using(db_alias).filter(
+                id__gt=last_id, short_url_path__isnull=True
+            ).order_by('id').only('id', 'random_offset')[:BATCH_SIZE]
+        )
+        if not objs:
+            break
+
+        short_url_paths = b62_encode_many([
+            obj.id + URL_B62_BASE_NUM + URL_B62_OFFSET_SIZE * obj.random_offset
+            for obj in objs
+        ])
+        for obj, short_url_path in zip(objs, short_url_paths):
+            obj.short_url_path = short_url_path
+
+        ShortUrl.objects.using(db_alias).bulk_update(objs, ['short_url_path'])
+        last_id = objs[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shorten_urls', '0006_urlpreviewcrawltask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shorturl',
+            name='short_url_path',
+            field=models.CharField(max_length=5, null=True, unique=True),
+        ),
+        migrations.RunPython(fill_short_url_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:59
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def create_short_url_counter(apps, schema_editor):
+    ShortUrl = apps.get_model('shorten_urls', 'ShortUrl')
+    IdBlockCounter = apps.get_model('shorten_urls', 'IdBlockCounter')
+    db_alias = schema_editor.connection.alias
+
+    max_id = ShortUrl.objects.using(db_alias).aggregate(max_id=Max('id'))['max_id']
+    IdBlockCounter.objects.using(db_alias).create(
+        name='shorten_urls.shorturl', next_id=(max_id or 0) + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shorten_urls', '0007_shorturl_short_url_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdBlockCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('next_id', models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(create_short_url_counter, migrations.RunPython.noop),
+    ]
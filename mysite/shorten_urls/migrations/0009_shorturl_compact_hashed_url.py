@@ -0,0 +1,60 @@
+from django.db import migrations, models
+
+BATCH_SIZE = 10000
+
+
+def convert_hashed_urls(apps, schema_editor):
+    from shorten_urls.configs import HASHED_URL_BYTES
+
+    ShortUrl = apps.get_model('shorten_urls', 'ShortUrl')
+    db_alias = schema_editor.connection.alias
+
+    last_id = 0
+    while True:
+        objs = list(
+            ShortUrl.objects.using(db_alias).filter(
+                id__gt=last_id
+            ).order_by('id').only('id', 'hashed_url')[:BATCH_SIZE]
+        )
+        if not objs:
+            break
+
+        # the old value is a hex prefix of the same sha256 digest, so its
+        # leading bytes give the same fingerprint as new rows
+        for obj in objs:
+            obj.compact_hashed_url = int.from_bytes(
+                bytes.fromhex(obj.hashed_url[:HASHED_URL_BYTES * 2]), 'big', signed=True)
+
+        ShortUrl.objects.using(db_alias).bulk_update(objs, ['compact_hashed_url'])
+        last_id = objs[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shorten_urls', '0008_idblockcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shorturl',
+            name='compact_hashed_url',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunPython(convert_hashed_urls, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='shorturl',
+            name='hashed_url',
+        ),
+        migrations.RenameField(
+            model_name='shorturl',
+            old_name='compact_hashed_url',
+            new_name='hashed_url',
+        ),
+        # the index is built once, after the rows are converted
+        migrations.AlterField(
+            model_name='shorturl',
+            name='hashed_url',
+            field=models.BigIntegerField(db_index=True),
+        ),
+    ]
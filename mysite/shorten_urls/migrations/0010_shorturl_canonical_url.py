@@ -0,0 +1,71 @@
+from django.db import migrations, models
+
+BATCH_SIZE = 10000
+
+
+def fill_canonical_urls(apps, schema_editor):
+    from shorten_urls.fingerprints import fingerprint_urls
+    from shorten_urls.sharding import get_shard_for_hashed_url
+    from shorten_urls.utils import canonicalize_url
+
+    ShortUrl = apps.get_model('shorten_urls', 'ShortUrl')
+    db_alias = schema_editor.connection.alias
+    qs = ShortUrl.objects.using(db_alias)
+
+    last_id = 0
+    while True:
+        objs = list(
+            qs.filter(id__gt=last_id).order_by('id').only(
+                'id', 'original_url', 'canonical_url', 'hashed_url')[:BATCH_SIZE]
+        )
+        if not objs:
+            break
+
+        canonical_urls = [canonicalize_url(obj.original_url) for obj in objs]
+        taken_urls = set(
+            qs.filter(canonical_url__in=set(canonical_urls)).values_list(
+                'canonical_url', flat=True)
+        )
+
+        # when several existing rows share a canonical form the oldest one
+        # becomes the dedup target; the others keep redirecting as before
+        changed_objs = []
+        for obj, canonical_url in zip(objs, canonical_urls):
+            if canonical_url in taken_urls:
+                continue
+
+            taken_urls.add(canonical_url)
+            obj.canonical_url = canonical_url
+            changed_objs.append(obj)
+
+        # the hash decides the shard of a row, a row whose new hash belongs
+        # to another shard keeps the old one instead of becoming unreachable
+        # by hash; it is then not matched again by its canonical url
+        hashed_urls = fingerprint_urls([obj.canonical_url for obj in changed_objs])
+        for obj, hashed_url in zip(changed_objs, hashed_urls):
+            if get_shard_for_hashed_url(hashed_url) == db_alias:
+                obj.hashed_url = hashed_url
+
+        qs.bulk_update(changed_objs, ['canonical_url', 'hashed_url'])
+        last_id = objs[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shorten_urls', '0009_shorturl_compact_hashed_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shorturl',
+            name='canonical_url',
+            field=models.TextField(null=True, unique=True),
+        ),
+        migrations.RunPython(fill_canonical_urls, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='shorturl',
+            name='original_url',
+            field=models.TextField(),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shorten_urls', '0010_shorturl_canonical_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('short_url_path', models.CharField(max_length=5)),
+                ('hour', models.DateTimeField()),
+                ('clicks', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'click stats',
+                'unique_together': {('short_url_path', 'hour')},
+            },
+        ),
+    ]
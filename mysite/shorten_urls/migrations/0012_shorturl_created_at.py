@@ -0,0 +1,24 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shorten_urls', '0011_clickstats'),
+    ]
+
+    operations = [
+        # added without a default first, so existing rows stay null instead
+        # of all getting the time of the migration
+        migrations.AddField(
+            model_name='shorturl',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='shorturl',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, null=True),
+        ),
+    ]
@@ -1,28 +1,143 @@
-import hashlib
 import random
+import threading
+from functools import partial
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Max
 from django.utils import timezone
 
-from .configs import (HASHED_URL_LENGTH, URL_B62_BASE_NUM,
-                      URL_B62_OFFSET_RANGE, URL_B62_OFFSET_SIZE)
-from .utils import b62_encode
+from .configs import (CLICK_FLUSH_BATCH_SIZE, SHORT_URL_ID_BLOCK_SIZE,
+                      SHORT_URL_MAX_LEN, URL_B62_BASE_NUM,
+                      URL_B62_OFFSET_RANGE, URL_B62_OFFSET_SIZE,
+                      URL_PREVIEW_DATA_EXPIRE_DAYS)
+from .fingerprints import fingerprint_url, fingerprint_urls
+from .id_allocator import IdBlockAllocator
+from .sharding import (get_shard_aliases, get_shard_for_hashed_url,
+                       to_global_id, to_local_id)
+from .utils import b62_encode, b62_encode_many, canonicalize_url
+
+_id_allocators = {}
+_id_allocators_lock = threading.Lock()
+
+
+def get_random_offset():
+    return random.randint(URL_B62_OFFSET_RANGE[0], URL_B62_OFFSET_RANGE[1])
+
+
+def get_url_id(id, random_offset):
+    return id + URL_B62_BASE_NUM + URL_B62_OFFSET_SIZE * random_offset
+
+
+class IdBlockCounterManager(models.Manager):
+
+    def reserve_block(self, name, size, get_min_id):
+        # reservations only hold if they commit, so callers should reserve
+        # outside of their own transactions
+        with transaction.atomic(using=self.db):
+            try:
+                counter = self.select_for_update().get(name=name)
+            except self.model.DoesNotExist:
+                try:
+                    with transaction.atomic(using=self.db):
+                        counter = self.create(name=name, next_id=get_min_id())
+                except IntegrityError:
+                    # another worker created the counter first
+                    counter = self.select_for_update().get(name=name)
+
+            # never hand out ids of rows written without the counter, e.g.
+            # by a restore or a rolled back reservation
+            start = max(counter.next_id, get_min_id())
+            counter.next_id = start + size
+            counter.save(update_fields=['next_id'])
+
+        return start
 
 
 class BaseShortUrlManager(models.Manager):
 
+    def get_id_allocator(self, using=None):
+        using = using or self.db
+        key = (self.model._meta.label_lower, using)
+
+        with _id_allocators_lock:
+            id_allocator = _id_allocators.get(key)
+            if id_allocator is None:
+                id_allocator = _id_allocators[key] = IdBlockAllocator(
+                    partial(self._reserve_id_block, using), SHORT_URL_ID_BLOCK_SIZE)
+
+        return id_allocator
+
+    @property
+    def id_allocator(self):
+        return self.get_id_allocator()
+
+    def _reserve_id_block(self, using, size):
+        def get_min_id():
+            max_id = self.using(using).aggregate(max_id=Max('id'))['max_id'] or 0
+            return to_local_id(max_id) + 1
+
+        # each shard counts its own local ids, see sharding.to_global_id
+        return IdBlockCounter.objects.db_manager(using).reserve_block(
+            self.model._meta.label_lower, size, get_min_id)
+
+    def allocate_ids(self, count=1, using=None):
+        using = using or self.db
+        return [
+            to_global_id(local_id, using)
+            for local_id in self.get_id_allocator(using).allocate(count)
+        ]
+
+    def get_max_id(self):
+        max_ids = []
+        for alias in get_shard_aliases():
+            max_ids.append(self.using(alias).aggregate(max_id=Max('id'))['max_id'] or 0)
+
+            # ids handed out from reserved blocks can run ahead of the rows
+            next_id = IdBlockCounter.objects.using(alias).filter(
+                name=self.model._meta.label_lower
+            ).values_list('next_id', flat=True).first()
+            if next_id:
+                max_ids.append(to_global_id(next_id - 1, alias))
+
+        return max(max_ids)
+
+    def get_shard_for_object(self, obj):
+        return self.db
+
     def create(self, original_url, random_offset=None,
                *args, **kwargs):
 
         if not random_offset:
-            random_offset = random.randint(
-                URL_B62_OFFSET_RANGE[0], URL_B62_OFFSET_RANGE[1])
+            random_offset = get_random_offset()
+
+        # ids come from a locally reserved block, so the code is known
+        # before the insert
+        if kwargs.get('id') is None:
+            kwargs['id'] = self.allocate_ids()[0]
 
         return super(BaseShortUrlManager, self).create(
             original_url=original_url,
             random_offset=random_offset,
+            short_url_path=b62_encode(get_url_id(kwargs['id'], random_offset)),
             **kwargs)
 
+    def assign_short_url_paths(self, objs):
+        objs_by_shard = {}
+        for obj in objs:
+            objs_by_shard.setdefault(self.get_shard_for_object(obj), []).append(obj)
+
+        for using, shard_objs in objs_by_shard.items():
+            new_objs = [obj for obj in shard_objs if obj.id is None]
+            for obj, id in zip(new_objs, self.allocate_ids(len(new_objs), using=using)):
+                obj.id = id
+
+            short_url_paths = b62_encode_many(
+                [get_url_id(obj.id, obj.random_offset) for obj in new_objs])
+            for obj, short_url_path in zip(new_objs, short_url_paths):
+                obj.short_url_path = short_url_path
+
+        return objs_by_shard
+
 
 class BaseShortUrl(models.Model):
 
@@ -30,6 +145,9 @@ class BaseShortUrl(models.Model):
 
     random_offset = models.SmallIntegerField()
 
+    short_url_path = models.CharField(
+        max_length=SHORT_URL_MAX_LEN, unique=True, null=True)
+
     objects = BaseShortUrlManager()
 
     class Meta:
@@ -37,43 +155,63 @@ class BaseShortUrl(models.Model):
 
     @property
     def url_id(self):
-        base = URL_B62_BASE_NUM
-        offset = URL_B62_OFFSET_SIZE * self.random_offset
-
-        return self.id + base + offset
+        return get_url_id(self.id, self.random_offset)
 
-    @property
-    def short_url_path(self):
+    def compute_short_url_path(self):
         return b62_encode(self.url_id)
 
 
-def get_hashed_url_from_original_url(original_url, hash_algo=None):
-    if hash_algo is None:
-        hash_algo = hashlib.sha256()
+def get_hashed_url_from_original_url(original_url, algorithm=None):
+    return fingerprint_url(original_url, algorithm)
+
 
-    hash_algo.update(original_url.encode('utf-8'))
-    hashed_url = hash_algo.hexdigest()[:HASHED_URL_LENGTH]
-    return hashed_url
+def get_hashed_urls_from_original_urls(original_urls, algorithm=None):
+    return fingerprint_urls(original_urls, algorithm)
 
 
 class ShortUrlManager(BaseShortUrlManager):
 
-    def create(self, original_url, hashed_url='',
+    def get_shard_for_object(self, obj):
+        return get_shard_for_hashed_url(obj.hashed_url)
+
+    def create(self, original_url, hashed_url=None, canonical_url=None,
                *args, **kwargs):
-        if not hashed_url:
-            hashed_url = get_hashed_url_from_original_url(original_url)
+        if canonical_url is None:
+            canonical_url = canonicalize_url(original_url)
+
+        if hashed_url is None:
+            hashed_url = get_hashed_url_from_original_url(canonical_url)
 
-        return super(ShortUrlManager, self).create(
+        # rows are placed by url hash, so lookups by url need no fan-out
+        shard_manager = self.db_manager(get_shard_for_hashed_url(hashed_url))
+        return super(ShortUrlManager, shard_manager).create(
             original_url=original_url,
             hashed_url=hashed_url,
+            canonical_url=canonical_url,
             **kwargs
         )
 
 
+class IdBlockCounter(models.Model):
+
+    name = models.CharField(max_length=64, unique=True)
+    next_id = models.BigIntegerField()
+
+    objects = IdBlockCounterManager()
+
+    def __str__(self):
+        return self.name
+
+
 class ShortUrl(BaseShortUrl):
 
-    original_url = models.TextField(unique=True)
-    hashed_url = models.CharField(max_length=HASHED_URL_LENGTH, db_index=True)
+    original_url = models.TextField()
+    # the deduplication key, see utils.canonicalize_url
+    canonical_url = models.TextField(unique=True, null=True)
+    hashed_url = models.BigIntegerField(db_index=True)
+    # null for rows written before the column existed, delta redirect
+    # snapshots export the rows created since the previous one by it
+    created_at = models.DateTimeField(default=timezone.now, null=True, db_index=True)
 
     objects = ShortUrlManager()
 
@@ -95,6 +233,11 @@ class UrlPreviewData(models.Model):
 
     last_update = models.DateTimeField(auto_now=True)
 
+    @property
+    def is_expired(self):
+        expire_delta = timezone.timedelta(days=URL_PREVIEW_DATA_EXPIRE_DAYS)
+        return timezone.now() - self.last_update > expire_delta
+
     def as_dict(self):
         return {
             'original_url': str(self.from_url),
@@ -104,3 +247,82 @@ class UrlPreviewData(models.Model):
             'image_url': self.image_url,
             'last_update': self.last_update.strftime('%Y-%m-%d %H:%M:%S')
         }
+
+
+class UrlPreviewCrawlTask(models.Model):
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'pending'),
+        (STATUS_RUNNING, 'running'),
+        (STATUS_DONE, 'done'),
+        (STATUS_FAILED, 'failed'),
+    )
+
+    from_url = models.OneToOneField(
+        ShortUrl, on_delete=models.CASCADE,
+        related_name='crawl_task',
+    )
+
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING,
+        db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_update = models.DateTimeField(auto_now=True)
+
+
+class ClickStatsManager(models.Manager):
+
+    def add_clicks(self, counts, batch_size=CLICK_FLUSH_BATCH_SIZE):
+        """
+        Add ``{(short_url_path, hour): clicks}`` to the hourly counters.
+        Callers pick the shard of the short urls with ``db_manager()``.
+        """
+        items = list(counts.items())
+        for start in range(0, len(items), batch_size):
+            self._add_clicks(dict(items[start:start + batch_size]))
+
+    def _add_clicks(self, counts):
+        with transaction.atomic(using=self.db):
+            # make sure every counter exists, then lock and bump them, so
+            # flushers in other processes add up instead of overwriting
+            self.bulk_create(
+                [
+                    self.model(short_url_path=short_url_path, hour=hour)
+                    for short_url_path, hour in counts
+                ],
+                ignore_conflicts=True,
+            )
+
+            objs = []
+            for obj in self.select_for_update().filter(
+                    short_url_path__in={short_url_path for short_url_path, _ in counts},
+                    hour__in={hour for _, hour in counts}):
+                clicks = counts.get((obj.short_url_path, obj.hour))
+                if clicks:
+                    obj.clicks += clicks
+                    objs.append(obj)
+
+            self.bulk_update(objs, ['clicks'])
+
+
+class ClickStats(models.Model):
+
+    short_url_path = models.CharField(max_length=SHORT_URL_MAX_LEN)
+    hour = models.DateTimeField()
+    clicks = models.PositiveIntegerField(default=0)
+
+    objects = ClickStatsManager()
+
+    class Meta:
+        unique_together = ('short_url_path', 'hour')
+        verbose_name_plural = 'click stats'
+
+    def __str__(self):
+        return '{} {}'.format(self.short_url_path, self.hour)
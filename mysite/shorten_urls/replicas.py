@@ -0,0 +1,59 @@
+import itertools
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .configs import READ_REPLICA_SELECTION
+
+SELECTION_ROUND_ROBIN = 'round_robin'
+SELECTION_LEAST_LOADED = 'least_loaded'
+
+
+def get_replica_aliases(primary=None):
+    replicas = getattr(settings, 'SHORT_URL_READ_REPLICAS', None) or {}
+    if primary is None:
+        return [alias for aliases in replicas.values() for alias in aliases]
+
+    return replicas.get(primary, [])
+
+
+class ReplicaSelector:
+
+    def __init__(self, selection=READ_REPLICA_SELECTION):
+        if selection not in (SELECTION_ROUND_ROBIN, SELECTION_LEAST_LOADED):
+            raise ValueError('unknown replica selection: {}'.format(selection))
+
+        self.selection = selection
+
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._in_flight = {}
+
+    def select(self, primary):
+        replicas = get_replica_aliases(primary)
+        if not replicas:
+            return primary
+
+        with self._lock:
+            if self.selection == SELECTION_LEAST_LOADED:
+                return min(replicas, key=lambda alias: self._in_flight.get(alias, 0))
+
+            counter = self._counters.setdefault(primary, itertools.count())
+            return replicas[next(counter) % len(replicas)]
+
+    @contextmanager
+    def reading(self, alias):
+        with self._lock:
+            self._in_flight[alias] = self._in_flight.get(alias, 0) + 1
+        try:
+            yield alias
+        finally:
+            with self._lock:
+                self._in_flight[alias] -= 1
+
+    def in_flight(self, alias):
+        return self._in_flight.get(alias, 0)
+
+
+replica_selector = ReplicaSelector()
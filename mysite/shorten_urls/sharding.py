@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .replicas import get_replica_aliases
+
+SHARDED_APP_LABEL = 'shorten_urls'
+
+
+def get_shard_aliases():
+    return getattr(settings, 'SHORT_URL_SHARDS', None) or [DEFAULT_DB_ALIAS]
+
+
+def get_shard_index(alias):
+    return get_shard_aliases().index(alias)
+
+
+def get_shard_for_id(id):
+    # the shard index is stored in the low digits of the id, so the shard
+    # of any short code is known once it is decoded
+    shards = get_shard_aliases()
+    return shards[id % len(shards)]
+
+
+def get_shard_for_hashed_url(hashed_url):
+    shards = get_shard_aliases()
+    if len(shards) == 1:
+        return shards[0]
+
+    return shards[hashed_url % len(shards)]
+
+
+def to_global_id(local_id, alias):
+    return local_id * len(get_shard_aliases()) + get_shard_index(alias)
+
+
+def to_local_id(id):
+    return id // len(get_shard_aliases())
+
+
+class ShortUrlShardRouter:
+    """
+    Keeps the app's rows on the shard of the short url they belong to.
+
+    ShortUrl rows are placed by the hash of their original url, so lookups
+    by url and by code both go to a single shard. Queries without an
+    instance are routed explicitly with ``using()``.
+    """
+
+    def _db_for_instance(self, instance):
+        if instance is None:
+            return None
+        elif instance._state.db:
+            return instance._state.db
+
+        # preview rows follow the short url they point to
+        from_url = instance._state.fields_cache.get('from_url')
+        if from_url is not None:
+            return from_url._state.db
+
+        hashed_url = getattr(instance, 'hashed_url', None)
+        if hashed_url is not None:
+            return get_shard_for_hashed_url(hashed_url)
+
+        return None
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != SHARDED_APP_LABEL:
+            return None
+
+        return self._db_for_instance(hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != SHARDED_APP_LABEL:
+            return None
+
+        return self._db_for_instance(hints.get('instance'))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if SHARDED_APP_LABEL not in (obj1._meta.app_label, obj2._meta.app_label):
+            return None
+
+        return obj1._state.db == obj2._state.db
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replica_aliases():
+            # replicas are filled by the database's own replication
+            return False
+
+        shards = get_shard_aliases()
+        if app_label == SHARDED_APP_LABEL:
+            return db in shards
+        elif db != DEFAULT_DB_ALIAS and db in shards:
+            # shards only hold the app's own tables
+            return False
+
+        return None
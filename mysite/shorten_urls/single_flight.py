@@ -0,0 +1,286 @@
+import asyncio
+import math
+import random
+import threading
+import time
+import uuid
+import weakref
+from collections import namedtuple
+
+from .configs import (CACHE_EARLY_REFRESH_BETA, CACHE_LOCK_POLL_INTERVAL,
+                      CACHE_LOCK_PREFIX, CACHE_LOCK_TIMEOUT,
+                      CACHE_LOCK_WAIT_TIMEOUT, CACHE_STALE_TIMEOUT,
+                      CACHE_TTL_JITTER)
+
+# what get_or_refresh keeps in the cache: the value, the wall clock time it
+# is due for a refresh and the seconds its computation took
+CacheEntry = namedtuple('CacheEntry', ['value', 'refresh_at', 'delta'])
+
+_MISSING = object()
+
+
+def make_cache_entry(value, timeout, delta=0):
+    # jittered, so keys written together are not all due at once
+    timeout *= 1 - CACHE_TTL_JITTER * random.random()
+    return CacheEntry(value, time.time() + timeout, delta)
+
+
+def get_cache_timeout(timeout):
+    # entries outlive their refresh time, so they can be served stale
+    return timeout + CACHE_STALE_TIMEOUT
+
+
+def needs_refresh(entry, now=None, beta=CACHE_EARLY_REFRESH_BETA):
+    """
+    Whether ``entry`` should be computed again. Close to its refresh time,
+    and the more so the slower it was to compute, a request may refresh it
+    early (probabilistic early expiration, "XFetch"), which spreads the
+    refreshes of a hot key instead of all callers missing at once.
+    """
+    if now is None:
+        now = time.time()
+
+    return now - entry.delta * beta * math.log(1 - random.random()) >= entry.refresh_at
+
+
+class _Call:
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time in this process. Callers arriving while
+    it runs wait for its result, or get ``stale`` right away if they pass
+    one.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, stale=_MISSING):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if stale is not _MISSING:
+                return stale
+
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines, calls are shared between the tasks of an
+    event loop. When the task running a call is cancelled, the tasks
+    waiting for it start the call again.
+    """
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()
+
+    async def do(self, key, func, stale=_MISSING):
+        loop = asyncio.get_running_loop()
+        calls = self._calls.setdefault(loop, {})
+
+        future = calls.get(key)
+        while future is not None:
+            if stale is not _MISSING:
+                return stale
+
+            try:
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                # the first of the waiting tasks to get here runs it next
+                future = calls.get(key)
+
+        future = calls[key] = loop.create_future()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            # only this task is cancelled, not the ones waiting for it
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            # retrieved, asyncio would otherwise log it when nobody waited
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del calls[key]
+
+        return result
+
+
+_single_flight = SingleFlight()
+_async_single_flight = AsyncSingleFlight()
+
+
+def _unpack(cached):
+    # values written without an entry, e.g. before it existed, never refresh
+    if isinstance(cached, CacheEntry):
+        return cached.value, needs_refresh(cached)
+
+    return cached, False
+
+
+def _compute(compute):
+    start = time.perf_counter()
+    value, timeout = compute()
+
+    return value, timeout, time.perf_counter() - start
+
+
+def _release(cache, lock_key, token):
+    # a lock that expired while computing may be held by another process now
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def _refresh(cache, key, compute, stale):
+    lock_key = CACHE_LOCK_PREFIX + key
+    token = uuid.uuid4().hex
+
+    deadline = None
+    while not cache.add(lock_key, token, timeout=CACHE_LOCK_TIMEOUT):
+        # another process refreshes it
+        if stale is not None:
+            return stale
+
+        if deadline is None:
+            deadline = time.monotonic() + CACHE_LOCK_WAIT_TIMEOUT
+        elif time.monotonic() >= deadline:
+            # the holder is slow or gone, this request cannot wait any longer
+            return _compute(compute)[0]
+
+        time.sleep(CACHE_LOCK_POLL_INTERVAL)
+
+        # a value that is not cached never shows up here, the lock is then
+        # released and taken over by the next attempt
+        cached = cache.get(key)
+        if cached is not None:
+            return _unpack(cached)[0]
+
+    try:
+        value, timeout, delta = _compute(compute)
+        if value is not None and timeout is not None:
+            cache.set(
+                key, make_cache_entry(value, timeout, delta),
+                timeout=get_cache_timeout(timeout))
+    finally:
+        _release(cache, lock_key, token)
+
+    return value
+
+
+def get_or_refresh(cache, key, compute):
+    """
+    Return the value cached at ``key``, computing it on a miss and when it
+    is due for a refresh.
+
+    ``compute`` returns the value and its timeout. A timeout of None or a
+    value of None is returned but not cached.
+
+    A single caller in this process, and over all processes only the one
+    holding a short lock key in the cache, computes a key. While it does,
+    the others serve the stale value or, without one, wait for the new one
+    or for the lock to be released.
+    """
+    cached = cache.get(key)
+    value, due = (None, True) if cached is None else _unpack(cached)
+    if not due:
+        return value
+
+    def refresh():
+        return _refresh(cache, key, compute, value)
+
+    return _single_flight.do(key, refresh, stale=_MISSING if value is None else value)
+
+
+async def _async_compute(compute):
+    start = time.perf_counter()
+    value, timeout = await compute()
+
+    return value, timeout, time.perf_counter() - start
+
+
+async def _async_release(cache, lock_key, token):
+    if await cache.get(lock_key) == token:
+        await cache.delete(lock_key)
+
+
+async def _async_refresh(cache, key, compute, stale):
+    lock_key = CACHE_LOCK_PREFIX + key
+    token = uuid.uuid4().hex
+
+    deadline = None
+    while not await cache.add(lock_key, token, timeout=CACHE_LOCK_TIMEOUT):
+        if stale is not None:
+            return stale
+
+        if deadline is None:
+            deadline = time.monotonic() + CACHE_LOCK_WAIT_TIMEOUT
+        elif time.monotonic() >= deadline:
+            return (await _async_compute(compute))[0]
+
+        await asyncio.sleep(CACHE_LOCK_POLL_INTERVAL)
+
+        cached = await cache.get(key)
+        if cached is not None:
+            return _unpack(cached)[0]
+
+    try:
+        value, timeout, delta = await _async_compute(compute)
+        if value is not None and timeout is not None:
+            await cache.set(
+                key, make_cache_entry(value, timeout, delta),
+                timeout=get_cache_timeout(timeout))
+    finally:
+        await _async_release(cache, lock_key, token)
+
+    return value
+
+
+async def async_get_or_refresh(cache, key, compute):
+    """
+    get_or_refresh for an AsyncCache and a ``compute`` coroutine function.
+    """
+    cached = await cache.get(key)
+    value, due = (None, True) if cached is None else _unpack(cached)
+    if not due:
+        return value
+
+    def refresh():
+        return _async_refresh(cache, key, compute, value)
+
+    return await _async_single_flight.do(
+        key, refresh, stale=_MISSING if value is None else value)
@@ -0,0 +1,466 @@
+import fcntl
+import heapq
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .configs import (REDIRECT_NOT_FOUND_CACHE_VALUE,
+                      REDIRECT_SNAPSHOT_CHUNK_SIZE,
+                      REDIRECT_SNAPSHOT_DELTA_OVERLAP,
+                      REDIRECT_SNAPSHOT_RELOAD_INTERVAL, URL_B62_BASE_NUM,
+                      URL_B62_OFFSET_SIZE)
+from .models import ShortUrl
+from .sharding import get_shard_aliases
+from .utils import b62_decode
+
+SNAPSHOT_MAGIC = b'SURLSNP1'
+# magic, byte order, row count, max id
+SNAPSHOT_HEADER = struct.Struct('=8s8sQQ')
+
+# manifest updates are read-modify-write, compaction runs beside appends
+_manifest_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+class RedirectSnapshotSegment:
+    """
+    A read-only id -> original url table, memory-mapped from a segment
+    file written by ``manage.py build_redirect_snapshot``.
+
+    Layout after the header, in native byte order: ``count + 1`` uint64
+    offsets into the blob, ``count`` sorted uint32 ids, ``count`` uint8
+    random offsets and the utf-8 blob of original urls. Lookups binary
+    search the mapped ids, so the file is never read into memory and all
+    processes share its pages through the page cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, byteorder, self.count, self.max_id = SNAPSHOT_HEADER.unpack_from(self._mmap)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('{} is not a redirect snapshot segment'.format(path))
+        elif byteorder.rstrip(b'\0').decode() != sys.byteorder:
+            raise ValueError('{} was built on a {} endian machine'.format(
+                path, byteorder.rstrip(b'\0').decode()))
+
+        view = memoryview(self._mmap)
+        start = SNAPSHOT_HEADER.size
+        self._offsets = view[start:start + (self.count + 1) * 8].cast('Q')
+        start += (self.count + 1) * 8
+        self._ids = view[start:start + self.count * 4].cast('I')
+        start += self.count * 4
+        self._random_offsets = view[start:start + self.count]
+        self._blob = view[start + self.count:]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        # rows as written, urls stay encoded
+        for index in range(self.count):
+            yield (self._ids[index], self._random_offsets[index],
+                   bytes(self._blob[self._offsets[index]:self._offsets[index + 1]]))
+
+    def get(self, url_id, random_offset):
+        """
+        Return the original url of a short url, REDIRECT_NOT_FOUND_CACHE_VALUE
+        if its id is in the segment with another code, or None if the id
+        is not in the segment.
+        """
+        index = bisect_left(self._ids, url_id)
+        if index == self.count or self._ids[index] != url_id:
+            return None
+        elif self._random_offsets[index] != random_offset:
+            return REDIRECT_NOT_FOUND_CACHE_VALUE
+
+        return str(self._blob[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+
+def is_single_file_snapshot(path):
+    """
+    Whether ``path`` is a snapshot written before manifests existed: one
+    segment file at the configured path.
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+def read_manifest(path):
+    """
+    Return the manifest at ``path`` or None if there is none. It lists the
+    segment file names, oldest first, and ``exported_until``, the time up
+    to which created rows are in the segments.
+
+    A single-file snapshot counts as none, so writing to its path builds
+    the snapshot anew and replaces it with a manifest.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC:
+                return None
+
+            f.seek(0)
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    manifest['exported_until'] = parse_datetime(manifest['exported_until'])
+    return manifest
+
+
+def _write_manifest(path, manifest):
+    # not a NamedTemporaryFile, readers may run as another user than 0600 allows
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(dict(manifest, exported_until=manifest['exported_until'].isoformat()), f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _lock_manifest(path):
+    """
+    Hold the lock of the snapshot at ``path`` while its manifest is updated
+    or segments are removed. A full build, --delta, --compact and --follow
+    may run in separate processes, so it is a file lock beside the manifest
+    as well as a thread lock.
+    """
+    with _manifest_lock, open('{}.lock'.format(path), 'a') as f:
+        # released when the file is closed
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def _get_segment_path(path, name):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), name)
+
+
+def _open_segments(path, manifest):
+    return [
+        RedirectSnapshotSegment(_get_segment_path(path, name))
+        for name in manifest['segments']
+    ]
+
+
+def _remove_segments(path, names):
+    # processes that mapped them keep reading until they reload
+    for name in names:
+        try:
+            os.remove(_get_segment_path(path, name))
+        except FileNotFoundError:
+            pass
+
+
+class RedirectSnapshotReader:
+    """
+    Serves lookups from the snapshot whose manifest is at
+    settings.REDIRECT_SNAPSHOT_PATH.
+
+    The manifest is checked for changes at most every ``reload_interval``
+    seconds. Segments that are still listed stay mapped, new ones are
+    mapped and those dropped by a compaction are released once no lookup
+    uses them anymore. A snapshot that cannot be read keeps the segments
+    mapped before it.
+    """
+
+    def __init__(self, reload_interval=REDIRECT_SNAPSHOT_RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+
+        # (stat key, segment) pairs, newest first
+        self._segments = ()
+        self._stat = None
+        self._last_check = None
+        self._lock = threading.Lock()
+
+    @property
+    def segments(self):
+        last_check = self._last_check
+        if last_check is None or time.monotonic() - last_check >= self.reload_interval:
+            self.reload()
+
+        return self._segments
+
+    def reload(self):
+        path = getattr(settings, 'REDIRECT_SNAPSHOT_PATH', None)
+
+        with self._lock:
+            self._last_check = time.monotonic()
+
+            try:
+                stat = os.stat(path) if path else None
+            except FileNotFoundError:
+                stat = None
+
+            key = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size) if stat else None
+            if key == self._stat:
+                return
+
+            segments = ()
+            if key:
+                try:
+                    segments = self._map_segments(path)
+                except FileNotFoundError:
+                    # replaced since the stat, e.g. a compaction removed a
+                    # segment of the manifest that was read, the next check
+                    # sees the new one
+                    return
+                except (KeyError, TypeError, ValueError, OSError):
+                    logger.exception('Failed to load the redirect snapshot %s', path)
+                    # not retried until the file changes
+                    self._stat = key
+                    return
+
+            self._segments = segments
+            self._stat = key
+
+    def _map_segments(self, path):
+        manifest = read_manifest(path)
+        if manifest is not None:
+            names = manifest['segments']
+        elif is_single_file_snapshot(path):
+            names = [os.path.basename(path)]
+        else:
+            # the manifest was removed since the stat
+            raise FileNotFoundError(path)
+
+        mapped = dict(self._segments)
+        segments = []
+        for name in reversed(names):
+            segment_path = _get_segment_path(path, name)
+            segment_stat = os.stat(segment_path)
+            segment_key = (segment_path, segment_stat.st_ino, segment_stat.st_size)
+
+            segment = mapped.get(segment_key)
+            if segment is None:
+                segment = RedirectSnapshotSegment(segment_path)
+            segments.append((segment_key, segment))
+
+        return tuple(segments)
+
+    def get(self, short_url):
+        segments = self.segments
+        if not segments:
+            return None
+
+        try:
+            random_offset, url_id = divmod(b62_decode(short_url) - URL_B62_BASE_NUM,
+                                           URL_B62_OFFSET_SIZE)
+        except (KeyError, ValueError):
+            return None
+
+        for _, segment in segments:
+            original_url = segment.get(url_id, random_offset)
+            if original_url is not None:
+                return original_url
+
+        return None
+
+
+def _iter_short_urls(chunk_size, created_since=None):
+    querysets = []
+    for shard in get_shard_aliases():
+        queryset = ShortUrl.objects.using(shard).order_by('id')
+        if created_since is not None:
+            queryset = queryset.filter(created_at__gte=created_since)
+
+        querysets.append(
+            (url_id, random_offset, original_url.encode('utf-8'))
+            for url_id, random_offset, original_url in queryset.values_list(
+                'id', 'random_offset', 'original_url').iterator(chunk_size=chunk_size)
+        )
+
+    # ids are global over the shards, so merging their ordered rows gives
+    # one ordered stream
+    return heapq.merge(*querysets)
+
+
+def _write_segment(path, rows, chunk_size):
+    directory = os.path.dirname(os.path.abspath(path))
+
+    with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+        parts = {
+            name: open(os.path.join(tmpdir, name), 'w+b')
+            for name in ('offsets', 'ids', 'random_offsets', 'blob')
+        }
+
+        count = max_id = offset = 0
+        offsets, ids, random_offsets = array('Q', [0]), array('I'), array('B')
+        blob = bytearray()
+
+        def flush():
+            offsets.tofile(parts['offsets'])
+            ids.tofile(parts['ids'])
+            random_offsets.tofile(parts['random_offsets'])
+            parts['blob'].write(blob)
+
+            del offsets[:], ids[:], random_offsets[:], blob[:]
+
+        for url_id, random_offset, url in rows:
+            offset += len(url)
+
+            offsets.append(offset)
+            ids.append(url_id)
+            random_offsets.append(random_offset)
+            blob += url
+
+            count += 1
+            max_id = url_id
+            if len(ids) >= chunk_size:
+                flush()
+
+        flush()
+
+        tmp_path = os.path.join(tmpdir, 'segment')
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC, sys.byteorder.encode(), count, max_id))
+            for name in ('offsets', 'ids', 'random_offsets', 'blob'):
+                parts[name].seek(0)
+                shutil.copyfileobj(parts[name], f)
+                parts[name].close()
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, path)
+
+    return count
+
+
+def _new_segment_name(path, manifest):
+    number = manifest['next_segment'] if manifest else 1
+    return '{}.{:06d}'.format(os.path.basename(path), number), number + 1
+
+
+def _reserve_segment_name(path):
+    # appends and a compaction write their segments at the same time. The
+    # listed segments are mapped under the lock too: once mapped, removing
+    # their files by a compaction does not affect reading them
+    with _lock_manifest(path):
+        manifest = read_manifest(path)
+        name, manifest['next_segment'] = _new_segment_name(path, manifest)
+        _write_manifest(path, manifest)
+
+        segments = _open_segments(path, manifest)
+
+    return name, manifest, segments
+
+
+def build_redirect_snapshot(path, chunk_size=REDIRECT_SNAPSHOT_CHUNK_SIZE):
+    """
+    Export every short url into one new segment and make it the whole
+    snapshot at ``path``. Returns the number of rows written.
+    """
+    exported_until = timezone.now()
+
+    with _lock_manifest(path):
+        manifest = read_manifest(path)
+        name, next_segment = _new_segment_name(path, manifest)
+
+        count = _write_segment(
+            _get_segment_path(path, name), _iter_short_urls(chunk_size), chunk_size)
+
+        _write_manifest(path, {
+            'segments': [name],
+            'exported_until': exported_until,
+            'next_segment': next_segment,
+        })
+
+        if manifest:
+            _remove_segments(path, manifest['segments'])
+
+    return count
+
+
+def append_redirect_snapshot(path, chunk_size=REDIRECT_SNAPSHOT_CHUNK_SIZE,
+                             overlap=REDIRECT_SNAPSHOT_DELTA_OVERLAP):
+    """
+    Export the short urls created since the last export into a new delta
+    segment, or build the snapshot if there is none yet. Returns the
+    number of rows written.
+
+    Rows are picked by created_at rather than above the highest exported
+    id: ids come from per-process blocks, so new rows often get lower ids
+    than already exported ones. The last ``overlap`` seconds are read
+    again for rows committed late or stamped by a clock running behind;
+    rows already in a segment are skipped.
+    """
+    exported_until = timezone.now()
+
+    if read_manifest(path) is None:
+        return build_redirect_snapshot(path, chunk_size)
+
+    name, manifest, segments = _reserve_segment_name(path)
+    rows = (
+        row for row in _iter_short_urls(
+            chunk_size, manifest['exported_until'] - timedelta(seconds=overlap))
+        if all(segment.get(row[0], row[1]) is None for segment in segments)
+    )
+    count = _write_segment(_get_segment_path(path, name), rows, chunk_size)
+
+    with _lock_manifest(path):
+        manifest = read_manifest(path)
+        if count:
+            manifest['segments'].append(name)
+        else:
+            _remove_segments(path, [name])
+        # a full build that ran meanwhile may have exported later rows
+        manifest['exported_until'] = max(manifest['exported_until'], exported_until)
+
+        _write_manifest(path, manifest)
+
+    return count
+
+
+def compact_redirect_snapshot(path, chunk_size=REDIRECT_SNAPSHOT_CHUNK_SIZE):
+    """
+    Merge the segments of the snapshot at ``path`` into one, without
+    reading the database. Segments appended meanwhile are kept after it.
+    Returns the number of segments merged.
+    """
+    manifest = read_manifest(path)
+    if manifest is None or len(manifest['segments']) < 2:
+        return 0
+
+    name, manifest, segments = _reserve_segment_name(path)
+    merged_names = manifest['segments']
+    _write_segment(_get_segment_path(path, name), heapq.merge(*segments), chunk_size)
+
+    with _lock_manifest(path):
+        manifest = read_manifest(path)
+        if not set(merged_names) <= set(manifest['segments']):
+            # a full build replaced the merged segments meanwhile
+            _remove_segments(path, [name])
+            return 0
+
+        manifest['segments'] = [name] + [
+            segment_name for segment_name in manifest['segments']
+            if segment_name not in merged_names
+        ]
+        _write_manifest(path, manifest)
+
+        _remove_segments(path, merged_names)
+
+    return len(merged_names)
@@ -94,7 +94,10 @@ const getOriginalUrlOnSuccess = (data, status, xhr) => {
 }
 
 
-const getUrlPreviewData = (original_url) => {
+const PREVIEW_POLL_INTERVAL = 1000;
+const PREVIEW_POLL_MAX_TIMES = 10;
+
+const getUrlPreviewData = (original_url, poll_times = 0) => {
     const formData = {'url_input': original_url}
 
     $.ajax({
@@ -103,6 +106,10 @@ const getUrlPreviewData = (original_url) => {
         data: formData,
         dataType: 'json',
         success: (data, status, xhr) => {
+            if (data['message'] === 'pending' && poll_times < PREVIEW_POLL_MAX_TIMES) {
+                setTimeout(() => getUrlPreviewData(original_url, poll_times + 1), PREVIEW_POLL_INTERVAL);
+                return;
+            }
             showUrlPreviewData(data, original_url);
         },
         error: (xhr, status, message) => {
@@ -7,3 +7,15 @@ class MockResposne:
         self.headers = headers or {'Content-Type': 'text/html; charset="utf-8"'}
         self.status_code = status_code or httplib.OK
         self.content = content or ''
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        content = self.content
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
@@ -1,11 +1,18 @@
 import http.client as httplib
+import json
+import time
 from unittest import mock
 
 from django.core.cache import cache
-from django.test import TestCase, override_settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 
+from ..clicks import get_click_hour
 from ..configs import CREATE_SHORT_URL_RATE_LIMIT
-from ..models import ShortUrl
+from ..logics import UrlPreviewCrawlQueue
+from ..models import ClickStats, ShortUrl, UrlPreviewCrawlTask
+from ..single_flight import CacheEntry
 from ..utils import b62_encode
 
 
@@ -55,6 +62,76 @@ class ShortUrlViewTest(TestCase):
         )
 
 
+@override_settings(RATELIMIT_ENABLE=False)
+class ShortUrlBulkViewTest(TestCase):
+
+    url = '/api/v1/short_urls/bulk'
+
+    def post_json(self, data):
+        return self.client.post(
+            self.url, json.dumps(data), content_type='application/json')
+
+    def test_get_not_allowed(self):
+        r = self.client.get(self.url)
+        self.assertEqual(r.status_code, httplib.METHOD_NOT_ALLOWED)
+
+    def test_invalid_json(self):
+        r = self.client.post(self.url, 'not json', content_type='application/json')
+
+        self.assertEqual(r.status_code, httplib.BAD_REQUEST)
+        self.assertJSONEqual(r.content, {'urls': ['This field is required.']})
+
+    def test_urls_not_a_list(self):
+        r = self.post_json({'urls': 'https://www.google.com'})
+
+        self.assertEqual(r.status_code, httplib.BAD_REQUEST)
+        self.assertJSONEqual(r.content, {'urls': ['urls should be a list']})
+
+    @mock.patch('shorten_urls.forms.BULK_SHORT_URL_MAX_SIZE', 2)
+    def test_too_many_urls(self):
+        r = self.post_json({'urls': ['https://www.google.com'] * 3})
+
+        self.assertEqual(r.status_code, httplib.BAD_REQUEST)
+        self.assertJSONEqual(
+            r.content,
+            {'urls': ['urls should have at most 2 items, not 3']}
+        )
+
+    def test_invalid_url(self):
+        r = self.post_json({'urls': ['https://www.google.com', 'https://', 3]})
+
+        self.assertEqual(r.status_code, httplib.BAD_REQUEST)
+        self.assertJSONEqual(
+            r.content,
+            {'urls': ['invalid url at index 1', 'invalid url at index 2']}
+        )
+        self.assertEqual(ShortUrl.objects.count(), 0)
+
+    def test_success(self):
+        urls = ['https://www.google.com', 'https://www.fake.com', 'https://www.google.com']
+        ShortUrl.objects.create(original_url=urls[1])
+
+        r = self.post_json({'urls': urls})
+
+        self.assertEqual(r.status_code, httplib.OK)
+        self.assertEqual(ShortUrl.objects.count(), 2)
+
+        objs = {obj.original_url: obj for obj in ShortUrl.objects.all()}
+        self.assertJSONEqual(
+            r.content,
+            {
+                'data': [
+                    {
+                        'short_url_path': objs[url].short_url_path,
+                        'original_url': url,
+                    }
+                    for url in urls
+                ],
+                'message': 'success'
+            }
+        )
+
+
 @override_settings(ENABLE_CACHE=False)
 class ShortUrlPreviewTest(TestCase):
 
@@ -83,12 +160,34 @@ class ShortUrlPreviewTest(TestCase):
         )
 
     @mock.patch('shorten_urls.logics.UrlPreviewDataLogic.get_url_preview_data')
-    def test_get_preview_data_failed(self, mock_get):
-        mock_get.return_value = None
+    def test_get_preview_data_pending(self, mock_get):
+        form = {
+            'url_input': 'https://www.google.com'
+        }
+
+        r = self.client.post(self.url, form)
+
+        self.assertEqual(r.status_code, httplib.ACCEPTED)
+        self.assertDictEqual(
+            r.json(),
+            {'message': 'pending', 'data': {}}
+        )
+        mock_get.assert_not_called()
+
+        task = UrlPreviewCrawlTask.objects.get()
+        self.assertEqual(str(task.from_url), 'https://www.google.com')
+        self.assertEqual(task.status, UrlPreviewCrawlTask.STATUS_PENDING)
+
+    @mock.patch('shorten_urls.utils.UrlPreviewFetcher.fetch_previews')
+    def test_get_preview_data_failed(self, mock_fetch):
+        mock_fetch.return_value = [{}]
         form = {
             'url_input': 'https://www.google.com'
         }
 
+        self.client.post(self.url, form)
+        UrlPreviewCrawlQueue(max_attempts=1).run_once(batch_size=1)
+
         r = self.client.post(self.url, form)
 
         self.assertEqual(r.status_code, httplib.OK)
@@ -97,18 +196,21 @@ class ShortUrlPreviewTest(TestCase):
             {'message': 'failed', 'data': {}}
         )
 
-    @mock.patch('shorten_urls.logics.UrlPreviewDataLogic.get_url_preview_data')
-    def test_success(self, mock_get):
-        mock_get.return_value = {
+    @mock.patch('shorten_urls.utils.UrlPreviewFetcher.fetch_previews')
+    def test_success(self, mock_fetch):
+        mock_fetch.return_value = [{
             'title': 'some title',
             'description': 'some description',
             'url': 'some url',
             'image': 'some image url',
-        }
+        }]
         form = {
             'url_input': 'https://www.google.com'
         }
 
+        self.client.post(self.url, form)
+        UrlPreviewCrawlQueue().run_once(batch_size=1)
+
         r = self.client.post(self.url, form)
 
         self.assertEqual(r.status_code, httplib.OK)
@@ -126,6 +228,61 @@ class ShortUrlPreviewTest(TestCase):
         )
 
 
+@override_settings(ENABLE_CACHE=True)
+class ShortUrlPreviewCacheTest(TestCase):
+
+    url = '/api/v1/short_urls/preview'
+    form = {'url_input': 'https://www.google.com'}
+    cache_key = 'GETPREVIEW:https://www.google.com'
+    preview_data = {
+        'title': 'some title',
+        'description': 'some description',
+        'url': 'some url',
+        'image_url': 'some image url',
+    }
+
+    def setUp(self):
+        self.cache = LocMemCache('preview_cache_test', {})
+        self.addCleanup(self.cache.clear)
+        # the preview creates its short url, which drops its cached redirect
+        for target in ('shorten_urls.api_views.cache', 'shorten_urls.logics.cache'):
+            patcher = mock.patch(target, self.cache)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @mock.patch('shorten_urls.utils.UrlPreviewFetcher.fetch_previews')
+    def test_success_is_cached(self, mock_fetch):
+        mock_fetch.return_value = [{
+            'title': 'some title',
+            'description': 'some description',
+            'url': 'some url',
+            'image': 'some image url',
+        }]
+
+        r = self.client.post(self.url, self.form)
+        self.assertEqual(r.status_code, httplib.ACCEPTED)
+        self.assertIsNone(self.cache.get(self.cache_key))
+
+        UrlPreviewCrawlQueue().run_once(batch_size=1)
+        self.client.post(self.url, self.form)
+
+        self.assertEqual(self.cache.get(self.cache_key).value, self.preview_data)
+        with self.assertNumQueries(0):
+            r = self.client.post(self.url, self.form)
+        self.assertDictEqual(r.json(), {'message': 'success', 'data': self.preview_data})
+
+    def test_stale_while_refreshing(self):
+        self.cache.set(self.cache_key, CacheEntry(self.preview_data, time.time() - 1, 0))
+        # another request is refreshing it
+        self.cache.add('LOCK:' + self.cache_key, 1)
+
+        with self.assertNumQueries(0):
+            r = self.client.post(self.url, self.form)
+
+        self.assertEqual(r.status_code, httplib.OK)
+        self.assertDictEqual(r.json(), {'message': 'success', 'data': self.preview_data})
+
+
 class GetOriginalUrlViewTest(TestCase):
 
     url = '/api/v1/short_urls/original_url'
@@ -212,3 +369,88 @@ class GetOriginalUrlViewTest(TestCase):
                 }
             }
         )
+
+
+class ClickStatsViewTest(TestCase):
+
+    url = '/api/v1/short_urls/stats'
+
+    def setUp(self):
+        self.short_url_path = ShortUrl.objects.create(
+            original_url='https://www.fake.com'
+        ).short_url_path
+        self.hour = get_click_hour()
+
+    def create_click_stats(self, hours_ago, clicks):
+        return ClickStats.objects.create(
+            short_url_path=self.short_url_path,
+            hour=self.hour - timezone.timedelta(hours=hours_ago),
+            clicks=clicks,
+        )
+
+    def test_form_invalid(self):
+        r = self.client.get(self.url, {'short_url': 'a' * 4})
+
+        self.assertEqual(r.status_code, httplib.BAD_REQUEST)
+        self.assertEqual(r.json(), {'message': 'failed', 'data': {}})
+
+    def test_form_invalid_hours(self):
+        r = self.client.get(self.url, {'short_url': self.short_url_path, 'hours': 0})
+
+        self.assertEqual(r.status_code, httplib.BAD_REQUEST)
+
+    def test_success(self):
+        self.create_click_stats(0, 3)
+        self.create_click_stats(23, 2)
+        self.create_click_stats(24, 1)
+
+        r = self.client.get(self.url, {'short_url': self.short_url_path})
+
+        self.assertEqual(r.status_code, httplib.OK)
+        data = r.json()['data']
+        self.assertEqual(data['short_url_path'], self.short_url_path)
+        self.assertEqual(data['clicks'], 5)
+        self.assertEqual([item['clicks'] for item in data['hourly_clicks']], [2, 3])
+        self.assertEqual(
+            data['hourly_clicks'][-1]['hour'], self.hour.strftime('%Y-%m-%d %H:%M:%S'))
+
+    def test_success_with_hours(self):
+        self.create_click_stats(0, 3)
+        self.create_click_stats(1, 2)
+
+        r = self.client.get(self.url, {'short_url': self.short_url_path, 'hours': 1})
+
+        self.assertEqual(r.json()['data']['clicks'], 3)
+
+    def test_success_without_clicks(self):
+        r = self.client.get(self.url, {'short_url': self.short_url_path})
+
+        self.assertEqual(r.status_code, httplib.OK)
+        self.assertEqual(r.json()['data']['clicks'], 0)
+        self.assertEqual(r.json()['data']['hourly_clicks'], [])
+
+
+@override_settings(ROOT_URLCONF='mysite.asgi_urls')
+class AsyncGetOriginalUrlViewTest(TransactionTestCase):
+
+    url = '/api/v1/short_urls/original_url'
+
+    def test_form_invalid(self):
+        r = self.client.get(self.url, {'short_url': 'abcd@'})
+
+        self.assertEqual(r.status_code, httplib.BAD_REQUEST)
+        self.assertEqual(r.json(), {'message': 'failed', 'data': {}})
+
+    def test_get_success(self):
+        short_url_object = ShortUrl.objects.create(original_url='https://www.fake.com')
+
+        r = self.client.get(self.url, {'short_url': short_url_object.short_url_path})
+
+        self.assertEqual(r.status_code, httplib.OK)
+        self.assertEqual(r.json(), {
+            'message': 'success',
+            'data': {
+                'original_url': 'https://www.fake.com',
+                'short_url_path': short_url_object.short_url_path,
+            },
+        })
@@ -0,0 +1,118 @@
+import threading
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from ..async_utils import AsyncCache, run_in_thread
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'async_utils_test',
+    }
+}
+
+REDIS_CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+        'TIMEOUT': 100,
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        },
+        'KEY_PREFIX': 'shorten_urls',
+    }
+}
+
+
+class RunInThreadTest(SimpleTestCase):
+
+    def test_runs_in_worker_thread(self):
+        result = async_to_sync(run_in_thread)(
+            lambda a, b=0: (a + b, threading.current_thread()), 1, b=2)
+
+        self.assertEqual(result[0], 3)
+        self.assertNotEqual(result[1], threading.current_thread())
+
+    def test_raises(self):
+        def fail():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            async_to_sync(run_in_thread)(fail)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AsyncCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.async_cache = AsyncCache()
+        self.addCleanup(caches['default'].clear)
+
+    def test_get_and_set(self):
+        async_to_sync(self.async_cache.set)('key', 'value')
+
+        self.assertEqual(caches['default'].get('key'), 'value')
+        self.assertEqual(async_to_sync(self.async_cache.get)('key'), 'value')
+        self.assertEqual(async_to_sync(self.async_cache.get)('other', 'default'), 'default')
+
+    def test_add_and_delete(self):
+        self.assertTrue(async_to_sync(self.async_cache.add)('key', 'value'))
+        self.assertFalse(async_to_sync(self.async_cache.add)('key', 'other'))
+
+        async_to_sync(self.async_cache.delete)('key')
+
+        self.assertIsNone(caches['default'].get('key'))
+
+
+@override_settings(CACHES=REDIS_CACHES)
+class AsyncRedisCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.async_cache = AsyncCache()
+
+        self.redis_cache = caches['default'].client
+        self.client = mock.AsyncMock()
+        patcher = mock.patch(
+            'shorten_urls.async_utils.aioredis.Redis.from_url', return_value=self.client)
+        self.mock_from_url = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get(self):
+        self.client.get.return_value = self.redis_cache.encode('value')
+
+        self.assertEqual(async_to_sync(self.async_cache.get)('key'), 'value')
+        self.client.get.assert_awaited_once_with(self.redis_cache.make_key('key'))
+        self.mock_from_url.assert_called_once_with('redis://127.0.0.1:6379/1')
+
+    def test_get_miss(self):
+        self.client.get.return_value = None
+
+        self.assertIsNone(async_to_sync(self.async_cache.get)('key'))
+
+    def test_set(self):
+        async_to_sync(self.async_cache.set)('key', 'value')
+        async_to_sync(self.async_cache.set)('key', 'value', timeout=None)
+
+        self.assertEqual(self.client.set.await_args_list, [
+            mock.call(self.redis_cache.make_key('key'),
+                      self.redis_cache.encode('value'), ex=100),
+            mock.call(self.redis_cache.make_key('key'),
+                      self.redis_cache.encode('value'), ex=None),
+        ])
+
+    def test_add(self):
+        self.client.set.return_value = None
+
+        self.assertFalse(async_to_sync(self.async_cache.add)('key', 'value', timeout=10))
+        self.client.set.assert_awaited_once_with(
+            self.redis_cache.make_key('key'), self.redis_cache.encode('value'),
+            nx=True, ex=10)
+
+    def test_delete(self):
+        self.client.delete.return_value = 1
+
+        self.assertTrue(async_to_sync(self.async_cache.delete)('key'))
+        self.client.delete.assert_awaited_once_with(self.redis_cache.make_key('key'))
@@ -0,0 +1,85 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from ..benchmarks import compare_results, percentile, summarize_latencies
+from ..models import ShortUrl
+
+
+class PercentileTest(TestCase):
+
+    def test_empty(self):
+        self.assertEqual(percentile([], 50), 0)
+
+    def test_success(self):
+        samples = list(range(1, 101))
+
+        self.assertEqual(percentile(samples, 50), 51)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile(samples, 100), 100)
+
+
+class SummarizeLatenciesTest(TestCase):
+
+    def test_success(self):
+        self.assertDictEqual(
+            summarize_latencies([0.001, 0.002, 0.003], elapsed=0.5),
+            {
+                'count': 3,
+                'p50_us': 2000.0,
+                'p99_us': 3000.0,
+                'mean_us': 2000.0,
+                'ops_per_sec': 6.0,
+            }
+        )
+
+
+class CompareResultsTest(TestCase):
+
+    def test_success(self):
+        previous = {'micro': {'b62_encode': {'ops_per_sec': 100}}}
+        current = {
+            'micro': {
+                'b62_encode': {'ops_per_sec': 150},
+                'b62_decode': {'ops_per_sec': 100},
+            }
+        }
+
+        self.assertDictEqual(
+            compare_results(previous, current),
+            {'micro.b62_encode': 50.0}
+        )
+
+
+@override_settings(RATELIMIT_ENABLE=False)
+class RunBenchmarksCommandTest(TestCase):
+
+    def test_success(self):
+        fd, output_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, output_path)
+
+        call_command(
+            'run_benchmarks', '--rows', '20', '--number', '10',
+            '--requests', '5', '--output', output_path, stdout=StringIO())
+
+        with open(output_path) as f:
+            results = json.load(f)
+
+        self.assertEqual(
+            set(results),
+            {'environment', 'micro', 'db', 'load'}
+        )
+        self.assertEqual(
+            set(results['db']),
+            {'get_or_create_short_url_hit@20', 'get_or_create_short_url_miss@20'}
+        )
+        self.assertEqual(results['load']['redirect_view']['count'], 5)
+        self.assertEqual(results['load']['short_url_view']['count'], 5)
+
+        # rows created by the miss and create benchmarks are removed
+        self.assertEqual(ShortUrl.objects.count(), 20)
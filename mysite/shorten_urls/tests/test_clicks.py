@@ -0,0 +1,85 @@
+import datetime
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import TestCase
+from django.utils import timezone
+
+from ..clicks import ClickBuffer, get_click_hour
+from ..models import ClickStats, ShortUrl
+
+
+class ClickBufferTest(TestCase):
+
+    def setUp(self):
+        self.short_url_path = ShortUrl.objects.create('https://www.fake.com').short_url_path
+        self.hour = datetime.datetime(2020, 12, 1, 18, tzinfo=datetime.timezone.utc)
+
+    def test_get_click_hour(self):
+        now = datetime.datetime(2020, 12, 1, 18, 28, 59, 1, tzinfo=datetime.timezone.utc)
+
+        self.assertEqual(
+            get_click_hour(now),
+            datetime.datetime(2020, 12, 1, 18, tzinfo=datetime.timezone.utc))
+
+    def test_record_does_not_touch_the_database(self):
+        buffer = ClickBuffer(flush_interval=None)
+
+        with self.assertNumQueries(0):
+            buffer.record(self.short_url_path)
+            buffer.record(self.short_url_path)
+
+        self.assertEqual(len(buffer), 1)
+
+    def test_flush(self):
+        buffer = ClickBuffer(flush_interval=None)
+        buffer.record(self.short_url_path, now=self.hour)
+        buffer.record(self.short_url_path, now=self.hour + timezone.timedelta(minutes=30))
+        buffer.record(self.short_url_path, now=self.hour + timezone.timedelta(hours=1))
+
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(
+            list(ClickStats.objects.order_by('hour').values_list('hour', 'clicks')),
+            [(self.hour, 2), (self.hour + timezone.timedelta(hours=1), 1)]
+        )
+
+    def test_flush_adds_to_existing_counters(self):
+        ClickStats.objects.create(short_url_path=self.short_url_path, hour=self.hour, clicks=5)
+        buffer = ClickBuffer(flush_interval=None)
+        buffer.record(self.short_url_path, now=self.hour)
+
+        buffer.flush()
+
+        self.assertEqual(ClickStats.objects.get().clicks, 6)
+
+    def test_flush_keeps_clicks_on_error(self):
+        buffer = ClickBuffer(flush_interval=None)
+        buffer.record(self.short_url_path, now=self.hour)
+
+        with mock.patch.object(ClickStats.objects, 'db_manager', side_effect=DatabaseError):
+            self.assertEqual(buffer.flush(), 0)
+
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(ClickStats.objects.get().clicks, 1)
+
+    @mock.patch('shorten_urls.clicks.threading.Thread')
+    def test_record_starts_flusher_once(self, mock_thread):
+        buffer = ClickBuffer(flush_interval=60)
+
+        buffer.record(self.short_url_path)
+        buffer.record(self.short_url_path)
+
+        mock_thread.assert_called_once()
+        mock_thread.return_value.start.assert_called_once_with()
+
+    @mock.patch('shorten_urls.clicks.threading.Thread')
+    def test_full_buffer_wakes_flusher(self, mock_thread):
+        buffer = ClickBuffer(flush_interval=60, max_size=2)
+
+        buffer.record(self.short_url_path, now=self.hour)
+        self.assertFalse(buffer._wakeup.is_set())
+
+        buffer.record(self.short_url_path, now=self.hour + timezone.timedelta(hours=1))
+        self.assertTrue(buffer._wakeup.is_set())
@@ -0,0 +1,162 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+
+from ..models import (ShortUrl, UrlPreviewCrawlTask,
+                      get_hashed_url_from_original_url)
+from ..snapshot import (RedirectSnapshotSegment, build_redirect_snapshot,
+                        read_manifest)
+
+
+class RunPreviewCrawlerCommandTest(TestCase):
+
+    @mock.patch('shorten_urls.utils.UrlPreviewFetcher.fetch_previews')
+    def test_once(self, mock_fetch):
+        mock_fetch.return_value = [{
+            'title': 'some title',
+            'description': 'some description',
+            'url': 'https://www.fake.com',
+            'image': 'https://www.fake.com/static/img1'
+        }]
+        short_url_object = ShortUrl.objects.create('https://www.fake.com')
+        UrlPreviewCrawlTask.objects.create(from_url=short_url_object)
+
+        out = StringIO()
+        call_command('run_preview_crawler', '--once', stdout=out)
+
+        self.assertEqual(out.getvalue(), 'crawled 1 previews\n')
+        self.assertEqual(
+            UrlPreviewCrawlTask.objects.get().status,
+            UrlPreviewCrawlTask.STATUS_DONE
+        )
+
+
+class RehashShortUrlsCommandTest(TestCase):
+
+    def test_success(self):
+        short_url_objects = [
+            ShortUrl.objects.create('https://www.fake.com/{}'.format(index))
+            for index in range(3)
+        ]
+        ShortUrl.objects.filter(id=short_url_objects[0].id).update(hashed_url=0)
+
+        out = StringIO()
+        with mock.patch('shorten_urls.fingerprints.URL_FINGERPRINT_ALGORITHM', 'blake2b'):
+            call_command('rehash_short_urls', '--batch-size', '2', stdout=out)
+
+            for short_url_object in short_url_objects:
+                self.assertEqual(
+                    ShortUrl.objects.get(id=short_url_object.id).hashed_url,
+                    get_hashed_url_from_original_url(short_url_object.original_url))
+
+        self.assertEqual(out.getvalue(), 'rehashed 3 short urls\n')
+
+    @override_settings(SHORT_URL_SHARDS=['default', 'shard_1'])
+    def test_several_shards(self):
+        with self.assertRaises(CommandError):
+            call_command('rehash_short_urls')
+
+
+class WarmCacheCommandTest(TestCase):
+
+    def setUp(self):
+        self.cache = LocMemCache('warm_cache_command_test', {})
+        patcher = mock.patch(
+            'shorten_urls.management.commands.warm_cache.cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_success(self):
+        short_url_object = ShortUrl.objects.create('https://www.fake.com')
+
+        out = StringIO()
+        call_command('warm_cache', '--skip-previews', stdout=out)
+
+        self.assertEqual(
+            self.cache.get('REDIRECT:' + short_url_object.short_url_path).value,
+            'https://www.fake.com')
+        self.assertTrue(out.getvalue().startswith('warmed 1 redirect keys ('))
+        self.assertTrue(out.getvalue().endswith('warmed 1 redirect keys\n'))
+
+    def test_invalid_top(self):
+        with self.assertRaises(CommandError):
+            call_command('warm_cache', '--top', '0')
+
+
+class BuildRedirectSnapshotCommandTest(TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'redirects.snapshot')
+
+    def get_segment(self, index=-1):
+        return RedirectSnapshotSegment(os.path.join(
+            os.path.dirname(self.path), read_manifest(self.path)['segments'][index]))
+
+    def test_success(self):
+        short_url_object = ShortUrl.objects.create('https://www.fake.com')
+
+        out = StringIO()
+        with override_settings(REDIRECT_SNAPSHOT_PATH=self.path):
+            call_command('build_redirect_snapshot', stdout=out)
+
+        self.assertTrue(out.getvalue().startswith('wrote 1 short urls to {} in '.format(self.path)))
+        self.assertEqual(
+            self.get_segment().get(short_url_object.id, short_url_object.random_offset),
+            'https://www.fake.com')
+
+    def test_output(self):
+        call_command('build_redirect_snapshot', '--output', self.path, stdout=StringIO())
+
+        self.assertEqual(len(self.get_segment()), 0)
+
+    def test_delta(self):
+        build_redirect_snapshot(self.path)
+        short_url_object = ShortUrl.objects.create('https://www.fake.com')
+
+        out = StringIO()
+        call_command('build_redirect_snapshot', '--output', self.path, '--delta', stdout=out)
+
+        self.assertTrue(out.getvalue().startswith('appended 1 short urls to '))
+        self.assertEqual(
+            self.get_segment().get(short_url_object.id, short_url_object.random_offset),
+            'https://www.fake.com')
+
+    def test_compact(self):
+        build_redirect_snapshot(self.path)
+        call_command('build_redirect_snapshot', '--output', self.path, '--delta', stdout=StringIO())
+        ShortUrl.objects.create('https://www.fake.com')
+        call_command('build_redirect_snapshot', '--output', self.path, '--delta', stdout=StringIO())
+
+        out = StringIO()
+        call_command('build_redirect_snapshot', '--output', self.path, '--compact', stdout=out)
+
+        self.assertTrue(out.getvalue().startswith('compacted 2 segments in '))
+        self.assertEqual(len(read_manifest(self.path)['segments']), 1)
+
+    @mock.patch('shorten_urls.management.commands.build_redirect_snapshot.time.sleep')
+    def test_follow_continues_after_error(self, mock_sleep):
+        mock_sleep.side_effect = [None, KeyboardInterrupt]
+
+        out = StringIO()
+        with mock.patch(
+                'shorten_urls.management.commands.build_redirect_snapshot.append_redirect_snapshot',
+                side_effect=[DatabaseError, 2]) as mock_append:
+            with self.assertLogs('shorten_urls', 'ERROR'):
+                with self.assertRaises(KeyboardInterrupt):
+                    call_command(
+                        'build_redirect_snapshot', '--output', self.path, '--follow', stdout=out)
+
+        self.assertEqual(mock_append.call_count, 2)
+        self.assertEqual(out.getvalue(), 'appended 2 short urls\n')
+
+    def test_without_path(self):
+        with self.assertRaises(CommandError):
+            call_command('build_redirect_snapshot')
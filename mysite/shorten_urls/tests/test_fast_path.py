@@ -0,0 +1,167 @@
+import http.client as httplib
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+
+from ..configs import REDIRECT_NOT_FOUND_CACHE_VALUE
+from ..fast_path import (FAST_PATH_VIEW, RedirectFastPathASGI,
+                         RedirectFastPathWSGI, get_fast_path_response,
+                         match_short_url)
+from ..metrics import registry
+from ..models import ShortUrl
+from ..utils import b62_encode
+
+
+class MatchShortUrlTest(SimpleTestCase):
+
+    def test_match(self):
+        self.assertEqual(match_short_url('GET', '/abcde'), 'abcde')
+
+    def test_no_match(self):
+        self.assertIsNone(match_short_url('POST', '/abcde'))
+        self.assertIsNone(match_short_url('HEAD', '/abcde'))
+        self.assertIsNone(match_short_url('GET', '/abcd'))
+        self.assertIsNone(match_short_url('GET', '/abcdef'))
+        self.assertIsNone(match_short_url('GET', '/abcd@'))
+        self.assertIsNone(match_short_url('GET', '/abcde/'))
+        self.assertIsNone(match_short_url('GET', '/'))
+
+
+class GetFastPathResponseTest(SimpleTestCase):
+
+    def test_redirect(self):
+        status, headers, body = get_fast_path_response('abcde', 'https://www.fake.com/ü')
+
+        self.assertEqual(status, httplib.FOUND)
+        self.assertIn(('Location', 'https://www.fake.com/%C3%BC'), headers)
+        self.assertEqual(body, b'')
+
+    def test_not_found(self):
+        for url in [None, REDIRECT_NOT_FOUND_CACHE_VALUE]:
+            status, _, body = get_fast_path_response('abcde', url)
+
+            self.assertEqual(status, httplib.NOT_FOUND)
+            self.assertEqual(body, b'<h1>404 Not Found</h1>')
+
+    def test_other_scheme(self):
+        self.assertIsNone(get_fast_path_response('abcde', 'javascript:alert(1)'))
+
+    @override_settings(ENABLE_CLICK_TRACKING=True)
+    @mock.patch('shorten_urls.fast_path.click_buffer')
+    def test_records_click(self, mock_click_buffer):
+        get_fast_path_response('abcde', 'https://www.fake.com')
+
+        mock_click_buffer.record.assert_called_once_with('abcde')
+
+
+class RedirectFastPathWSGITest(TestCase):
+
+    def setUp(self):
+        self.short_url_object = ShortUrl.objects.create('https://www.fake.com')
+
+        self.application = mock.Mock(return_value=[b'django'])
+        self.fast_path = RedirectFastPathWSGI(self.application)
+        self.start_response = mock.Mock()
+
+    def call(self, path, method='GET'):
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': path}
+        return b''.join(self.fast_path(environ, self.start_response))
+
+    def test_redirect(self):
+        registry.clear()
+        self.addCleanup(registry.clear)
+
+        body = self.call('/{}'.format(self.short_url_object.short_url_path))
+
+        self.assertEqual(body, b'')
+        self.application.assert_not_called()
+        status, headers = self.start_response.call_args[0]
+        self.assertEqual(status, '302 Found')
+        self.assertIn(('Location', 'https://www.fake.com'), headers)
+        self.assertIn('view="{}"'.format(FAST_PATH_VIEW), registry.render_prometheus())
+
+    def test_records_db_queries(self):
+        registry.clear()
+        self.addCleanup(registry.clear)
+
+        self.call('/{}'.format(self.short_url_object.short_url_path))
+
+        metrics = registry.render_prometheus()
+        self.assertIn(
+            'shorten_urls_db_queries_total{{view="{}"}} 1'.format(FAST_PATH_VIEW), metrics)
+        self.assertIn('view="{}",component="db"'.format(FAST_PATH_VIEW), metrics)
+
+    def test_not_found(self):
+        body = self.call('/{}'.format(b62_encode(int(1E8) + 9999)))
+
+        self.assertEqual(body, b'<h1>404 Not Found</h1>')
+        self.assertEqual(self.start_response.call_args[0][0], '404 Not Found')
+
+    def test_other_requests_go_to_django(self):
+        for method, path in [('GET', '/'), ('GET', '/api/v1/short_urls/original_url'),
+                             ('POST', '/{}'.format(self.short_url_object.short_url_path))]:
+            self.assertEqual(self.call(path, method=method), b'django')
+
+        self.assertEqual(self.application.call_count, 3)
+
+    @mock.patch('shorten_urls.fast_path.get_original_url', side_effect=ValueError)
+    def test_lookup_error_goes_to_django(self, mock_get_original_url):
+        self.assertEqual(self.call('/abcde'), b'django')
+        self.start_response.assert_not_called()
+
+    def test_wsgi_application(self):
+        from mysite.wsgi import application
+
+        for path, status in [('/{}'.format(self.short_url_object.short_url_path), '302 Found'),
+                             ('/', '200 OK')]:
+            environ = RequestFactory().get(path).environ
+            b''.join(application(environ, self.start_response))
+
+            self.assertEqual(self.start_response.call_args[0][0], status)
+
+
+class RedirectFastPathASGITest(TestCase):
+
+    def setUp(self):
+        self.short_url_object = ShortUrl.objects.create('https://www.fake.com')
+
+        self.application = mock.AsyncMock()
+        self.fast_path = RedirectFastPathASGI(self.application)
+
+    def call(self, scope):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(self.fast_path)(scope, mock.AsyncMock(), send)
+        return messages
+
+    @mock.patch('shorten_urls.fast_path.async_get_original_url')
+    def test_redirect(self, mock_get_original_url):
+        mock_get_original_url.return_value = 'https://www.fake.com'
+
+        messages = self.call({'type': 'http', 'method': 'GET', 'path': '/abcde'})
+
+        mock_get_original_url.assert_awaited_once_with('abcde')
+        self.application.assert_not_awaited()
+        self.assertEqual(messages[0]['status'], httplib.FOUND)
+        self.assertIn((b'Location', b'https://www.fake.com'), messages[0]['headers'])
+        self.assertEqual(messages[1], {'type': 'http.response.body', 'body': b''})
+
+    @mock.patch('shorten_urls.fast_path.async_get_original_url', side_effect=ValueError)
+    def test_lookup_error_goes_to_django(self, mock_get_original_url):
+        scope = {'type': 'http', 'method': 'GET', 'path': '/abcde'}
+
+        self.assertEqual(self.call(scope), [])
+        self.application.assert_awaited_once_with(scope, mock.ANY, mock.ANY)
+
+    def test_other_requests_go_to_django(self):
+        for scope in [{'type': 'lifespan'},
+                      {'type': 'http', 'method': 'GET', 'path': '/'},
+                      {'type': 'http', 'method': 'POST', 'path': '/abcde'}]:
+            self.call(scope)
+
+        self.assertEqual(self.application.await_count, 3)
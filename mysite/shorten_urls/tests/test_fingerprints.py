@@ -0,0 +1,50 @@
+import hashlib
+from unittest import mock, skipIf
+
+from django.test import TestCase
+
+from ..fingerprints import (fingerprint_url, fingerprint_urls,
+                            get_fingerprint_function, xxhash)
+
+
+class FingerprintTest(TestCase):
+
+    url = 'https://www.fake.com'
+
+    def test_sha256(self):
+        expected = int.from_bytes(
+            hashlib.sha256(self.url.encode('utf-8')).digest()[:8], 'big', signed=True)
+
+        self.assertEqual(fingerprint_url(self.url, 'sha256'), expected)
+
+    def test_blake2b(self):
+        expected = int.from_bytes(
+            hashlib.blake2b(self.url.encode('utf-8'), digest_size=8).digest(),
+            'big', signed=True)
+
+        self.assertEqual(fingerprint_url(self.url, 'blake2b'), expected)
+
+    @skipIf(xxhash is None, 'xxhash is not installed')
+    def test_xxhash(self):
+        expected = int.from_bytes(
+            xxhash.xxh64_digest(self.url.encode('utf-8')), 'big', signed=True)
+
+        self.assertEqual(fingerprint_url(self.url, 'xxhash'), expected)
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(ValueError):
+            get_fingerprint_function('md4')
+
+    @mock.patch('shorten_urls.fingerprints.URL_FINGERPRINT_ALGORITHM', 'blake2b')
+    def test_default_algorithm(self):
+        self.assertEqual(fingerprint_url(self.url), fingerprint_url(self.url, 'blake2b'))
+
+    def test_no_state_between_calls(self):
+        self.assertEqual(fingerprint_url(self.url), fingerprint_url(self.url))
+
+    def test_fingerprint_urls(self):
+        urls = ['https://www.fake.com/{}'.format(index) for index in range(5)]
+
+        self.assertEqual(
+            fingerprint_urls(urls, 'blake2b'),
+            [fingerprint_url(url, 'blake2b') for url in urls])
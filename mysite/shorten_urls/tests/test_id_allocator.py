@@ -0,0 +1,53 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from ..id_allocator import IdBlockAllocator
+
+
+class IdBlockAllocatorTest(TestCase):
+
+    def setUp(self):
+        self.next_start = 1
+        self.reserve_block = mock.Mock(side_effect=self.fake_reserve_block)
+
+    def fake_reserve_block(self, size):
+        start = self.next_start
+        self.next_start += size
+        return start
+
+    def test_allocate_from_one_block(self):
+        allocator = IdBlockAllocator(self.reserve_block, 3)
+
+        self.assertEqual(allocator.allocate(), [1])
+        self.assertEqual(allocator.allocate(2), [2, 3])
+        self.reserve_block.assert_called_once_with(3)
+
+    def test_allocate_across_blocks(self):
+        allocator = IdBlockAllocator(self.reserve_block, 3)
+        allocator.allocate(2)
+
+        self.assertEqual(allocator.allocate(2), [3, 4])
+        self.assertEqual(self.reserve_block.call_count, 2)
+
+    def test_allocate_more_than_block_size(self):
+        allocator = IdBlockAllocator(self.reserve_block, 3)
+
+        self.assertEqual(allocator.allocate(5), [1, 2, 3, 4, 5])
+        self.reserve_block.assert_called_once_with(5)
+
+    def test_reset(self):
+        allocator = IdBlockAllocator(self.reserve_block, 3)
+        allocator.allocate()
+        allocator.reset()
+
+        self.assertEqual(allocator.allocate(), [4])
+
+    @mock.patch('shorten_urls.id_allocator.os.getpid')
+    def test_forked_process_reserves_new_block(self, mock_getpid):
+        mock_getpid.return_value = 1
+        allocator = IdBlockAllocator(self.reserve_block, 3)
+        allocator.allocate()
+
+        mock_getpid.return_value = 2
+        self.assertEqual(allocator.allocate(), [4])
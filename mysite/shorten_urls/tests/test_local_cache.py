@@ -0,0 +1,68 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from ..local_cache import LRUCache
+
+
+class LRUCacheTest(TestCase):
+
+    def test_get_miss(self):
+        local_cache = LRUCache(2)
+
+        self.assertIsNone(local_cache.get('a'))
+        self.assertEqual(local_cache.get('a', 'default'), 'default')
+        self.assertEqual(local_cache.misses, 2)
+        self.assertEqual(local_cache.hits, 0)
+
+    def test_get_hit(self):
+        local_cache = LRUCache(2)
+        local_cache.set('a', 1)
+
+        self.assertEqual(local_cache.get('a'), 1)
+        self.assertEqual(local_cache.hits, 1)
+        self.assertEqual(local_cache.misses, 0)
+
+    def test_evict_least_recently_used(self):
+        local_cache = LRUCache(2)
+        local_cache.set('a', 1)
+        local_cache.set('b', 2)
+        local_cache.get('a')
+        local_cache.set('c', 3)
+
+        self.assertEqual(len(local_cache), 2)
+        self.assertEqual(local_cache.get('a'), 1)
+        self.assertIsNone(local_cache.get('b'))
+        self.assertEqual(local_cache.get('c'), 3)
+
+    def test_zero_max_size_disables_cache(self):
+        local_cache = LRUCache(0)
+        local_cache.set('a', 1)
+
+        self.assertEqual(len(local_cache), 0)
+
+    @mock.patch('shorten_urls.local_cache.time')
+    def test_expired(self, mock_time):
+        mock_time.monotonic.return_value = 100
+        local_cache = LRUCache(2, timeout=10)
+        local_cache.set('a', 1)
+        local_cache.set('b', 2, timeout=30)
+
+        mock_time.monotonic.return_value = 110
+        self.assertIsNone(local_cache.get('a'))
+        self.assertEqual(local_cache.get('b'), 2)
+        self.assertEqual(len(local_cache), 1)
+
+    def test_delete_and_clear(self):
+        local_cache = LRUCache(2)
+        local_cache.set('a', 1)
+        local_cache.set('b', 2)
+
+        local_cache.delete('a')
+        self.assertIsNone(local_cache.get('a'))
+
+        local_cache.clear()
+        self.assertDictEqual(
+            local_cache.stats(),
+            {'size': 0, 'max_size': 2, 'hits': 0, 'misses': 0}
+        )
@@ -1,13 +1,16 @@
 from unittest import mock
 
+from django.core.cache.backends.locmem import LocMemCache
 from django.test import TestCase
 from django.utils import timezone
 from requests.exceptions import RequestException
 
 from . import MockResposne
 from ..configs import URL_B62_BASE_NUM, URL_B62_OFFSET_SIZE
-from ..logics import ShortUrlLogics, UrlPreviewDataLogic, decode_short_url
-from ..models import ShortUrl, UrlPreviewData
+from ..logics import (CacheWarmer, ShortUrlBulkLogics, ShortUrlIdRangeFilter,
+                      ShortUrlLogics, UrlPreviewCrawlQueue,
+                      UrlPreviewDataLogic, decode_short_url)
+from ..models import ShortUrl, UrlPreviewCrawlTask, UrlPreviewData
 from ..utils import b62_encode
 
 
@@ -82,9 +85,9 @@ class ShortUrlLogicsTest(TestCase):
         mock_rand.randint.return_value = 1
         url_1 = 'https://www.google.com'
         url_2 = 'https://www.fake.com'
-        mock_model_hash.return_value = mock_logic_hash.return_value = 'a' * 32
+        mock_model_hash.return_value = mock_logic_hash.return_value = 42
 
-        ShortUrl.objects.create(
+        short_url_1 = ShortUrl.objects.create(
             original_url=url_1,
         )
         ShortUrl.objects.create(
@@ -94,13 +97,45 @@ class ShortUrlLogicsTest(TestCase):
         logic = ShortUrlLogics(url_1)
         result = logic.get_or_create_short_url()
 
-        expect_short_url_path = b62_encode(2 * int(1E8) + 1)
+        expect_short_url_path = b62_encode(2 * int(1E8) + short_url_1.id)
         self.assertEqual(result.short_url_path, expect_short_url_path)
         self.assertEqual(
-            ShortUrl.objects.filter(hashed_url='a' * 32).count(),
+            ShortUrl.objects.filter(hashed_url=42).count(),
             2
         )
 
+    def test_get_or_create_short_url_hit_costs_one_query(self):
+        url = 'https://www.google.com'
+        short_url_object = ShortUrl.objects.create(original_url=url)
+
+        logic = ShortUrlLogics(url)
+        with self.assertNumQueries(1):
+            result = logic.get_or_create_short_url()
+
+        self.assertEqual(result, short_url_object)
+
+    def test_get_or_create_short_url_success_when_concurrent_insert_wins(self):
+        url = 'https://www.google.com'
+        short_url_object = ShortUrl.objects.create(original_url=url)
+
+        logic = ShortUrlLogics(url)
+        with mock.patch.object(ShortUrl.objects, 'filter') as mock_filter:
+            mock_filter.return_value.first.return_value = None
+            result = logic.get_or_create_short_url()
+
+        self.assertEqual(result, short_url_object)
+        self.assertEqual(ShortUrl.objects.count(), 1)
+
+    def test_get_or_create_short_url_reuses_canonical_url(self):
+        short_url_object = ShortUrlLogics('https://www.fake.com').get_or_create_short_url()
+
+        for url in ['HTTPS://WWW.FAKE.COM/', 'https://www.fake.com:443',
+                    'https://www.fake.com/?utm_source=x']:
+            self.assertEqual(ShortUrlLogics(url).get_or_create_short_url(), short_url_object)
+
+        self.assertEqual(ShortUrl.objects.count(), 1)
+        self.assertEqual(short_url_object.original_url, 'https://www.fake.com')
+
     @mock.patch('shorten_urls.logics.ShortUrlLogics.get_or_create_short_url')
     def test_get_short_url_info(self, mock_get_or_create):
         url = 'https://www.fake.com'
@@ -113,7 +148,7 @@ class ShortUrlLogicsTest(TestCase):
         logic = ShortUrlLogics(url)
         result = logic.get_short_url_info()
 
-        expect_short_url_path = b62_encode(2 * int(1E8) + 1)
+        expect_short_url_path = b62_encode(2 * int(1E8) + short_url.id)
         self.assertDictEqual(
             result,
              {
@@ -123,6 +158,97 @@ class ShortUrlLogicsTest(TestCase):
         )
 
 
+class ShortUrlBulkLogicsTest(TestCase):
+
+    def test_get_or_create_short_urls_success_by_create(self):
+        urls = ['https://www.google.com', 'https://www.fake.com']
+
+        logic = ShortUrlBulkLogics(urls)
+        result = logic.get_or_create_short_urls()
+
+        self.assertEqual(ShortUrl.objects.count(), 2)
+        self.assertEqual(
+            {url: obj.original_url for url, obj in result.items()},
+            {url: url for url in urls}
+        )
+
+    def test_get_or_create_short_urls_success_by_get(self):
+        url = 'https://www.google.com'
+        short_url_object = ShortUrl.objects.create(original_url=url)
+
+        logic = ShortUrlBulkLogics([url, 'https://www.fake.com'])
+        result = logic.get_or_create_short_urls()
+
+        self.assertEqual(ShortUrl.objects.count(), 2)
+        self.assertEqual(result[url], short_url_object)
+
+    def test_get_or_create_short_urls_in_batches(self):
+        urls = ['https://www.fake.com/{}'.format(index) for index in range(10)]
+        ShortUrl.objects.create(original_url=urls[0])
+
+        logic = ShortUrlBulkLogics(urls, batch_size=3)
+        result = logic.get_or_create_short_urls()
+
+        self.assertEqual(ShortUrl.objects.count(), 10)
+        self.assertEqual(len(result), 10)
+
+    @mock.patch('shorten_urls.models.get_hashed_url_from_original_url')
+    @mock.patch('shorten_urls.logics.get_hashed_url_from_original_url')
+    def test_get_or_create_short_urls_success_when_hash_collision_occurs(self,
+                                                                        mock_logic_hash,
+                                                                        mock_model_hash):
+        url_1 = 'https://www.google.com'
+        url_2 = 'https://www.fake.com'
+        mock_model_hash.return_value = mock_logic_hash.return_value = 42
+
+        short_url_object = ShortUrl.objects.create(original_url=url_1)
+
+        logic = ShortUrlBulkLogics([url_1, url_2])
+        result = logic.get_or_create_short_urls()
+
+        self.assertEqual(result[url_1], short_url_object)
+        self.assertEqual(result[url_2].original_url, url_2)
+        self.assertEqual(ShortUrl.objects.filter(hashed_url=42).count(), 2)
+
+    def test_get_or_create_short_urls_success_when_concurrent_insert_wins(self):
+        url = 'https://www.google.com'
+        short_url_object = ShortUrl.objects.create(original_url=url)
+
+        logic = ShortUrlBulkLogics([url, 'https://www.fake.com'])
+        with mock.patch.object(ShortUrlBulkLogics, '_get_existing_short_urls',
+                               side_effect=[{}, {}]):
+            logic.get_or_create_short_urls()
+
+        self.assertEqual(ShortUrl.objects.count(), 2)
+        self.assertEqual(ShortUrl.objects.get(original_url=url), short_url_object)
+
+    def test_get_or_create_short_urls_reuses_canonical_url(self):
+        short_url_object = ShortUrl.objects.create(original_url='https://www.fake.com')
+        urls = ['HTTPS://WWW.FAKE.COM/', 'https://www.google.com?b=1&a=2',
+                'https://www.google.com/?a=2&b=1&fbclid=x']
+
+        logic = ShortUrlBulkLogics(urls)
+        result = logic.get_or_create_short_urls()
+
+        self.assertEqual(ShortUrl.objects.count(), 2)
+        self.assertEqual(result[urls[0]], short_url_object)
+        self.assertEqual(result[urls[1]], result[urls[2]])
+        self.assertEqual(result[urls[1]].original_url, urls[1])
+
+    def test_get_short_url_infos_keeps_input_order(self):
+        urls = ['https://www.fake.com', 'https://www.google.com', 'https://www.fake.com']
+
+        logic = ShortUrlBulkLogics(urls)
+        result = logic.get_short_url_infos()
+
+        self.assertEqual([info['original_url'] for info in result], urls)
+        self.assertEqual(result[0]['short_url_path'], result[2]['short_url_path'])
+        self.assertEqual(
+            result[1]['short_url_path'],
+            ShortUrl.objects.get(original_url=urls[1]).short_url_path
+        )
+
+
 class UrlPreviewDataLogicTest(TestCase):
 
     def setUp(self):
@@ -303,7 +429,7 @@ class UrlPreviewDataLogicTest(TestCase):
 
         self.assertIsNone(url_preview_logic.get_or_create_url_preview_data())
 
-    @mock.patch('shorten_urls.logics.timezone')
+    @mock.patch('shorten_urls.models.timezone')
     @mock.patch('shorten_urls.logics.UrlPreviewDataLogic.get_url_preview_data')
     def test_get_or_create_success_and_update(self, mock_get, mock_tz):
         mock_get.return_value = {
@@ -322,9 +448,9 @@ class UrlPreviewDataLogicTest(TestCase):
             image_url='https://www.oldurl.com/static/img1',
         )
 
-        two_days_ago = timezone.now() - timezone.timedelta(days=2)
+        two_days_later = timezone.now() + timezone.timedelta(days=2)
         mock_tz.timedelta = timezone.timedelta
-        mock_tz.now.return_value = two_days_ago
+        mock_tz.now.return_value = two_days_later
 
         new_object = url_preview_logic.get_or_create_url_preview_data()
 
@@ -372,6 +498,313 @@ class UrlPreviewDataLogicTest(TestCase):
         )
 
 
+class UrlPreviewDataLogicEnqueueTest(TestCase):
+
+    def setUp(self):
+        self.url = 'https://www.fake.com'
+
+    def test_enqueue_when_no_preview_data(self):
+        logic = UrlPreviewDataLogic(self.url)
+
+        self.assertEqual(
+            logic.get_or_enqueue_url_preview_data_info(),
+            (UrlPreviewCrawlTask.STATUS_PENDING, {})
+        )
+        self.assertEqual(UrlPreviewCrawlTask.objects.count(), 1)
+
+    def test_return_preview_data_without_enqueue(self):
+        logic = UrlPreviewDataLogic(self.url)
+        preview_object = UrlPreviewData.objects.create(
+            from_url=logic.short_url_object,
+            title='title', description='description',
+            url='https://www.fake.com',
+            image_url='https://www.fake.com/static/img1'
+        )
+
+        self.assertEqual(
+            logic.get_or_enqueue_url_preview_data_info(),
+            (UrlPreviewCrawlTask.STATUS_DONE, preview_object.as_dict())
+        )
+        self.assertEqual(UrlPreviewCrawlTask.objects.count(), 0)
+
+    @mock.patch('shorten_urls.models.timezone')
+    def test_return_expired_preview_data_and_enqueue_refresh(self, mock_tz):
+        logic = UrlPreviewDataLogic(self.url)
+        UrlPreviewData.objects.create(
+            from_url=logic.short_url_object,
+            title='title', description='description',
+            url='https://www.fake.com',
+            image_url='https://www.fake.com/static/img1'
+        )
+        UrlPreviewCrawlTask.objects.create(
+            from_url=logic.short_url_object,
+            status=UrlPreviewCrawlTask.STATUS_DONE
+        )
+
+        mock_tz.timedelta = timezone.timedelta
+        mock_tz.now.return_value = timezone.now() + timezone.timedelta(days=2)
+
+        status, info = logic.get_or_enqueue_url_preview_data_info()
+
+        self.assertEqual(status, UrlPreviewCrawlTask.STATUS_DONE)
+        self.assertEqual(info['title'], 'title')
+        self.assertEqual(
+            UrlPreviewCrawlTask.objects.get().status,
+            UrlPreviewCrawlTask.STATUS_PENDING
+        )
+
+    def test_failed_task(self):
+        logic = UrlPreviewDataLogic(self.url)
+        UrlPreviewCrawlTask.objects.create(
+            from_url=logic.short_url_object,
+            status=UrlPreviewCrawlTask.STATUS_FAILED
+        )
+
+        self.assertEqual(
+            logic.get_or_enqueue_url_preview_data_info(),
+            (UrlPreviewCrawlTask.STATUS_FAILED, {})
+        )
+
+
+class UrlPreviewCrawlQueueTest(TestCase):
+
+    def setUp(self):
+        self.short_url_object = ShortUrl.objects.create('https://www.fake.com')
+        self.preview_fetcher = mock.Mock()
+        self.queue = UrlPreviewCrawlQueue(
+            task_timeout=60, max_attempts=2, retry_interval=3600,
+            preview_fetcher=self.preview_fetcher)
+
+    def test_enqueue_create(self):
+        task = self.queue.enqueue(self.short_url_object)
+
+        self.assertEqual(task.status, UrlPreviewCrawlTask.STATUS_PENDING)
+        self.assertEqual(UrlPreviewCrawlTask.objects.count(), 1)
+
+    def test_enqueue_existing_pending_task(self):
+        self.queue.enqueue(self.short_url_object)
+        task = self.queue.enqueue(self.short_url_object, refresh=True)
+
+        self.assertEqual(task.status, UrlPreviewCrawlTask.STATUS_PENDING)
+        self.assertEqual(UrlPreviewCrawlTask.objects.count(), 1)
+
+    def test_enqueue_done_task_only_requeued_on_refresh(self):
+        UrlPreviewCrawlTask.objects.create(
+            from_url=self.short_url_object,
+            status=UrlPreviewCrawlTask.STATUS_DONE, attempts=1
+        )
+
+        task = self.queue.enqueue(self.short_url_object)
+        self.assertEqual(task.status, UrlPreviewCrawlTask.STATUS_DONE)
+
+        task = self.queue.enqueue(self.short_url_object, refresh=True)
+        self.assertEqual(task.status, UrlPreviewCrawlTask.STATUS_PENDING)
+        self.assertEqual(UrlPreviewCrawlTask.objects.get().attempts, 0)
+
+    def test_enqueue_failed_task_requeued_after_retry_interval(self):
+        task = UrlPreviewCrawlTask.objects.create(
+            from_url=self.short_url_object,
+            status=UrlPreviewCrawlTask.STATUS_FAILED
+        )
+
+        task = self.queue.enqueue(self.short_url_object)
+        self.assertEqual(task.status, UrlPreviewCrawlTask.STATUS_FAILED)
+
+        UrlPreviewCrawlTask.objects.update(
+            last_update=timezone.now() - timezone.timedelta(seconds=3601))
+
+        task = self.queue.enqueue(self.short_url_object)
+        self.assertEqual(task.status, UrlPreviewCrawlTask.STATUS_PENDING)
+
+    def test_claim(self):
+        self.queue.enqueue(self.short_url_object)
+
+        tasks = self.queue.claim(batch_size=10)
+
+        self.assertEqual(len(tasks), 1)
+        self.assertEqual(tasks[0].status, UrlPreviewCrawlTask.STATUS_RUNNING)
+        self.assertEqual(tasks[0].attempts, 1)
+
+        # already claimed
+        self.assertEqual(self.queue.claim(batch_size=10), [])
+
+    def test_claim_timeout_running_task(self):
+        UrlPreviewCrawlTask.objects.create(
+            from_url=self.short_url_object,
+            status=UrlPreviewCrawlTask.STATUS_RUNNING, attempts=1
+        )
+        self.assertEqual(self.queue.claim(batch_size=10), [])
+
+        UrlPreviewCrawlTask.objects.update(
+            last_update=timezone.now() - timezone.timedelta(seconds=61))
+
+        tasks = self.queue.claim(batch_size=10)
+        self.assertEqual(len(tasks), 1)
+        self.assertEqual(tasks[0].attempts, 2)
+
+    def test_run_once_success(self):
+        self.preview_fetcher.fetch_previews.return_value = [{
+            'title': 'some title',
+            'description': 'some description',
+            'url': 'https://www.fake.com',
+            'image': 'https://www.fake.com/static/img1'
+        }]
+        self.queue.enqueue(self.short_url_object)
+
+        self.assertEqual(self.queue.run_once(batch_size=10), 1)
+
+        self.preview_fetcher.fetch_previews.assert_called_once_with(
+            ['https://www.fake.com'])
+        self.assertEqual(
+            UrlPreviewCrawlTask.objects.get().status,
+            UrlPreviewCrawlTask.STATUS_DONE
+        )
+        self.assertEqual(UrlPreviewData.objects.get().title, 'some title')
+
+    def test_run_once_update_existing_preview_data(self):
+        UrlPreviewData.objects.create(
+            from_url=self.short_url_object,
+            title='old title', description='old description',
+            url='https://www.oldurl.com',
+            image_url='https://www.oldurl.com/static/img1'
+        )
+        self.preview_fetcher.fetch_previews.return_value = [{
+            'title': 'some title',
+            'description': 'some description',
+            'url': 'https://www.fake.com',
+            'image': 'https://www.fake.com/static/img1'
+        }]
+        self.queue.enqueue(self.short_url_object)
+
+        self.queue.run_once(batch_size=10)
+
+        self.assertEqual(UrlPreviewData.objects.count(), 1)
+        self.assertEqual(UrlPreviewData.objects.get().title, 'some title')
+
+    def test_run_once_retry_then_failed(self):
+        self.preview_fetcher.fetch_previews.return_value = [{}]
+        self.queue.enqueue(self.short_url_object)
+
+        self.queue.run_once(batch_size=10)
+        self.assertEqual(
+            UrlPreviewCrawlTask.objects.get().status,
+            UrlPreviewCrawlTask.STATUS_PENDING
+        )
+
+        self.queue.run_once(batch_size=10)
+        self.assertEqual(
+            UrlPreviewCrawlTask.objects.get().status,
+            UrlPreviewCrawlTask.STATUS_FAILED
+        )
+        self.assertEqual(self.queue.run_once(batch_size=10), 0)
+
+
+class ShortUrlIdRangeFilterTest(TestCase):
+
+    def test_not_positive_id(self):
+        id_range_filter = ShortUrlIdRangeFilter(refresh_interval=60)
+
+        with self.assertNumQueries(0):
+            self.assertFalse(id_range_filter.might_exist(0))
+
+    def test_id_within_known_range(self):
+        short_url_object = ShortUrl.objects.create('https://www.fake.com')
+        id_range_filter = ShortUrlIdRangeFilter(refresh_interval=60)
+        id_range_filter.refresh()
+
+        with self.assertNumQueries(0):
+            self.assertTrue(id_range_filter.might_exist(short_url_object.id))
+
+    def test_id_within_margin(self):
+        short_url_object = ShortUrl.objects.create('https://www.fake.com')
+        id_range_filter = ShortUrlIdRangeFilter(refresh_interval=60, margin=10)
+        id_range_filter.refresh()
+
+        with self.assertNumQueries(0):
+            self.assertTrue(id_range_filter.might_exist(short_url_object.id + 10))
+            self.assertFalse(id_range_filter.might_exist(short_url_object.id + 11))
+
+    def test_id_beyond_range_refreshes(self):
+        id_range_filter = ShortUrlIdRangeFilter(refresh_interval=60)
+        id_range_filter.refresh()
+
+        short_url_object = ShortUrl.objects.create('https://www.fake.com')
+
+        # refreshed recently, so the new row is not visible yet
+        with self.assertNumQueries(0):
+            self.assertFalse(id_range_filter.might_exist(short_url_object.id))
+
+        id_range_filter.refresh_interval = 0
+        with self.assertNumQueries(2):
+            self.assertTrue(id_range_filter.might_exist(short_url_object.id))
+
+    def test_refresh_includes_allocated_ids(self):
+        ShortUrl.objects.id_allocator.reset()
+        allocated_id = ShortUrl.objects.allocate_ids()[0]
+        id_range_filter = ShortUrlIdRangeFilter(refresh_interval=60)
+        id_range_filter.refresh()
+
+        # reserved ids count even before their rows are inserted
+        with self.assertNumQueries(0):
+            self.assertTrue(id_range_filter.might_exist(allocated_id))
+
+
+class CacheWarmerTest(TestCase):
+
+    def setUp(self):
+        self.cache = LocMemCache('warm_cache_test', {})
+        self.short_url_objects = [
+            ShortUrl.objects.create('https://www.fake.com/{}'.format(index))
+            for index in range(5)
+        ]
+
+    def create_preview_data(self, short_url_object):
+        return UrlPreviewData.objects.create(
+            from_url=short_url_object,
+            title='title', description='description',
+            url=short_url_object.original_url, image_url='https://www.fake.com/a.png',
+        )
+
+    def test_warm_redirects(self):
+        warmer = CacheWarmer(self.cache, chunk_size=2)
+
+        self.assertEqual(list(warmer.warm_redirects()), [2, 2, 1])
+        for short_url_object in self.short_url_objects:
+            self.assertEqual(
+                self.cache.get('REDIRECT:' + short_url_object.short_url_path).value,
+                short_url_object.original_url)
+
+    def test_warm_redirects_top(self):
+        warmer = CacheWarmer(self.cache, top=2)
+
+        self.assertEqual(list(warmer.warm_redirects()), [2])
+        self.assertIsNone(
+            self.cache.get('REDIRECT:' + self.short_url_objects[2].short_url_path))
+        self.assertIsNotNone(
+            self.cache.get('REDIRECT:' + self.short_url_objects[3].short_url_path))
+
+    def test_warm_previews(self):
+        for short_url_object in self.short_url_objects[:2]:
+            self.create_preview_data(short_url_object)
+        expired = self.create_preview_data(self.short_url_objects[2])
+        UrlPreviewData.objects.filter(id=expired.id).update(
+            last_update=timezone.now() - timezone.timedelta(days=2))
+
+        warmer = CacheWarmer(self.cache)
+
+        self.assertEqual(list(warmer.warm_previews()), [2])
+        self.assertEqual(
+            self.cache.get('GETPREVIEW:https://www.fake.com/0').value,
+            {
+                'title': 'title',
+                'description': 'description',
+                'url': 'https://www.fake.com/0',
+                'image_url': 'https://www.fake.com/a.png',
+            }
+        )
+        self.assertIsNone(self.cache.get('GETPREVIEW:https://www.fake.com/2'))
+
+
 class DecodeShortUrlTest(TestCase):
 
     def test_short_url_too_long(self):
@@ -0,0 +1,156 @@
+import http.client as httplib
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from ..metrics import (BACKGROUND_VIEW, COMPONENT_CACHE, Histogram,
+                       MetricsRegistry, RequestTimings, TimedCache,
+                       end_request_timings, registry, start_request_timings,
+                       timed)
+from ..models import ShortUrl
+
+
+class HistogramTest(TestCase):
+
+    def test_observe(self):
+        histogram = Histogram(buckets=[0.1, 1])
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(3)
+
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(list(histogram.cumulative_counts()), [2, 3, 4])
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 3.65)
+
+
+class MetricsRegistryTest(TestCase):
+
+    def test_render_prometheus(self):
+        metrics_registry = MetricsRegistry(buckets=[0.1])
+        timings = RequestTimings()
+        timings.add('cache', 0.05)
+        timings.db_queries = 2
+
+        metrics_registry.observe_request('ShortUrlView', 0.5, timings)
+
+        self.assertEqual(
+            metrics_registry.render_prometheus(),
+            '# HELP shorten_urls_duration_seconds Time spent per view and component.\n'
+            '# TYPE shorten_urls_duration_seconds histogram\n'
+            'shorten_urls_duration_seconds_bucket{view="ShortUrlView",component="cache",le="0.1"} 1\n'
+            'shorten_urls_duration_seconds_bucket{view="ShortUrlView",component="cache",le="+Inf"} 1\n'
+            'shorten_urls_duration_seconds_sum{view="ShortUrlView",component="cache"} 0.05\n'
+            'shorten_urls_duration_seconds_count{view="ShortUrlView",component="cache"} 1\n'
+            'shorten_urls_duration_seconds_bucket{view="ShortUrlView",component="total",le="0.1"} 0\n'
+            'shorten_urls_duration_seconds_bucket{view="ShortUrlView",component="total",le="+Inf"} 1\n'
+            'shorten_urls_duration_seconds_sum{view="ShortUrlView",component="total"} 0.5\n'
+            'shorten_urls_duration_seconds_count{view="ShortUrlView",component="total"} 1\n'
+            '# HELP shorten_urls_db_queries_total DB queries executed per view.\n'
+            '# TYPE shorten_urls_db_queries_total counter\n'
+            'shorten_urls_db_queries_total{view="ShortUrlView"} 2\n'
+        )
+
+
+class RequestTimingsTest(TestCase):
+
+    def test_server_timing(self):
+        timings = RequestTimings()
+        timings.add('db', 0.002)
+        timings.add('cache', 0.001)
+        timings.db_queries = 3
+
+        self.assertEqual(
+            timings.server_timing(0.01),
+            'cache;dur=1.000, db;dur=2.000;desc="3 queries", total;dur=10.000'
+        )
+
+
+class TimedTest(TestCase):
+
+    def setUp(self):
+        registry.clear()
+        self.addCleanup(registry.clear)
+
+    def test_inside_request(self):
+        timings, token = start_request_timings()
+        try:
+            with timed(COMPONENT_CACHE):
+                pass
+        finally:
+            end_request_timings(token)
+
+        self.assertIn(COMPONENT_CACHE, timings.durations)
+        self.assertNotIn(BACKGROUND_VIEW, registry.render_prometheus())
+
+    def test_outside_request(self):
+        with timed(COMPONENT_CACHE):
+            pass
+
+        self.assertIn(
+            'view="{}",component="cache"'.format(BACKGROUND_VIEW),
+            registry.render_prometheus()
+        )
+
+    def test_timed_cache(self):
+        mock_cache = mock.Mock()
+        mock_cache.get.return_value = 'value'
+        mock_cache.default_timeout = 300
+
+        timed_cache = TimedCache(mock_cache)
+
+        timings, token = start_request_timings()
+        try:
+            self.assertEqual(timed_cache.get('key'), 'value')
+        finally:
+            end_request_timings(token)
+
+        mock_cache.get.assert_called_once_with('key')
+        self.assertEqual(timed_cache.default_timeout, 300)
+        self.assertIn(COMPONENT_CACHE, timings.durations)
+
+
+class RequestMetricsMiddlewareTest(TestCase):
+
+    def setUp(self):
+        registry.clear()
+        self.addCleanup(registry.clear)
+
+        self.short_url_object = ShortUrl.objects.create(
+            original_url='https://www.fake.com'
+        )
+
+    @override_settings(ENABLE_SERVER_TIMING=True)
+    def test_tracked_view(self):
+        r = self.client.get('/{}'.format(self.short_url_object.short_url_path))
+
+        self.assertEqual(r.status_code, httplib.FOUND)
+        self.assertRegex(
+            r['Server-Timing'],
+            r'^db;dur=[0-9.]+;desc="1 queries", total;dur=[0-9.]+$'
+        )
+
+        r = self.client.get('/metrics')
+
+        self.assertEqual(r.status_code, httplib.OK)
+        self.assertIn(
+            'shorten_urls_db_queries_total{view="ShortUrlRedirectView"} 1',
+            r.content.decode('utf-8')
+        )
+
+    def test_untracked_view(self):
+        r = self.client.get('/')
+
+        self.assertFalse(r.has_header('Server-Timing'))
+
+    def test_server_timing_disabled(self):
+        r = self.client.get('/{}'.format(self.short_url_object.short_url_path))
+
+        self.assertEqual(r.status_code, httplib.FOUND)
+        self.assertFalse(r.has_header('Server-Timing'))
+
+    def test_metrics_not_allowed(self):
+        r = self.client.get('/metrics', REMOTE_ADDR='203.0.113.1')
+
+        self.assertEqual(r.status_code, httplib.NOT_FOUND)
@@ -4,7 +4,8 @@ from unittest import mock
 from django.test import TestCase
 from django.utils import timezone
 
-from ..models import ShortUrl, UrlPreviewData, get_hashed_url_from_original_url
+from ..models import (IdBlockCounter, ShortUrl, UrlPreviewData,
+                      get_hashed_url_from_original_url)
 from ..utils import b62_encode
 
 
@@ -55,6 +56,65 @@ class BaseShortUrlModelTest(TestCase):
         expect_short_url_path = b62_encode(int(1E8) + 3 * int(1E8) + short_url.id)
         self.assertEqual(short_url.short_url_path, expect_short_url_path)
 
+        short_url.refresh_from_db()
+        self.assertEqual(short_url.short_url_path, expect_short_url_path)
+
+    def test_create_costs_one_query(self):
+        ShortUrl.objects.id_allocator.reset()
+        ShortUrl.objects.allocate_ids()
+
+        with self.assertNumQueries(1):
+            short_url = ShortUrl.objects.create(original_url='https://www.google.com')
+
+        self.assertEqual(short_url.short_url_path, short_url.compute_short_url_path())
+
+    def test_assign_short_url_paths(self):
+        objs = [
+            ShortUrl(original_url='https://www.fake.com/{}'.format(index),
+                     hashed_url=index, random_offset=index)
+            for index in range(3)
+        ]
+
+        ShortUrl.objects.assign_short_url_paths(objs)
+        ShortUrl.objects.bulk_create(objs)
+
+        self.assertEqual(len({obj.id for obj in objs}), 3)
+        for obj in ShortUrl.objects.order_by('id'):
+            self.assertEqual(obj.short_url_path, obj.compute_short_url_path())
+
+
+class IdBlockCounterModelTest(TestCase):
+
+    def test_reserve_block_starts_from_initial_id(self):
+        start = IdBlockCounter.objects.reserve_block('fake', 10, lambda: 5)
+
+        self.assertEqual(start, 5)
+        self.assertEqual(IdBlockCounter.objects.get(name='fake').next_id, 15)
+
+    def test_reserve_block_continues_from_counter(self):
+        IdBlockCounter.objects.create(name='fake', next_id=100)
+
+        first = IdBlockCounter.objects.reserve_block('fake', 10, lambda: 1)
+        second = IdBlockCounter.objects.reserve_block('fake', 10, lambda: 1)
+
+        self.assertEqual(first, 100)
+        self.assertEqual(second, 110)
+
+    def test_reserve_block_skips_ids_in_use(self):
+        IdBlockCounter.objects.create(name='fake', next_id=100)
+
+        start = IdBlockCounter.objects.reserve_block('fake', 10, lambda: 200)
+
+        self.assertEqual(start, 200)
+        self.assertEqual(IdBlockCounter.objects.get(name='fake').next_id, 210)
+
+    def test_short_url_counter_starts_after_existing_rows(self):
+        short_url = ShortUrl.objects.create(original_url='https://www.google.com')
+        ShortUrl.objects.id_allocator.reset()
+
+        self.assertGreater(ShortUrl.objects.allocate_ids()[0], short_url.id)
+        self.assertGreater(ShortUrl.objects.get_max_id(), short_url.id)
+
 
 class GetHashedUrlFromOriginalUrlTtest(TestCase):
 
@@ -64,12 +124,21 @@ class GetHashedUrlFromOriginalUrlTtest(TestCase):
         default_hash_algo = hashlib.sha256()
         default_hash_algo.update(original_url.encode('utf-8'))
 
-        expected_hashed_url = default_hash_algo.hexdigest()
+        expected_hashed_url = int.from_bytes(
+            default_hash_algo.digest()[:8], 'big', signed=True)
         self.assertEqual(
             get_hashed_url_from_original_url(original_url),
-            expected_hashed_url[:32]
+            expected_hashed_url
         )
 
+    def test_fits_in_signed_64_bits(self):
+        for index in range(100):
+            hashed_url = get_hashed_url_from_original_url(
+                'http://www.fake.com/{}'.format(index))
+
+            self.assertGreaterEqual(hashed_url, -2 ** 63)
+            self.assertLess(hashed_url, 2 ** 63)
+
 
 class ShortUrlModelTest(TestCase):
 
@@ -85,10 +154,12 @@ class ShortUrlModelTest(TestCase):
             original_url=original_url
         )
 
-        self.hash_algo.update(original_url.encode('utf-8'))
-        expected_url = self.hash_algo.hexdigest()[:32]
+        # the hash is taken of the canonical form
+        self.hash_algo.update(b'https://www.google.com/')
+        expected_url = int.from_bytes(self.hash_algo.digest()[:8], 'big', signed=True)
 
         self.assertEqual(short_url.original_url, original_url)
+        self.assertEqual(short_url.canonical_url, 'https://www.google.com/')
         self.assertEqual(short_url.hashed_url, expected_url)
         self.assertEqual(short_url.random_offset, 1)
 
@@ -96,11 +167,11 @@ class ShortUrlModelTest(TestCase):
         original_url = 'https://www.google.com'
         short_url = ShortUrl.objects.create(
             original_url=original_url,
-            hashed_url='abcdefg'
+            hashed_url=-12345
         )
 
         self.assertEqual(short_url.original_url, original_url)
-        self.assertEqual(short_url.hashed_url, 'abcdefg')
+        self.assertEqual(short_url.hashed_url, -12345)
 
 
 class UrlPreviewDataModelTest(TestCase):
@@ -0,0 +1,98 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from ..logics import get_short_url_object_for_read
+from ..models import ShortUrl
+from ..replicas import (SELECTION_LEAST_LOADED, SELECTION_ROUND_ROBIN,
+                        ReplicaSelector, get_replica_aliases)
+from ..sharding import ShortUrlShardRouter
+
+REPLICAS = {'default': ['replica_1', 'replica_2']}
+
+
+@override_settings(SHORT_URL_READ_REPLICAS=REPLICAS)
+class ReplicaSelectorTest(TestCase):
+
+    def test_get_replica_aliases(self):
+        self.assertEqual(get_replica_aliases('default'), ['replica_1', 'replica_2'])
+        self.assertEqual(get_replica_aliases('shard_1'), [])
+        self.assertEqual(get_replica_aliases(), ['replica_1', 'replica_2'])
+
+    def test_unknown_selection(self):
+        with self.assertRaises(ValueError):
+            ReplicaSelector('random')
+
+    def test_no_replicas_selects_primary(self):
+        replica_selector = ReplicaSelector(SELECTION_ROUND_ROBIN)
+
+        self.assertEqual(replica_selector.select('shard_1'), 'shard_1')
+
+    def test_round_robin(self):
+        replica_selector = ReplicaSelector(SELECTION_ROUND_ROBIN)
+
+        self.assertEqual(
+            [replica_selector.select('default') for _ in range(4)],
+            ['replica_1', 'replica_2', 'replica_1', 'replica_2'])
+
+    def test_least_loaded(self):
+        replica_selector = ReplicaSelector(SELECTION_LEAST_LOADED)
+
+        with replica_selector.reading('replica_1'):
+            self.assertEqual(replica_selector.in_flight('replica_1'), 1)
+            self.assertEqual(replica_selector.select('default'), 'replica_2')
+
+        self.assertEqual(replica_selector.in_flight('replica_1'), 0)
+        self.assertEqual(replica_selector.select('default'), 'replica_1')
+
+    def test_replicas_are_not_migrated(self):
+        router = ShortUrlShardRouter()
+
+        self.assertFalse(router.allow_migrate('replica_1', 'shorten_urls'))
+        self.assertFalse(router.allow_migrate('replica_1', 'auth'))
+
+
+@override_settings(SHORT_URL_SHARDS=['default'],
+                   SHORT_URL_READ_REPLICAS={'default': ['replica_1']})
+class GetShortUrlObjectForReadTest(TestCase):
+
+    def setUp(self):
+        self.short_url_object = ShortUrl.objects.create(original_url='https://www.fake.com')
+        self.queried_dbs = []
+
+    def fake_using(self, lagging_dbs):
+        def using(db):
+            self.queried_dbs.append(db)
+            if db in lagging_dbs:
+                return ShortUrl.objects.none()
+
+            return ShortUrl.objects.get_queryset()
+
+        return using
+
+    def test_read_from_replica(self):
+        with mock.patch.object(
+                ShortUrl.objects, 'using', side_effect=self.fake_using([])):
+            result = get_short_url_object_for_read(self.short_url_object.short_url_path)
+
+        self.assertEqual(result, self.short_url_object)
+        self.assertEqual(self.queried_dbs, ['replica_1'])
+
+    def test_fresh_code_falls_back_to_primary(self):
+        with mock.patch.object(
+                ShortUrl.objects, 'using', side_effect=self.fake_using(['replica_1'])):
+            result = get_short_url_object_for_read(self.short_url_object.short_url_path)
+
+        self.assertEqual(result, self.short_url_object)
+        self.assertEqual(self.queried_dbs, ['replica_1', 'default'])
+
+    def test_not_found(self):
+        short_url_path = ShortUrl(
+            id=self.short_url_object.id + 1, random_offset=0).compute_short_url_path()
+
+        with mock.patch.object(
+                ShortUrl.objects, 'using', side_effect=self.fake_using([])):
+            result = get_short_url_object_for_read(short_url_path)
+
+        self.assertIsNone(result)
+        self.assertEqual(self.queried_dbs, ['replica_1', 'default'])
@@ -0,0 +1,207 @@
+import http.client as httplib
+from importlib import import_module
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+from django.apps import apps
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from ..clicks import ClickBuffer
+from ..fingerprints import fingerprint_urls
+from ..logics import (ShortUrlBulkLogics, ShortUrlLogics, UrlPreviewCrawlQueue,
+                      UrlPreviewDataLogic, decode_short_url,
+                      get_shard_for_short_url)
+from ..models import ClickStats, ShortUrl, UrlPreviewData
+from ..sharding import (ShortUrlShardRouter, get_shard_for_hashed_url,
+                        get_shard_for_id, to_global_id, to_local_id)
+
+SHARDS = ['default', 'shard_1', 'shard_2']
+
+
+@override_settings(SHORT_URL_SHARDS=SHARDS)
+class ShardingTest(SimpleTestCase):
+
+    def test_get_shard_for_id(self):
+        self.assertEqual(get_shard_for_id(30), 'default')
+        self.assertEqual(get_shard_for_id(31), 'shard_1')
+        self.assertEqual(get_shard_for_id(32), 'shard_2')
+
+    def test_global_id_round_trip(self):
+        for alias in SHARDS:
+            id = to_global_id(10, alias)
+
+            self.assertEqual(get_shard_for_id(id), alias)
+            self.assertEqual(to_local_id(id), 10)
+
+    def test_get_shard_for_hashed_url(self):
+        self.assertEqual(get_shard_for_hashed_url(3), 'default')
+        self.assertEqual(get_shard_for_hashed_url(4), 'shard_1')
+        self.assertEqual(get_shard_for_hashed_url(-1), 'shard_2')
+
+    @override_settings(SHORT_URL_SHARDS=['default'])
+    def test_single_shard(self):
+        self.assertEqual(get_shard_for_id(31), 'default')
+        self.assertEqual(get_shard_for_hashed_url(4), 'default')
+        self.assertEqual(to_global_id(10, 'default'), 10)
+
+
+@override_settings(SHORT_URL_SHARDS=SHARDS)
+class ShortUrlShardRouterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.router = ShortUrlShardRouter()
+
+    def test_db_for_write_new_short_url(self):
+        short_url_object = ShortUrl(original_url='https://www.fake.com', hashed_url=4)
+
+        self.assertEqual(
+            self.router.db_for_write(ShortUrl, instance=short_url_object), 'shard_1')
+
+    def test_db_for_write_follows_short_url(self):
+        short_url_object = ShortUrl(original_url='https://www.fake.com')
+        short_url_object._state.db = 'shard_2'
+        preview_data = UrlPreviewData(from_url=short_url_object)
+
+        self.assertEqual(
+            self.router.db_for_write(UrlPreviewData, instance=preview_data), 'shard_2')
+
+    def test_db_for_read_without_instance(self):
+        self.assertIsNone(self.router.db_for_read(ShortUrl))
+
+    def test_allow_migrate(self):
+        self.assertTrue(self.router.allow_migrate('shard_1', 'shorten_urls'))
+        self.assertFalse(self.router.allow_migrate('shard_1', 'auth'))
+        self.assertFalse(self.router.allow_migrate('replica', 'shorten_urls'))
+        self.assertIsNone(self.router.allow_migrate('default', 'auth'))
+
+
+@skipUnless(
+    len(settings.SHORT_URL_SHARDS) > 1,
+    'needs several shards, run with --settings=mysite.settings_sharded')
+@override_settings(RATELIMIT_ENABLE=False, ENABLE_CACHE=False)
+class ShardedShortUrlTest(TestCase):
+
+    databases = '__all__'
+
+    def get_shard_counts(self):
+        return {
+            alias: ShortUrl.objects.using(alias).count()
+            for alias in settings.SHORT_URL_SHARDS
+        }
+
+    def test_get_or_create_short_url(self):
+        urls = ['https://www.fake.com/{}'.format(index) for index in range(30)]
+
+        for url in urls:
+            short_url_object = ShortUrlLogics(url).get_or_create_short_url()
+            shard = get_shard_for_short_url(short_url_object.short_url_path)
+
+            self.assertEqual(short_url_object._state.db, shard)
+            self.assertEqual(get_shard_for_id(short_url_object.id), shard)
+
+        # the same url is found again on its own shard
+        with self.assertNumQueries(1, using=shard):
+            self.assertEqual(
+                ShortUrlLogics(url).get_or_create_short_url(), short_url_object)
+
+        shard_counts = self.get_shard_counts()
+        self.assertEqual(sum(shard_counts.values()), len(urls))
+        self.assertTrue(all(shard_counts.values()))
+
+    def test_fill_canonical_urls_keeps_rows_on_their_shard(self):
+        migration = import_module('shorten_urls.migrations.0010_shorturl_canonical_url')
+        urls = ['https://WWW.FAKE.COM/{}'.format(index) for index in range(30)]
+        # as before the migration: placed by the hash of the original url,
+        # without a canonical url
+        with mock.patch('shorten_urls.logics.canonicalize_url', lambda url: url):
+            short_url_objects = [ShortUrlLogics(url).get_or_create_short_url() for url in urls]
+        for short_url_object in short_url_objects:
+            ShortUrl.objects.using(short_url_object._state.db).filter(
+                id=short_url_object.id).update(canonical_url=None)
+
+        for shard in SHARDS:
+            migration.fill_canonical_urls(
+                apps, SimpleNamespace(connection=SimpleNamespace(alias=shard)))
+
+        rehashed = 0
+        for shard in SHARDS:
+            for short_url_object in ShortUrl.objects.using(shard):
+                self.assertEqual(short_url_object.canonical_url, 'https://www.fake.com/{}'.format(
+                    short_url_object.original_url.rsplit('/', 1)[1]))
+                self.assertEqual(get_shard_for_hashed_url(short_url_object.hashed_url), shard)
+                rehashed += short_url_object.hashed_url == fingerprint_urls(
+                    [short_url_object.canonical_url])[0]
+
+        self.assertTrue(0 < rehashed < len(urls))
+
+    def test_bulk_create(self):
+        urls = ['https://www.fake.com/{}'.format(index) for index in range(30)]
+
+        infos = ShortUrlBulkLogics(urls).get_short_url_infos()
+
+        self.assertEqual(sum(self.get_shard_counts().values()), len(urls))
+        for info in infos:
+            shard = get_shard_for_short_url(info['short_url_path'])
+            short_url_object = ShortUrl.objects.using(shard).get(
+                id=decode_short_url(info['short_url_path']))
+            self.assertEqual(short_url_object.original_url, info['original_url'])
+
+    def test_redirect_and_get_original_url(self):
+        short_url_objects = [
+            ShortUrlLogics('https://www.fake.com/{}'.format(index)).get_or_create_short_url()
+            for index in range(10)
+        ]
+
+        for short_url_object in short_url_objects:
+            short_url_path = short_url_object.short_url_path
+
+            r = self.client.get('/{}'.format(short_url_path))
+            self.assertRedirects(
+                r, short_url_object.original_url, fetch_redirect_response=False)
+
+            r = self.client.get('/api/v1/short_urls/original_url', {'short_url': short_url_path})
+            self.assertEqual(r.status_code, httplib.OK)
+
+    def test_preview_data_follows_short_url(self):
+        short_url_object = ShortUrlLogics('https://www.fake.com').get_or_create_short_url()
+        logic = UrlPreviewDataLogic(
+            short_url_object.original_url, short_url_object=short_url_object)
+
+        logic.save_url_preview_data({
+            'title': 'title', 'description': 'description',
+            'url': 'https://www.fake.com', 'image': 'https://www.fake.com/a.png',
+        })
+
+        self.assertEqual(
+            short_url_object.preview_data._state.db, short_url_object._state.db)
+
+    def test_crawl_queue_claims_from_every_shard(self):
+        short_url_objects = [
+            ShortUrlLogics('https://www.fake.com/{}'.format(index)).get_or_create_short_url()
+            for index in range(30)
+        ]
+        queue = UrlPreviewCrawlQueue()
+        for short_url_object in short_url_objects:
+            queue.enqueue(short_url_object)
+
+        tasks = queue.claim(batch_size=len(short_url_objects))
+
+        self.assertEqual(len(tasks), len(short_url_objects))
+        for task in tasks:
+            self.assertEqual(task._state.db, task.from_url._state.db)
+
+    def test_clicks_follow_short_url(self):
+        short_url_objects = [
+            ShortUrlLogics('https://www.fake.com/{}'.format(index)).get_or_create_short_url()
+            for index in range(10)
+        ]
+        buffer = ClickBuffer(flush_interval=None)
+        for short_url_object in short_url_objects:
+            buffer.record(short_url_object.short_url_path)
+
+        self.assertEqual(buffer.flush(), len(short_url_objects))
+        for short_url_object in short_url_objects:
+            self.assertTrue(
+                ClickStats.objects.using(short_url_object._state.db).filter(
+                    short_url_path=short_url_object.short_url_path).exists())
@@ -0,0 +1,279 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase, override_settings
+
+from ..async_utils import AsyncCache
+from ..single_flight import (AsyncSingleFlight, CacheEntry, SingleFlight,
+                             async_get_or_refresh, get_cache_timeout,
+                             get_or_refresh, make_cache_entry, needs_refresh)
+from .test_async_utils import LOCMEM_CACHES
+
+
+class NeedsRefreshTest(SimpleTestCase):
+
+    def test_fresh(self):
+        self.assertFalse(needs_refresh(CacheEntry('value', 100, 0), now=99))
+
+    def test_due(self):
+        self.assertTrue(needs_refresh(CacheEntry('value', 100, 0), now=100))
+
+    @mock.patch('shorten_urls.single_flight.random.random', return_value=0.99)
+    def test_early_refresh(self, mock_random):
+        # -log(0.01) is about 4.6 times the time the value took to compute
+        self.assertTrue(needs_refresh(CacheEntry('value', 100, 1), now=96))
+        self.assertFalse(needs_refresh(CacheEntry('value', 100, 1), now=95))
+        self.assertFalse(needs_refresh(CacheEntry('value', 100, 1), now=96, beta=0))
+
+    def test_make_cache_entry(self):
+        entry = make_cache_entry('value', 100, delta=0.5)
+
+        self.assertEqual(entry.value, 'value')
+        self.assertEqual(entry.delta, 0.5)
+        self.assertTrue(time.time() + 80 < entry.refresh_at <= time.time() + 100)
+        self.assertGreater(get_cache_timeout(100), 100)
+
+
+class SingleFlightTest(SimpleTestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return 'value'
+
+    def start_leader(self):
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(self.single_flight.do('key', self.compute)))
+        thread.start()
+        self.started.wait(5)
+
+        return thread, results
+
+    def test_followers_share_result(self):
+        thread, results = self.start_leader()
+        followers = [
+            threading.Thread(
+                target=lambda: results.append(self.single_flight.do('key', self.compute)))
+            for _ in range(3)
+        ]
+        for follower in followers:
+            follower.start()
+
+        self.release.set()
+        for t in [thread] + followers:
+            t.join(5)
+
+        self.assertEqual(results, ['value'] * 4)
+        self.assertEqual(self.calls, 1)
+
+    def test_follower_with_stale_value(self):
+        thread, results = self.start_leader()
+
+        self.assertEqual(self.single_flight.do('key', self.compute, stale='stale'), 'stale')
+
+        self.release.set()
+        thread.join(5)
+        self.assertEqual(results, ['value'])
+
+    def test_error(self):
+        def fail():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            self.single_flight.do('key', fail)
+
+        self.release.set()
+        self.assertEqual(self.single_flight.do('key', self.compute), 'value')
+
+
+class AsyncSingleFlightTest(SimpleTestCase):
+
+    def test_followers_share_result(self):
+        single_flight = AsyncSingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'value'
+
+        async def run():
+            return await asyncio.gather(
+                single_flight.do('key', compute),
+                single_flight.do('key', compute),
+                single_flight.do('key', compute, stale='stale'),
+            )
+
+        self.assertEqual(async_to_sync(run)(), ['value', 'value', 'stale'])
+        self.assertEqual(len(calls), 1)
+
+    def test_leader_cancelled(self):
+        single_flight = AsyncSingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01 if len(calls) > 1 else 5)
+            return 'value'
+
+        async def run():
+            leader = asyncio.ensure_future(single_flight.do('key', compute))
+            await asyncio.sleep(0)
+            followers = asyncio.gather(
+                single_flight.do('key', compute), single_flight.do('key', compute))
+            await asyncio.sleep(0)
+
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+
+            return await followers
+
+        # the followers run it again once instead of being cancelled
+        self.assertEqual(async_to_sync(run)(), ['value', 'value'])
+        self.assertEqual(len(calls), 2)
+
+
+class GetOrRefreshTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = LocMemCache('single_flight_test', {})
+        self.addCleanup(self.cache.clear)
+        self.compute = mock.Mock(return_value=('value', 100))
+
+    def test_miss(self):
+        self.assertEqual(get_or_refresh(self.cache, 'key', self.compute), 'value')
+        self.assertEqual(get_or_refresh(self.cache, 'key', self.compute), 'value')
+
+        self.compute.assert_called_once_with()
+        self.assertEqual(self.cache.get('key').value, 'value')
+        self.assertIsNone(self.cache.get('LOCK:key'))
+
+    def test_not_cached(self):
+        self.compute.return_value = (None, 100)
+
+        self.assertIsNone(get_or_refresh(self.cache, 'key', self.compute))
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_plain_value(self):
+        self.cache.set('key', 'plain')
+
+        self.assertEqual(get_or_refresh(self.cache, 'key', self.compute), 'plain')
+        self.compute.assert_not_called()
+
+    def test_due(self):
+        self.cache.set('key', CacheEntry('stale', time.time() - 1, 0))
+
+        self.assertEqual(get_or_refresh(self.cache, 'key', self.compute), 'value')
+        self.assertEqual(self.cache.get('key').value, 'value')
+
+    def test_due_while_locked(self):
+        self.cache.set('key', CacheEntry('stale', time.time() - 1, 0))
+        self.cache.add('LOCK:key', 1)
+
+        self.assertEqual(get_or_refresh(self.cache, 'key', self.compute), 'stale')
+        self.compute.assert_not_called()
+
+    def test_miss_while_locked(self):
+        self.cache.add('LOCK:key', 1)
+        timer = threading.Timer(
+            0.05, self.cache.set, args=('key', make_cache_entry('other', 100)))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        self.assertEqual(get_or_refresh(self.cache, 'key', self.compute), 'other')
+        self.compute.assert_not_called()
+
+    @mock.patch('shorten_urls.single_flight.CACHE_LOCK_WAIT_TIMEOUT', 0.05)
+    def test_miss_while_locked_timeout(self):
+        self.cache.add('LOCK:key', 1)
+
+        self.assertEqual(get_or_refresh(self.cache, 'key', self.compute), 'value')
+        self.compute.assert_called_once_with()
+
+    def test_miss_while_locked_not_cached(self):
+        # e.g. a pending preview, the holder releases the lock without a value
+        self.compute.return_value = ('pending', None)
+        self.cache.add('LOCK:key', 1)
+        timer = threading.Timer(0.05, self.cache.delete, args=('LOCK:key',))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        start = time.monotonic()
+        self.assertEqual(get_or_refresh(self.cache, 'key', self.compute), 'pending')
+
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.compute.assert_called_once_with()
+        self.assertIsNone(self.cache.get('LOCK:key'))
+
+    def test_compute_error_releases_lock(self):
+        self.compute.side_effect = ValueError
+
+        with self.assertRaises(ValueError):
+            get_or_refresh(self.cache, 'key', self.compute)
+
+        self.assertIsNone(self.cache.get('LOCK:key'))
+
+    def test_expired_lock_taken_over_is_kept(self):
+        def compute():
+            # the lock expired while computing and another process took it
+            self.cache.set('LOCK:key', 'other')
+            return 'value', 100
+
+        self.assertEqual(get_or_refresh(self.cache, 'key', compute), 'value')
+        self.assertEqual(self.cache.get('LOCK:key'), 'other')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AsyncGetOrRefreshTest(SimpleTestCase):
+
+    def setUp(self):
+        self.async_cache = AsyncCache()
+        self.addCleanup(caches['default'].clear)
+        self.compute = mock.AsyncMock(return_value=('value', 100))
+
+    def test_miss(self):
+        get = async_to_sync(async_get_or_refresh)
+
+        self.assertEqual(get(self.async_cache, 'key', self.compute), 'value')
+        self.assertEqual(get(self.async_cache, 'key', self.compute), 'value')
+
+        self.compute.assert_awaited_once_with()
+        self.assertIsNone(caches['default'].get('LOCK:key'))
+
+    def test_due_while_locked(self):
+        caches['default'].set('key', CacheEntry('stale', time.time() - 1, 0))
+        caches['default'].add('LOCK:key', 1)
+
+        self.assertEqual(
+            async_to_sync(async_get_or_refresh)(self.async_cache, 'key', self.compute),
+            'stale')
+        self.compute.assert_not_awaited()
+
+    def test_miss_while_locked_not_cached(self):
+        self.compute.return_value = ('pending', None)
+        caches['default'].add('LOCK:key', 1)
+        timer = threading.Timer(0.05, caches['default'].delete, args=('LOCK:key',))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        start = time.monotonic()
+        self.assertEqual(
+            async_to_sync(async_get_or_refresh)(self.async_cache, 'key', self.compute),
+            'pending')
+
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.compute.assert_awaited_once_with()
@@ -0,0 +1,376 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ..configs import REDIRECT_NOT_FOUND_CACHE_VALUE
+from ..models import ShortUrl
+from ..snapshot import (RedirectSnapshotReader, RedirectSnapshotSegment,
+                        _lock_manifest, _write_segment,
+                        append_redirect_snapshot, build_redirect_snapshot,
+                        compact_redirect_snapshot, read_manifest)
+from ..utils import b62_encode
+
+
+class SnapshotTestMixin:
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'redirects.snapshot')
+
+    def get_segments(self):
+        return [
+            RedirectSnapshotSegment(os.path.join(os.path.dirname(self.path), name))
+            for name in read_manifest(self.path)['segments']
+        ]
+
+
+class RedirectSnapshotSegmentTest(SnapshotTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.short_url_objects = [
+            ShortUrl.objects.create('https://www.fake.com/{}/é'.format(index))
+            for index in range(5)
+        ]
+
+    def test_build(self):
+        self.assertEqual(build_redirect_snapshot(self.path, chunk_size=2), 5)
+
+        segment, = self.get_segments()
+        self.assertEqual(len(segment), 5)
+        self.assertEqual(segment.max_id, self.short_url_objects[-1].id)
+        for short_url_object in self.short_url_objects:
+            self.assertEqual(
+                segment.get(short_url_object.id, short_url_object.random_offset),
+                short_url_object.original_url)
+
+    def test_iter(self):
+        build_redirect_snapshot(self.path)
+
+        segment, = self.get_segments()
+        self.assertEqual(list(segment), [
+            (obj.id, obj.random_offset, obj.original_url.encode('utf-8'))
+            for obj in self.short_url_objects
+        ])
+
+    def test_get_other_random_offset(self):
+        build_redirect_snapshot(self.path)
+        short_url_object = self.short_url_objects[0]
+
+        segment, = self.get_segments()
+        self.assertEqual(
+            segment.get(short_url_object.id, (short_url_object.random_offset + 1) % 7),
+            REDIRECT_NOT_FOUND_CACHE_VALUE)
+
+    def test_get_missing_id(self):
+        build_redirect_snapshot(self.path)
+
+        segment, = self.get_segments()
+        self.assertIsNone(segment.get(self.short_url_objects[-1].id + 1, 0))
+
+    def test_empty(self):
+        ShortUrl.objects.all().delete()
+
+        self.assertEqual(build_redirect_snapshot(self.path), 0)
+        segment, = self.get_segments()
+        self.assertIsNone(segment.get(1, 0))
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+
+        with self.assertRaises(ValueError):
+            RedirectSnapshotSegment(self.path)
+
+
+class RedirectSnapshotDeltaTest(SnapshotTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.short_url_object = ShortUrl.objects.create('https://www.fake.com')
+
+    def test_rebuild_removes_old_segments(self):
+        build_redirect_snapshot(self.path)
+        old_segments = read_manifest(self.path)['segments']
+
+        build_redirect_snapshot(self.path)
+
+        self.assertEqual(len(read_manifest(self.path)['segments']), 1)
+        self.assertFalse(os.path.exists(
+            os.path.join(os.path.dirname(self.path), old_segments[0])))
+
+    def test_append_without_snapshot_builds_it(self):
+        self.assertEqual(append_redirect_snapshot(self.path), 1)
+        self.assertEqual(len(self.get_segments()), 1)
+
+    def test_append_new_rows(self):
+        build_redirect_snapshot(self.path)
+        new_short_url_object = ShortUrl.objects.create('https://www.fake.com/new')
+
+        self.assertEqual(append_redirect_snapshot(self.path), 1)
+
+        old_segment, new_segment = self.get_segments()
+        self.assertEqual(len(new_segment), 1)
+        self.assertEqual(
+            new_segment.get(new_short_url_object.id, new_short_url_object.random_offset),
+            'https://www.fake.com/new')
+
+    def test_append_lower_id(self):
+        ShortUrl.objects.create('https://www.fake.com/new', id=self.short_url_object.id + 100)
+        build_redirect_snapshot(self.path)
+        # e.g. written by a worker still taking ids from an older block
+        lower_short_url_object = ShortUrl.objects.create(
+            'https://www.fake.com/lower', id=self.short_url_object.id + 10)
+
+        self.assertEqual(append_redirect_snapshot(self.path), 1)
+        self.assertEqual(
+            self.get_segments()[-1].get(
+                lower_short_url_object.id, lower_short_url_object.random_offset),
+            'https://www.fake.com/lower')
+
+    def test_append_skips_exported_rows(self):
+        build_redirect_snapshot(self.path)
+
+        self.assertEqual(append_redirect_snapshot(self.path), 0)
+        self.assertEqual(len(read_manifest(self.path)['segments']), 1)
+
+    def test_append_reads_overlap_again(self):
+        build_redirect_snapshot(self.path)
+        late_short_url_object = ShortUrl.objects.create(
+            'https://www.fake.com/late', created_at=timezone.now() - timedelta(seconds=30))
+
+        self.assertEqual(append_redirect_snapshot(self.path, overlap=0), 0)
+        self.assertEqual(append_redirect_snapshot(self.path, overlap=60), 1)
+        self.assertEqual(append_redirect_snapshot(self.path, overlap=60), 0)
+        self.assertEqual(
+            self.get_segments()[-1].get(
+                late_short_url_object.id, late_short_url_object.random_offset),
+            'https://www.fake.com/late')
+
+    def test_compact(self):
+        build_redirect_snapshot(self.path)
+        for index in range(3):
+            ShortUrl.objects.create('https://www.fake.com/{}'.format(index))
+            append_redirect_snapshot(self.path)
+        exported_until = read_manifest(self.path)['exported_until']
+
+        self.assertEqual(compact_redirect_snapshot(self.path), 4)
+
+        manifest = read_manifest(self.path)
+        self.assertEqual(manifest['exported_until'], exported_until)
+        segment, = self.get_segments()
+        self.assertEqual(
+            [row[0] for row in segment],
+            list(ShortUrl.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(
+            sorted(os.listdir(os.path.dirname(self.path))),
+            sorted(['redirects.snapshot', 'redirects.snapshot.lock'] + manifest['segments']))
+
+    def test_compact_single_segment(self):
+        build_redirect_snapshot(self.path)
+
+        self.assertEqual(compact_redirect_snapshot(self.path), 0)
+
+
+class RedirectSnapshotWritersTest(SnapshotTestMixin, TestCase):
+    # another writer runs while the first one writes its segment, outside
+    # the manifest lock
+
+    def setUp(self):
+        super().setUp()
+
+        ShortUrl.objects.create('https://www.fake.com/0')
+        build_redirect_snapshot(self.path)
+        ShortUrl.objects.create('https://www.fake.com/1')
+        append_redirect_snapshot(self.path)
+
+    def interleave(self, writer):
+        def write_segment(*args, **kwargs):
+            patcher.stop()
+            writer()
+            return _write_segment(*args, **kwargs)
+
+        patcher = mock.patch('shorten_urls.snapshot._write_segment', write_segment)
+        patcher.start()
+        self.addCleanup(mock.patch.stopall)
+
+    def assertSegmentsExist(self):
+        for name in read_manifest(self.path)['segments']:
+            self.assertTrue(os.path.exists(os.path.join(os.path.dirname(self.path), name)))
+
+    def test_append_during_compaction(self):
+        new_short_url_object = ShortUrl.objects.create('https://www.fake.com/2')
+        self.interleave(lambda: append_redirect_snapshot(self.path))
+
+        self.assertEqual(compact_redirect_snapshot(self.path), 2)
+
+        compacted, delta = self.get_segments()
+        self.assertEqual(len(compacted), 2)
+        self.assertEqual(
+            delta.get(new_short_url_object.id, new_short_url_object.random_offset),
+            'https://www.fake.com/2')
+        self.assertSegmentsExist()
+
+    def test_build_during_compaction(self):
+        self.interleave(lambda: build_redirect_snapshot(self.path))
+
+        self.assertEqual(compact_redirect_snapshot(self.path), 0)
+
+        segment, = self.get_segments()
+        self.assertEqual(len(segment), 2)
+        self.assertSegmentsExist()
+        # the compacted segment was dropped, not only left out
+        self.assertEqual(len(os.listdir(os.path.dirname(self.path))), 3)
+
+    def test_build_during_append(self):
+        ShortUrl.objects.create('https://www.fake.com/2')
+        self.interleave(lambda: build_redirect_snapshot(self.path))
+        exported_until = timezone.now()
+
+        append_redirect_snapshot(self.path)
+
+        manifest = read_manifest(self.path)
+        self.assertEqual(len(manifest['segments']), 2)
+        self.assertGreater(manifest['exported_until'], exported_until)
+        self.assertSegmentsExist()
+
+    def test_lock_is_held_across_processes(self):
+        script = (
+            'import fcntl, sys\n'
+            'with open(sys.argv[1], "a") as f:\n'
+            '    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)\n'
+        )
+        lock_path = '{}.lock'.format(self.path)
+
+        with _lock_manifest(self.path):
+            locked = subprocess.run([sys.executable, '-c', script, lock_path],
+                                    stderr=subprocess.DEVNULL)
+        unlocked = subprocess.run([sys.executable, '-c', script, lock_path])
+
+        self.assertNotEqual(locked.returncode, 0)
+        self.assertEqual(unlocked.returncode, 0)
+
+
+class RedirectSnapshotReaderTest(SnapshotTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.reader = RedirectSnapshotReader(reload_interval=0)
+        self.short_url_object = ShortUrl.objects.create('https://www.fake.com')
+
+    def test_without_path(self):
+        self.assertIsNone(self.reader.get(self.short_url_object.short_url_path))
+
+    def test_missing_file(self):
+        with override_settings(REDIRECT_SNAPSHOT_PATH=self.path):
+            self.assertIsNone(self.reader.get(self.short_url_object.short_url_path))
+
+    def test_get(self):
+        build_redirect_snapshot(self.path)
+
+        with override_settings(REDIRECT_SNAPSHOT_PATH=self.path):
+            self.assertEqual(
+                self.reader.get(self.short_url_object.short_url_path), 'https://www.fake.com')
+            self.assertIsNone(self.reader.get(b62_encode(int(1E8) + 9999)))
+            self.assertIsNone(self.reader.get('!!!!!'))
+
+    def test_reload_new_segment(self):
+        build_redirect_snapshot(self.path)
+        new_short_url_object = ShortUrl.objects.create('https://www.fake.com/new')
+
+        with override_settings(REDIRECT_SNAPSHOT_PATH=self.path):
+            self.assertIsNone(self.reader.get(new_short_url_object.short_url_path))
+            segment = self.reader.segments[0][1]
+
+            append_redirect_snapshot(self.path)
+
+            self.assertEqual(
+                self.reader.get(new_short_url_object.short_url_path), 'https://www.fake.com/new')
+            self.assertEqual(
+                self.reader.get(self.short_url_object.short_url_path), 'https://www.fake.com')
+            # the unchanged segment is not mapped again
+            self.assertIs(self.reader.segments[1][1], segment)
+
+    def test_reload_compacted(self):
+        build_redirect_snapshot(self.path)
+        new_short_url_object = ShortUrl.objects.create('https://www.fake.com/new')
+        append_redirect_snapshot(self.path)
+
+        with override_settings(REDIRECT_SNAPSHOT_PATH=self.path):
+            self.assertEqual(len(self.reader.segments), 2)
+
+            compact_redirect_snapshot(self.path)
+
+            self.assertEqual(len(self.reader.segments), 1)
+            self.assertEqual(
+                self.reader.get(new_short_url_object.short_url_path), 'https://www.fake.com/new')
+
+    def test_single_file_snapshot(self):
+        # the format before manifests: one segment file at the path
+        build_redirect_snapshot(self.path)
+        shutil.copyfile(self.get_segments()[0].path, self.path)
+        self.assertIsNone(read_manifest(self.path))
+
+        with override_settings(REDIRECT_SNAPSHOT_PATH=self.path):
+            self.assertEqual(
+                self.reader.get(self.short_url_object.short_url_path), 'https://www.fake.com')
+
+            new_short_url_object = ShortUrl.objects.create('https://www.fake.com/new')
+            # writing to the path replaces the file with a manifest
+            self.assertEqual(append_redirect_snapshot(self.path), 2)
+
+            self.assertEqual(len(read_manifest(self.path)['segments']), 1)
+            self.assertEqual(
+                self.reader.get(new_short_url_object.short_url_path), 'https://www.fake.com/new')
+
+    def test_invalid_manifest_keeps_segments(self):
+        build_redirect_snapshot(self.path)
+
+        with override_settings(REDIRECT_SNAPSHOT_PATH=self.path):
+            self.assertEqual(
+                self.reader.get(self.short_url_object.short_url_path), 'https://www.fake.com')
+
+            with open(self.path, 'w') as f:
+                f.write('{"segments": ')
+
+            with self.assertLogs('shorten_urls.snapshot', 'ERROR'):
+                self.assertEqual(
+                    self.reader.get(self.short_url_object.short_url_path), 'https://www.fake.com')
+
+    def test_manifest_removed_while_reloading(self):
+        build_redirect_snapshot(self.path)
+
+        with override_settings(REDIRECT_SNAPSHOT_PATH=self.path):
+            self.assertEqual(len(self.reader.segments), 1)
+
+            ShortUrl.objects.create('https://www.fake.com/new')
+            append_redirect_snapshot(self.path)
+            with mock.patch('shorten_urls.snapshot.read_manifest', return_value=None):
+                self.assertEqual(
+                    self.reader.get(self.short_url_object.short_url_path), 'https://www.fake.com')
+
+            self.assertEqual(len(self.reader.segments), 2)
+
+    def test_reload_interval(self):
+        reader = RedirectSnapshotReader(reload_interval=3600)
+
+        with override_settings(REDIRECT_SNAPSHOT_PATH=self.path):
+            self.assertIsNone(reader.get(self.short_url_object.short_url_path))
+
+            build_redirect_snapshot(self.path)
+
+            self.assertIsNone(reader.get(self.short_url_object.short_url_path))
+            reader.reload()
+            self.assertEqual(
+                reader.get(self.short_url_object.short_url_path), 'https://www.fake.com')
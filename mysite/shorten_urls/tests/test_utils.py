@@ -1,5 +1,5 @@
 import http.client as httplib
-from unittest import mock
+from unittest import mock, skipIf
 
 from bs4 import BeautifulSoup
 from django.test import TestCase
@@ -7,8 +7,12 @@ from requests.exceptions import RequestException
 
 from . import MockResposne
 from ..configs import B62_ALPHABET
-from ..utils import (BaseUrlPreview, OpenGraphPreviewMixin, UrlPreview,
-                     b62_decode, b62_encode)
+from ..utils import (BaseUrlPreview, HostConcurrencyLimiter,
+                     OpenGraphPreviewMixin, PreviewMetaParser,
+                     SinglePassUrlPreview, UrlPreview, UrlPreviewFetcher,
+                     b62_decode, b62_decode_many, b62_encode, b62_encode_many,
+                     canonicalize_url, fetch_previews, get_url_preview_class,
+                     np)
 
 
 class B62EncoddeTest(TestCase):
@@ -62,6 +66,124 @@ class B62DecodeTest(TestCase):
         decode = b62_decode(string)
         self.assertEqual(decode, 123456789)
 
+    def test_round_trip(self):
+        for number in [1, 61, 62, 3843, 3844, 123456789, int(8 * 1E8)]:
+            self.assertEqual(b62_decode(b62_encode(number)), number)
+
+
+class B62EncodeManyTest(TestCase):
+
+    def test_empty(self):
+        self.assertEqual(b62_encode_many([]), [])
+
+    def test_number_is_not_integer(self):
+        with self.assertRaises(ValueError):
+            b62_encode_many([1, '2'])
+
+    def test_number_out_of_range(self):
+        with self.assertRaises(ValueError):
+            b62_encode_many([1, 0])
+
+    def test_success(self):
+        numbers = [1, 62, 123456789, int(8 * 1E8)]
+        self.assertEqual(
+            b62_encode_many(numbers),
+            [b62_encode(number) for number in numbers]
+        )
+
+    @skipIf(np is None, 'numpy is not installed')
+    def test_success_with_numpy_array(self):
+        numbers = np.arange(int(1E8), int(1E8) + 1000)
+        self.assertEqual(
+            b62_encode_many(numbers),
+            [b62_encode(number) for number in numbers.tolist()]
+        )
+
+
+class B62DecodeManyTest(TestCase):
+
+    def test_empty(self):
+        self.assertEqual(b62_decode_many([]), [])
+
+    def test_string_exceed_max_length(self):
+        with self.assertRaises(ValueError):
+            b62_decode_many(['abcde', 'abcdefg'])
+
+    def test_string_contains_invalid_chars(self):
+        with self.assertRaises(KeyError):
+            b62_decode_many(['abcde', 'abcd@'])
+
+    def test_success(self):
+        strings = ['8m0Kx', 'abcde', 'ZZZZZ']
+        self.assertEqual(
+            b62_decode_many(strings),
+            [b62_decode(string) for string in strings]
+        )
+
+    def test_success_with_different_lengths(self):
+        strings = ['1', '10', '8m0Kx']
+        self.assertEqual(b62_decode_many(strings), [1, 62, 123456789])
+
+    @skipIf(np is None, 'numpy is not installed')
+    def test_success_with_numpy_array(self):
+        strings = np.array(['8m0Kx', 'abcde'])
+        result = b62_decode_many(strings)
+
+        self.assertIsInstance(result, np.ndarray)
+        self.assertEqual(result.tolist(), [123456789, b62_decode('abcde')])
+
+
+class CanonicalizeUrlTest(TestCase):
+
+    def test_lowercase_scheme_and_host(self):
+        self.assertEqual(
+            canonicalize_url('HTTP://WWW.Fake.COM/Path'), 'http://www.fake.com/Path')
+
+    def test_empty_path(self):
+        self.assertEqual(canonicalize_url('https://www.fake.com'), 'https://www.fake.com/')
+
+    def test_default_port(self):
+        self.assertEqual(
+            canonicalize_url('https://www.fake.com:443/a'), 'https://www.fake.com/a')
+        self.assertEqual(
+            canonicalize_url('http://www.fake.com:80/a'), 'http://www.fake.com/a')
+        self.assertEqual(
+            canonicalize_url('http://www.fake.com:8080/a'), 'http://www.fake.com:8080/a')
+
+    def test_ipv6_host(self):
+        self.assertEqual(canonicalize_url('http://[::1]:80/a'), 'http://[::1]/a')
+
+    def test_userinfo_kept(self):
+        self.assertEqual(
+            canonicalize_url('https://User:PW@www.fake.com/'), 'https://User:PW@www.fake.com/')
+
+    def test_percent_encoding(self):
+        self.assertEqual(
+            canonicalize_url('https://www.fake.com/%7euser/%2f%e4?q=%41%2b'),
+            'https://www.fake.com/~user/%2F%E4?q=A%2B')
+
+    def test_sort_query(self):
+        self.assertEqual(
+            canonicalize_url('https://www.fake.com/?b=2&a=2&c&a=1'),
+            'https://www.fake.com/?a=2&a=1&b=2&c')
+
+    def test_drop_params(self):
+        self.assertEqual(
+            canonicalize_url(
+                'https://www.fake.com/?utm_source=x&id=1&utm_medium=y&fbclid=z'),
+            'https://www.fake.com/?id=1')
+        self.assertEqual(
+            canonicalize_url('https://www.fake.com/?ref=x&id=1', drop_params=['ref']),
+            'https://www.fake.com/?id=1')
+
+    def test_fragment_kept(self):
+        self.assertEqual(
+            canonicalize_url('https://www.fake.com/#/Page'), 'https://www.fake.com/#/Page')
+
+    def test_invalid_port(self):
+        self.assertEqual(
+            canonicalize_url('https://www.fake.com:port/'), 'https://www.fake.com:port/')
+
 
 class BaseUrlPreviewTest(TestCase):
 
@@ -120,6 +242,70 @@ class BaseUrlPreviewTest(TestCase):
         self.assertTrue(r.success)
 
 
+class BaseUrlPreviewStreamingTest(TestCase):
+
+    url = 'https://www.google.com'
+
+    def setUp(self):
+        self.head = '<html><head><meta property="og:title" content="title"></head>'
+        self.body = '<body>' + 'x' * 1000 + '</body></html>'
+
+    @mock.patch('shorten_urls.utils.requests')
+    def test_fire_without_content_type(self, mock_request):
+        mock_response_val = MockResposne(headers={'Server': 'fake'})
+        mock_request.get.return_value = mock_response_val
+
+        r = BaseUrlPreview(self.url)
+        r.fire()
+
+        self.assertFalse(r.success)
+        self.assertTrue(mock_response_val.closed)
+
+    @mock.patch('shorten_urls.utils.requests')
+    def test_fire_failed_while_reading(self, mock_request):
+        mock_response_val = MockResposne(content=self.head)
+        mock_response_val.iter_content = mock.Mock(side_effect=RequestException)
+        mock_request.get.return_value = mock_response_val
+
+        r = BaseUrlPreview(self.url)
+        r.fire()
+
+        self.assertFalse(r.success)
+        self.assertTrue(mock_response_val.closed)
+
+    def test_read_content_stop_after_head(self):
+        res = MockResposne(content=self.head + self.body)
+
+        r = BaseUrlPreview(self.url)
+        r.head_markers = (b'og:title',)
+
+        self.assertEqual(r._read_content(res), self.head.encode('utf-8'))
+
+    def test_read_content_keep_body_when_head_markers_missing(self):
+        res = MockResposne(content=self.head + self.body)
+
+        r = BaseUrlPreview(self.url, max_body_bytes=100)
+        r.head_markers = (b'og:image',)
+
+        content = r._read_content(res)
+        self.assertEqual(content, (self.head + self.body).encode('utf-8')[:len(self.head) + 100])
+
+    @mock.patch('shorten_urls.utils.PREVIEW_FETCH_CHUNK_SIZE', 3)
+    def test_read_content_find_head_across_chunks(self):
+        res = MockResposne(content=self.head + self.body)
+
+        r = BaseUrlPreview(self.url)
+
+        self.assertEqual(r._read_content(res), self.head.encode('utf-8'))
+
+    def test_read_content_capped_by_max_bytes(self):
+        res = MockResposne(content='<html><body>' + 'x' * 1000)
+
+        r = BaseUrlPreview(self.url, max_bytes=50)
+
+        self.assertEqual(len(r._read_content(res)), 50)
+
+
 class OpenGraphPreviewMixinTest(TestCase):
 
     def setUp(self):
@@ -271,6 +457,8 @@ class OpenGraphPreviewMixinTest(TestCase):
 
 class UrlPreviewTest(TestCase):
 
+    preview_class = UrlPreview
+
     def setUp(self):
         self.fake_url = 'https://www.fakeurl.com'
         self.html = '''
@@ -335,7 +523,7 @@ class UrlPreviewTest(TestCase):
         self.mock_response_val.content = html
         mock_request.get.return_value = self.mock_response_val
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertEqual(preview.get_title(), expect_title)
 
@@ -354,7 +542,7 @@ class UrlPreviewTest(TestCase):
         self.mock_response_val.content = html
         mock_request.get.return_value = self.mock_response_val
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertEqual(preview.get_title(), expect_title)
 
@@ -374,7 +562,7 @@ class UrlPreviewTest(TestCase):
         self.mock_response_val.content = html
         mock_request.get.return_value = self.mock_response_val
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertEqual(preview.get_title(), expect_title)
 
@@ -395,7 +583,7 @@ class UrlPreviewTest(TestCase):
         self.mock_response_val.content = html
         mock_request.get.return_value = self.mock_response_val
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertEqual(preview.get_title(), expect_title)
 
@@ -414,7 +602,7 @@ class UrlPreviewTest(TestCase):
         self.mock_response_val.content = html
         mock_request.get.return_value = self.mock_response_val
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertEqual(preview.get_title(), '')
 
@@ -436,7 +624,7 @@ class UrlPreviewTest(TestCase):
         self.mock_response_val.content = html
         mock_request.get.return_value = self.mock_response_val
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertEqual(preview.get_description(), expect_description)
 
@@ -457,7 +645,7 @@ class UrlPreviewTest(TestCase):
         self.mock_response_val.content = html
         mock_request.get.return_value = self.mock_response_val
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertEqual(preview.get_description(), expect_description)
 
@@ -477,7 +665,7 @@ class UrlPreviewTest(TestCase):
         self.mock_response_val.content = html
         mock_request.get.return_value = self.mock_response_val
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertEqual(preview.get_description(), '')
 
@@ -499,7 +687,7 @@ class UrlPreviewTest(TestCase):
         self.mock_response_val.content = html
         mock_request.get.return_value = self.mock_response_val
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertEqual(preview.get_url(), expect_url)
 
@@ -517,7 +705,7 @@ class UrlPreviewTest(TestCase):
         mock_request.get.return_value = self.mock_response_val
 
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertEqual(preview.get_url(), self.fake_url)
 
@@ -540,7 +728,7 @@ class UrlPreviewTest(TestCase):
         self.mock_response_val.content = html
         mock_request.get.return_value = self.mock_response_val
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertEqual(preview.get_img(), expect_img)
 
@@ -561,7 +749,7 @@ class UrlPreviewTest(TestCase):
         self.mock_response_val.content = html
         mock_request.get.return_value = self.mock_response_val
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertEqual(preview.get_img(), expect_img)
 
@@ -581,7 +769,7 @@ class UrlPreviewTest(TestCase):
         self.mock_response_val.content = html
         mock_request.get.return_value = self.mock_response_val
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertEqual(preview.get_img(), '')
 
@@ -598,7 +786,7 @@ class UrlPreviewTest(TestCase):
         self.mock_response_val.content = html
         mock_request.get.return_value = self.mock_response_val
 
-        preview = UrlPreview(self.fake_url)
+        preview = self.preview_class(self.fake_url)
         preview.fire()
         self.assertDictEqual(
             preview.as_dict(),
@@ -609,3 +797,141 @@ class UrlPreviewTest(TestCase):
                 'image': 'https://www.facebook.com/images/fb_icon_325x325.png'
             }
         )
+
+
+class SinglePassUrlPreviewTest(UrlPreviewTest):
+
+    preview_class = SinglePassUrlPreview
+
+
+class PreviewMetaParserTest(TestCase):
+
+    def parse(self, html):
+        parser = PreviewMetaParser(text_tags=['title', 'h1', 'p'], img_tags=['img'])
+        return parser.parse(html)
+
+    def test_collect_first_candidates(self):
+        document = self.parse('''
+            <html>
+                <head>
+                    <meta property="og:title" content="first &amp; title">
+                    <meta property="og:title" content="second title">
+                    <title>page title</title>
+                </head>
+                <body>
+                    <h1>hello, <b>nested</b> h1</h1>
+                    <p>first p</p><p>second p</p>
+                    <img alt="no src"><img src="www.img.com">
+                </body>
+            </html>
+        ''')
+
+        self.assertDictEqual(document.og, {'og:title': 'first & title'})
+        self.assertDictEqual(
+            document.texts,
+            {'title': 'page title', 'h1': 'hello, nested h1', 'p': 'first p'}
+        )
+        self.assertDictEqual(document.img_srcs, {'img': ''})
+
+    def test_unclosed_tags(self):
+        document = self.parse('<p>first p<p>second p<h1>unclosed h1')
+
+        self.assertEqual(document.texts['p'], 'first p')
+        self.assertEqual(document.texts['h1'], 'unclosed h1')
+
+    def test_stop_after_all_og_properties_found(self):
+        document = self.parse('''
+            <meta property="og:title" content="title">
+            <meta property="og:description" content="description">
+            <meta property="og:url" content="https://www.fake.com">
+            <meta property="og:image" content="https://www.fake.com/img">
+            <p>never reached</p>
+        ''')
+
+        self.assertEqual(len(document.og), 4)
+        self.assertDictEqual(document.texts, {})
+
+
+class HostConcurrencyLimiterTest(TestCase):
+
+    def test_limit_per_host(self):
+        limiter = HostConcurrencyLimiter(1)
+
+        with limiter.limit('www.fake.com'):
+            semaphore = limiter._semaphores['www.fake.com'][0]
+            self.assertFalse(semaphore.acquire(blocking=False))
+
+            # other hosts are not blocked
+            with limiter.limit('www.google.com'):
+                pass
+
+        self.assertDictEqual(limiter._semaphores, {})
+
+
+class UrlPreviewFetcherTest(TestCase):
+
+    def setUp(self):
+        self.html = '''
+        <html>
+            <head>
+                <meta property="og:title" content="{title}">
+            </head>
+        </html>
+        '''
+
+    @mock.patch('shorten_urls.utils.requests')
+    def test_fetch_previews_keep_input_order(self, mock_request):
+        def fake_get(url, **kwargs):
+            if 'failed' in url:
+                raise RequestException
+            return MockResposne(content=self.html.format(title=url))
+
+        mock_request.Session.return_value.get.side_effect = fake_get
+
+        urls = [
+            'https://www.fake.com/1',
+            'https://www.failed.com',
+            'https://www.fake.com/2',
+        ]
+        with UrlPreviewFetcher(max_workers=2, max_per_host=1) as fetcher:
+            result = fetcher.fetch_previews(urls)
+
+        self.assertEqual(
+            [preview.get('title') for preview in result],
+            ['https://www.fake.com/1', None, 'https://www.fake.com/2']
+        )
+        mock_request.get.assert_not_called()
+        mock_request.Session.return_value.close.assert_called_once_with()
+
+    @mock.patch('shorten_urls.utils.requests')
+    def test_fetch_previews_unexpected_error(self, mock_request):
+        mock_request.Session.return_value.get.return_value = MockResposne(
+            content=self.html.format(title='Facebook'))
+
+        urls = [
+            # urlsplit raises ValueError on an unclosed IPv6 bracket
+            'https://[www.fake.com',
+            'https://www.facebook.com',
+        ]
+        with self.assertLogs('shorten_urls.utils', 'ERROR'):
+            with UrlPreviewFetcher(max_workers=2) as fetcher:
+                result = fetcher.fetch_previews(urls)
+
+        self.assertEqual(result[0], {})
+        self.assertEqual(result[1]['title'], 'Facebook')
+
+    @mock.patch('shorten_urls.utils.requests')
+    def test_fetch_previews_function(self, mock_request):
+        mock_request.Session.return_value.get.return_value = MockResposne(
+            content=self.html.format(title='Facebook'))
+
+        result = fetch_previews(['https://www.facebook.com'])
+
+        self.assertEqual(result[0]['title'], 'Facebook')
+
+
+class GetUrlPreviewClassTest(TestCase):
+
+    def test_success(self):
+        self.assertIs(get_url_preview_class('soup'), UrlPreview)
+        self.assertIs(get_url_preview_class('single_pass'), SinglePassUrlPreview)
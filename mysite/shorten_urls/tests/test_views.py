@@ -1,9 +1,24 @@
 import http.client as httplib
+import os
+import tempfile
+import time
+from unittest import mock
 
-from django.test import TestCase, override_settings
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
 
-from ..models import ShortUrl
+from ..configs import (REDIRECT_CACHE_TIMEOUT,
+                       REDIRECT_NOT_FOUND_CACHE_TIMEOUT,
+                       REDIRECT_NOT_FOUND_CACHE_VALUE,
+                       REDIRECT_URL_REDIS_PREFIX)
+from ..logics import ShortUrlBulkLogics, ShortUrlIdRangeFilter, ShortUrlLogics
+from ..models import ShortUrl, get_url_id
+from ..single_flight import CacheEntry, get_cache_timeout
+from ..snapshot import build_redirect_snapshot
 from ..utils import b62_encode
+from ..views import redirect_local_cache, redirect_snapshot
+from .test_async_utils import LOCMEM_CACHES
 
 
 class IndexViewTest(TestCase):
@@ -51,6 +66,27 @@ class ShortUrlRedirectViewTest(TestCase):
 
         self.assertEqual(r.status_code, httplib.NOT_FOUND)
 
+    def test_short_url_with_other_offset(self):
+        # decodes to an existing id, but is not the code that was handed out
+        short_url_path = b62_encode(int(1E8) + 2 * int(1E8) + self.short_url_object.id)
+        r = self.client.get('/{}'.format(short_url_path))
+
+        self.assertEqual(r.status_code, httplib.NOT_FOUND)
+
+    @mock.patch('shorten_urls.views.redirect_id_range_filter',
+                ShortUrlIdRangeFilter(refresh_interval=60))
+    def test_short_url_beyond_id_range(self):
+        short_url_path = b62_encode(int(1E8) + int(5E7))
+
+        with self.assertNumQueries(2):
+            r = self.client.get('/{}'.format(short_url_path))
+        self.assertEqual(r.status_code, httplib.NOT_FOUND)
+
+        # known max id is reused until the next refresh
+        with self.assertNumQueries(0):
+            r = self.client.get('/{}'.format(short_url_path))
+        self.assertEqual(r.status_code, httplib.NOT_FOUND)
+
     def test_success(self):
         short_url_path = self.short_url_object.short_url_path
         r = self.client.get('/{}'.format(short_url_path))
@@ -60,3 +96,307 @@ class ShortUrlRedirectViewTest(TestCase):
             self.short_url_object.original_url,
             fetch_redirect_response=False
         )
+
+    @override_settings(ENABLE_CLICK_TRACKING=True)
+    @mock.patch('shorten_urls.views.click_buffer')
+    def test_success_records_click(self, mock_click_buffer):
+        short_url_path = self.short_url_object.short_url_path
+        self.client.get('/{}'.format(short_url_path))
+
+        mock_click_buffer.record.assert_called_once_with(short_url_path)
+
+    @override_settings(ENABLE_CLICK_TRACKING=True)
+    @mock.patch('shorten_urls.views.click_buffer')
+    def test_not_found_records_no_click(self, mock_click_buffer):
+        self.client.get('/{}'.format(b62_encode(int(1E8) + 9999)))
+
+        mock_click_buffer.record.assert_not_called()
+
+
+class CacheSetAssertionsMixin:
+
+    def assertCacheSet(self, mock_set, key, value, timeout):
+        mock_set.assert_called_once()
+        (set_key, entry), kwargs = mock_set.call_args
+
+        self.assertEqual(set_key, key)
+        self.assertEqual(entry.value, value)
+        self.assertEqual(kwargs, {'timeout': get_cache_timeout(timeout)})
+
+
+@override_settings(ENABLE_CACHE=True)
+@mock.patch('shorten_urls.views.cache')
+class ShortUrlRedirectViewCacheTest(CacheSetAssertionsMixin, TestCase):
+
+    def setUp(self):
+        self.short_url_object = ShortUrl.objects.create(
+            original_url='https://www.fake.com',
+            random_offset=1
+        )
+        self.short_url_path = self.short_url_object.short_url_path
+        self.cache_key = REDIRECT_URL_REDIS_PREFIX + self.short_url_path
+
+        redirect_local_cache.clear()
+        self.addCleanup(redirect_local_cache.clear)
+
+    def test_miss_fills_both_tiers(self, mock_cache):
+        mock_cache.get.return_value = None
+
+        r = self.client.get('/{}'.format(self.short_url_path))
+
+        self.assertRedirects(r, 'https://www.fake.com', fetch_redirect_response=False)
+        self.assertCacheSet(
+            mock_cache.set, self.cache_key, 'https://www.fake.com', REDIRECT_CACHE_TIMEOUT)
+        self.assertEqual(redirect_local_cache.get(self.cache_key), 'https://www.fake.com')
+
+    def test_redis_hit_fills_local_tier(self, mock_cache):
+        mock_cache.get.return_value = 'https://www.cached.com'
+
+        with self.assertNumQueries(0):
+            r = self.client.get('/{}'.format(self.short_url_path))
+
+        self.assertRedirects(r, 'https://www.cached.com', fetch_redirect_response=False)
+        self.assertEqual(redirect_local_cache.get(self.cache_key), 'https://www.cached.com')
+
+    def test_local_hit_skips_redis(self, mock_cache):
+        redirect_local_cache.set(self.cache_key, 'https://www.local.com')
+
+        with self.assertNumQueries(0):
+            r = self.client.get('/{}'.format(self.short_url_path))
+
+        self.assertRedirects(r, 'https://www.local.com', fetch_redirect_response=False)
+        mock_cache.get.assert_not_called()
+
+    def test_not_found_is_cached_in_redis_only(self, mock_cache):
+        mock_cache.get.return_value = None
+        short_url_path = b62_encode(int(1E8) + 9999)
+        cache_key = REDIRECT_URL_REDIS_PREFIX + short_url_path
+
+        r = self.client.get('/{}'.format(short_url_path))
+
+        self.assertEqual(r.status_code, httplib.NOT_FOUND)
+        self.assertCacheSet(
+            mock_cache.set, cache_key, REDIRECT_NOT_FOUND_CACHE_VALUE,
+            REDIRECT_NOT_FOUND_CACHE_TIMEOUT)
+        self.assertIsNone(redirect_local_cache.get(cache_key))
+
+    def test_stale_while_refreshing(self, mock_cache):
+        mock_cache.get.return_value = CacheEntry('https://www.stale.com', time.time() - 1, 0)
+        # another process holds the refresh lock
+        mock_cache.add.return_value = False
+
+        with self.assertNumQueries(0):
+            r = self.client.get('/{}'.format(self.short_url_path))
+
+        self.assertRedirects(r, 'https://www.stale.com', fetch_redirect_response=False)
+        mock_cache.set.assert_not_called()
+
+    def test_due_is_refreshed(self, mock_cache):
+        entry = CacheEntry('https://www.stale.com', time.time() - 1, 0)
+
+        def get(key):
+            if key == 'LOCK:' + self.cache_key:
+                # still held with the token it was taken with
+                return mock_cache.add.call_args[0][1]
+            return entry
+
+        mock_cache.get.side_effect = get
+        mock_cache.add.return_value = True
+
+        r = self.client.get('/{}'.format(self.short_url_path))
+
+        self.assertRedirects(r, 'https://www.fake.com', fetch_redirect_response=False)
+        self.assertCacheSet(
+            mock_cache.set, self.cache_key, 'https://www.fake.com', REDIRECT_CACHE_TIMEOUT)
+        mock_cache.delete.assert_called_once_with('LOCK:' + self.cache_key)
+
+    def test_redis_not_found_hit(self, mock_cache):
+        mock_cache.get.return_value = REDIRECT_NOT_FOUND_CACHE_VALUE
+
+        with self.assertNumQueries(0):
+            r = self.client.get('/{}'.format(self.short_url_path))
+
+        self.assertEqual(r.status_code, httplib.NOT_FOUND)
+        self.assertIsNone(redirect_local_cache.get(self.cache_key))
+
+
+@override_settings(ENABLE_CACHE=True, CACHES=LOCMEM_CACHES)
+@mock.patch('shorten_urls.logics.get_random_offset', return_value=3)
+@mock.patch('shorten_urls.models.get_random_offset', return_value=3)
+class ShortUrlRedirectViewNewCodeTest(TestCase):
+    # the code of the next id is requested before the row is created
+
+    def setUp(self):
+        self.url_id = ShortUrl.objects.allocate_ids()[0] + 1
+        self.short_url_path = b62_encode(get_url_id(self.url_id, 3))
+
+        cache.clear()
+        redirect_local_cache.clear()
+        self.addCleanup(redirect_local_cache.clear)
+
+    def assertNewCodeRedirects(self, create):
+        r = self.client.get('/{}'.format(self.short_url_path))
+        self.assertEqual(r.status_code, httplib.NOT_FOUND)
+
+        with mock.patch.object(ShortUrl.objects, 'allocate_ids', return_value=[self.url_id]):
+            self.assertEqual(create(), self.short_url_path)
+
+        r = self.client.get('/{}'.format(self.short_url_path))
+        self.assertRedirects(r, 'https://www.new.com', fetch_redirect_response=False)
+
+    def test_create(self, *mocks):
+        self.assertNewCodeRedirects(
+            lambda: ShortUrlLogics('https://www.new.com').get_short_url_info()['short_url_path'])
+
+    def test_bulk_create(self, *mocks):
+        self.assertNewCodeRedirects(
+            lambda: ShortUrlBulkLogics(
+                ['https://www.new.com']).get_short_url_infos()[0]['short_url_path'])
+
+
+@override_settings(ENABLE_CACHE=True)
+@mock.patch('shorten_urls.views.cache')
+class ShortUrlRedirectViewSnapshotTest(TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, 'redirects.snapshot')
+
+        self.short_url_object = ShortUrl.objects.create('https://www.fake.com')
+        build_redirect_snapshot(path)
+
+        # cleanups run last in first out, drop the snapshot once the path is unset
+        self.addCleanup(redirect_snapshot.reload)
+        settings_override = override_settings(REDIRECT_SNAPSHOT_PATH=path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        redirect_snapshot.reload()
+
+        redirect_local_cache.clear()
+        self.addCleanup(redirect_local_cache.clear)
+
+    def test_hit_skips_redis_and_database(self, mock_cache):
+        with self.assertNumQueries(0):
+            r = self.client.get('/{}'.format(self.short_url_object.short_url_path))
+
+        self.assertRedirects(r, 'https://www.fake.com', fetch_redirect_response=False)
+        mock_cache.get.assert_not_called()
+
+    def test_newer_short_url_falls_back(self, mock_cache):
+        mock_cache.get.return_value = None
+        short_url_object = ShortUrl.objects.create('https://www.fake.com/new')
+
+        r = self.client.get('/{}'.format(short_url_object.short_url_path))
+
+        self.assertRedirects(r, 'https://www.fake.com/new', fetch_redirect_response=False)
+        mock_cache.get.assert_any_call(REDIRECT_URL_REDIS_PREFIX + short_url_object.short_url_path)
+
+
+@override_settings(ROOT_URLCONF='mysite.asgi_urls')
+class AsyncShortUrlRedirectViewTest(CacheSetAssertionsMixin, TransactionTestCase):
+
+    def setUp(self):
+        self.short_url_object = ShortUrl.objects.create(original_url='https://www.fake.com')
+        self.short_url_path = self.short_url_object.short_url_path
+        self.cache_key = REDIRECT_URL_REDIS_PREFIX + self.short_url_path
+
+        redirect_local_cache.clear()
+        self.addCleanup(redirect_local_cache.clear)
+
+    def test_success(self):
+        r = self.client.get('/{}'.format(self.short_url_path))
+
+        self.assertRedirects(r, 'https://www.fake.com', fetch_redirect_response=False)
+
+    def test_short_url_not_exist(self):
+        r = self.client.get('/{}'.format(b62_encode(int(1E8) + 9999)))
+
+        self.assertEqual(r.status_code, httplib.NOT_FOUND)
+
+    @override_settings(ENABLE_CACHE=True)
+    @mock.patch('shorten_urls.views.async_cache')
+    def test_miss_fills_both_tiers(self, mock_async_cache):
+        mock_async_cache.get = mock.AsyncMock(return_value=None)
+        mock_async_cache.set = mock.AsyncMock()
+        mock_async_cache.add = mock.AsyncMock(return_value=True)
+        mock_async_cache.delete = mock.AsyncMock()
+
+        r = self.client.get('/{}'.format(self.short_url_path))
+
+        self.assertRedirects(r, 'https://www.fake.com', fetch_redirect_response=False)
+        self.assertCacheSet(
+            mock_async_cache.set, self.cache_key, 'https://www.fake.com', REDIRECT_CACHE_TIMEOUT)
+        self.assertEqual(redirect_local_cache.get(self.cache_key), 'https://www.fake.com')
+
+    @override_settings(ENABLE_CACHE=True)
+    @mock.patch('shorten_urls.views.async_cache')
+    def test_redis_hit(self, mock_async_cache):
+        mock_async_cache.get = mock.AsyncMock(return_value='https://www.cached.com')
+
+        with self.assertNumQueries(0):
+            r = self.client.get('/{}'.format(self.short_url_path))
+
+        self.assertRedirects(r, 'https://www.cached.com', fetch_redirect_response=False)
+
+    @override_settings(ENABLE_CACHE=True)
+    @mock.patch('shorten_urls.views.async_cache')
+    def test_not_found_is_cached(self, mock_async_cache):
+        mock_async_cache.get = mock.AsyncMock(return_value=None)
+        mock_async_cache.set = mock.AsyncMock()
+        mock_async_cache.add = mock.AsyncMock(return_value=True)
+        mock_async_cache.delete = mock.AsyncMock()
+        short_url_path = b62_encode(int(1E8) + 9999)
+
+        r = self.client.get('/{}'.format(short_url_path))
+
+        self.assertEqual(r.status_code, httplib.NOT_FOUND)
+        self.assertCacheSet(
+            mock_async_cache.set, REDIRECT_URL_REDIS_PREFIX + short_url_path,
+            REDIRECT_NOT_FOUND_CACHE_VALUE, REDIRECT_NOT_FOUND_CACHE_TIMEOUT)
+
+
+class ShortUrlASGIHandlerTest(TransactionTestCase):
+
+    def get(self, path, query_string=b''):
+        from mysite.asgi import application
+
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'root_path': '',
+            'query_string': query_string, 'headers': [(b'host', b'testserver')],
+            'client': ('127.0.0.1', 12345), 'server': ('testserver', 80),
+        }
+        async_to_sync(application)(scope, receive, send)
+
+        return messages[0]['status'], dict(messages[0]['headers'])
+
+    def test_redirect(self):
+        short_url_object = ShortUrl.objects.create(original_url='https://www.fake.com')
+
+        status, headers = self.get('/{}'.format(short_url_object.short_url_path))
+
+        self.assertEqual(status, httplib.FOUND)
+        self.assertEqual(headers[b'Location'], b'https://www.fake.com')
+
+    def test_get_original_url(self):
+        short_url_object = ShortUrl.objects.create(original_url='https://www.fake.com')
+
+        status, _ = self.get(
+            '/api/v1/short_urls/original_url',
+            'short_url={}'.format(short_url_object.short_url_path).encode())
+
+        self.assertEqual(status, httplib.OK)
+
+    def test_other_urls(self):
+        status, _ = self.get('/')
+
+        self.assertEqual(status, httplib.OK)
@@ -1,70 +1,284 @@
 import http.client as httplib
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from html.parser import HTMLParser
+from string import ascii_letters, digits
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
 
 import requests
 from bs4 import BeautifulSoup
+from bs4.dammit import UnicodeDammit
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
-from .configs import (B62_ALPHABET, ENCODE_NUM_MAX, REVERSE_B62_ALPHABET,
-                      SHORT_URL_MAX_LEN)
+from .configs import (B62_ALPHABET, B62_POWERS, CRAWL_URL_PREVIEW_TIMEOUT,
+                      ENCODE_NUM_MAX, PREVIEW_FETCH_BODY_MAX_BYTES,
+                      PREVIEW_FETCH_CHUNK_SIZE, PREVIEW_FETCH_MAX_BYTES,
+                      PREVIEW_FETCH_MAX_HOSTS, PREVIEW_FETCH_MAX_PER_HOST,
+                      PREVIEW_FETCH_MAX_WORKERS, REVERSE_B62_ALPHABET,
+                      SHORT_URL_MAX_LEN, URL_CANONICAL_DROP_PARAMS,
+                      URL_PREVIEW_EXTRACTOR)
+from .metrics import COMPONENT_CRAWL, timed
 
+logger = logging.getLogger(__name__)
 
-def b62_encode(number):
-    result = []
-    alphabet_Len = len(B62_ALPHABET)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+B62_BASE = len(B62_ALPHABET)
+
+# every two-digit base62 string, so encoding consumes two digits per divmod
+_B62_PAIRS = tuple(
+    first + second for first in B62_ALPHABET for second in B62_ALPHABET
+)
+_B62_PAIRS_BASE = B62_BASE * B62_BASE
+
+if np is not None:
+    _NP_B62_ALPHABET = np.frombuffer(B62_ALPHABET.encode('ascii'), dtype=np.uint8)
+    _NP_B62_POWERS = np.array(B62_POWERS[::-1], dtype=np.int64)
 
+    # byte value -> digit value, -1 for bytes outside the alphabet
+    _NP_REVERSE_B62_ALPHABET = np.full(256, -1, dtype=np.int64)
+    for char, value in REVERSE_B62_ALPHABET.items():
+        _NP_REVERSE_B62_ALPHABET[ord(char)] = value
+
+
+def _check_encode_number(number):
     if not isinstance(number, int):
         raise ValueError('number must be positive integer')
     elif not 1 <= number <= ENCODE_NUM_MAX:
         raise ValueError(
             'number must be in range 1 to {}, not {}'.format(ENCODE_NUM_MAX, number))
 
-    while number:
-        result.append(B62_ALPHABET[number % alphabet_Len])
-        number //= alphabet_Len
-
-    return ''.join(reversed(result))
-
-
-def b62_decode(string, maxlen=SHORT_URL_MAX_LEN):
 
+def _check_decode_string(string, maxlen):
     if not isinstance(string, str):
         raise ValueError('string must be a instance of str')
     elif not 1 <= len(string) <= maxlen:
         raise ValueError(
             'string length must be in range 1 to {}'.format(SHORT_URL_MAX_LEN))
 
+
+def b62_encode(number):
+    _check_encode_number(number)
+
+    result = ''
+    while number:
+        number, pair_index = divmod(number, _B62_PAIRS_BASE)
+        result = _B62_PAIRS[pair_index] + result
+
+    return result.lstrip(B62_ALPHABET[0])
+
+
+def b62_decode(string, maxlen=SHORT_URL_MAX_LEN):
+    _check_decode_string(string, maxlen)
+
     number = 0
-    for index, char in enumerate(reversed(string)):
-        number += pow(62, index) * REVERSE_B62_ALPHABET[char]
+    for char in string:
+        number = number * B62_BASE + REVERSE_B62_ALPHABET[char]
 
     return number
 
 
+def b62_encode_many(numbers):
+    if np is None:
+        return [b62_encode(number) for number in numbers]
+
+    if isinstance(numbers, np.ndarray):
+        if numbers.dtype.kind not in 'iu':
+            raise ValueError('numbers must be an array of positive integers')
+    else:
+        numbers = list(numbers)
+        for number in numbers:
+            if not isinstance(number, int):
+                raise ValueError('number must be positive integer')
+
+    if len(numbers) == 0:
+        return []
+
+    numbers = np.asarray(numbers, dtype=np.int64).ravel()
+    if numbers.min() < 1 or numbers.max() > ENCODE_NUM_MAX:
+        raise ValueError(
+            'numbers must be in range 1 to {}'.format(ENCODE_NUM_MAX))
+
+    digits = (numbers[:, None] // _NP_B62_POWERS) % B62_BASE
+    chars = _NP_B62_ALPHABET[digits]
+
+    codes = chars.view('S{}'.format(len(B62_POWERS))).ravel()
+    return [
+        code.decode('ascii').lstrip(B62_ALPHABET[0]) for code in codes.tolist()
+    ]
+
+
+def b62_decode_many(strings, maxlen=SHORT_URL_MAX_LEN):
+    is_array = np is not None and isinstance(strings, np.ndarray)
+    strings = [str(string) for string in strings] if is_array else list(strings)
+
+    for string in strings:
+        _check_decode_string(string, maxlen)
+
+    if np is None:
+        return [b62_decode(string, maxlen) for string in strings]
+
+    if not strings:
+        return np.array([], dtype=np.int64) if is_array else []
+
+    length = len(strings[0])
+    if any(len(string) != length for string in strings):
+        numbers = np.array(
+            [b62_decode(string, maxlen) for string in strings], dtype=np.int64)
+    else:
+        raw = np.frombuffer(''.join(strings).encode('ascii'), dtype=np.uint8)
+        digits = _NP_REVERSE_B62_ALPHABET[raw.reshape(len(strings), length)]
+        if (digits < 0).any():
+            raise KeyError('string contains characters outside base62 alphabet')
+
+        numbers = digits @ _NP_B62_POWERS[-length:]
+
+    return numbers if is_array else numbers.tolist()
+
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+_PERCENT_ENCODED = re.compile('%([0-9A-Fa-f]{2})')
+_UNRESERVED_CHARS = frozenset(ascii_letters + digits + '-._~')
+
+
+def _normalize_percent_encoding(value):
+    def replace(match):
+        char = chr(int(match.group(1), 16))
+        if char in _UNRESERVED_CHARS:
+            return char
+
+        return '%' + match.group(1).upper()
+
+    return _PERCENT_ENCODED.sub(replace, value)
+
+
+def _canonicalize_query(query, drop_params):
+    params = []
+    for param in query.split('&'):
+        if not param:
+            continue
+
+        key = unquote_plus(param.partition('=')[0])
+        if any(fnmatchcase(key, pattern) for pattern in drop_params):
+            continue
+
+        params.append(_normalize_percent_encoding(param))
+
+    # sorting by key only keeps the order of repeated keys
+    params.sort(key=lambda param: param.partition('=')[0])
+    return '&'.join(params)
+
+
+def canonicalize_url(url, drop_params=URL_CANONICAL_DROP_PARAMS):
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+
+    try:
+        port = parts.port
+    except ValueError:
+        return url
+
+    host = parts.hostname or ''
+    if ':' in host:
+        host = '[{}]'.format(host)
+    if port is not None and port != _DEFAULT_PORTS.get(scheme):
+        host = '{}:{}'.format(host, port)
+
+    userinfo, at, _ = parts.netloc.rpartition('@')
+    netloc = userinfo + at + host
+
+    path = _normalize_percent_encoding(parts.path) or '/'
+    query = _canonicalize_query(parts.query, drop_params)
+    fragment = _normalize_percent_encoding(parts.fragment)
+
+    return urlunsplit((scheme, netloc, path, query, fragment))
+
+
 class BaseUrlPreview:
 
+    # reading stops right after </head> once all of these appear in it,
+    # otherwise up to max_body_bytes of the body are kept for fallbacks
+    head_markers = ()
+
     def __init__(self, url, timeout=None, headers=None, parser='html.parser',
-                 *args, **kwargs):
+                 session=None, max_bytes=PREVIEW_FETCH_MAX_BYTES,
+                 max_body_bytes=PREVIEW_FETCH_BODY_MAX_BYTES, *args, **kwargs):
         self.url = url
         self.timeout = timeout
         self.headers = headers
         self.parser = parser
+        self.session = session
+        self.max_bytes = max_bytes
+        self.max_body_bytes = max_body_bytes
         self._success = False
 
     def fire(self):
+        client = self.session or requests
+
         try:
-            res = requests.get(self.url,
-                timeout=self.timeout, headers=self.headers)
+            res = client.get(self.url,
+                timeout=self.timeout, headers=self.headers, stream=True)
         except RequestException:
             return
 
-        if res.status_code >= httplib.BAD_REQUEST:
-            return
+        try:
+            if res.status_code >= httplib.BAD_REQUEST:
+                return
 
-        if 'text/html' not in res.headers['Content-Type']:
+            if 'text/html' not in res.headers.get('Content-Type', ''):
+                return
+
+            content = self._read_content(res)
+        except RequestException:
             return
+        finally:
+            res.close()
 
         self._success = True
-        self.soup = BeautifulSoup(res.content, self.parser)
+        self.soup = self.build_document(content)
+
+    def build_document(self, content):
+        return BeautifulSoup(content, self.parser)
+
+    def _read_content(self, res):
+        content = bytearray()
+        head_end = -1
+        search_start = 0
+
+        for chunk in res.iter_content(chunk_size=PREVIEW_FETCH_CHUNK_SIZE):
+            content += chunk
+
+            if head_end < 0:
+                head_end = content.find(b'</head>', search_start)
+                if head_end < 0:
+                    head_end = content.find(b'</HEAD>', search_start)
+
+                if head_end >= 0:
+                    head_end += len(b'</head>')
+                    if self._has_head_markers(content[:head_end]):
+                        return bytes(content[:head_end])
+                else:
+                    search_start = max(0, len(content) - len(b'</head>'))
+
+            if head_end >= 0 and len(content) - head_end >= self.max_body_bytes:
+                return bytes(content[:head_end + self.max_body_bytes])
+
+            if len(content) >= self.max_bytes:
+                break
+
+        return bytes(content[:self.max_bytes])
+
+    def _has_head_markers(self, head):
+        return all(marker in head for marker in self.head_markers)
 
     @property
     def success(self):
@@ -104,6 +318,7 @@ class OpenGraphPreviewMixin:
 
 class UrlPreview(OpenGraphPreviewMixin, BaseUrlPreview):
 
+    head_markers = (b'og:title', b'og:description', b'og:image')
     title_tags = ['title', 'h1', 'h2']
     description_tags = ['p']
     img_tags = ['img']
@@ -143,19 +358,22 @@ class UrlPreview(OpenGraphPreviewMixin, BaseUrlPreview):
 
         return url
 
+    def _fallback_img_by_tags(self, soup, tags):
+        for tag in tags:
+            img_tag = soup.find(tag)
+
+            if img_tag and img_tag.get('src'):
+                return img_tag.get('src')
+
+        return ''
+
     def get_img(self):
         img = self._og_get_img(self.soup)
 
         if img:
             return img
 
-        for tag in self.img_tags:
-            img_tag = self.soup.find(tag)
-
-            if img_tag and img_tag.get('src'):
-                return img_tag.get('src')
-
-        return ''
+        return self._fallback_img_by_tags(self.soup, self.img_tags)
 
     def as_dict(self):
         title = self.get_title()
@@ -169,3 +387,221 @@ class UrlPreview(OpenGraphPreviewMixin, BaseUrlPreview):
             'url': url,
             'image': img
         }
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class PreviewMetaParser(HTMLParser):
+
+    og_properties = ('og:title', 'og:description', 'og:url', 'og:image')
+
+    def __init__(self, text_tags, img_tags):
+        super(PreviewMetaParser, self).__init__(convert_charrefs=True)
+
+        self.text_tags = frozenset(text_tags)
+        self.img_tags = frozenset(img_tags)
+
+        self.og = {}
+        self.texts = {}
+        self.img_srcs = {}
+
+        self._capturing = {}
+
+    def _is_complete(self):
+        if len(self.og) == len(self.og_properties):
+            return True
+
+        return (
+            len(self.texts) == len(self.text_tags) and
+            len(self.img_srcs) == len(self.img_tags)
+        )
+
+    def _finish_capture(self, tag):
+        self.texts[tag] = ''.join(self._capturing.pop(tag))
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'meta':
+            attrs = dict(attrs)
+            prop = attrs.get('property')
+            if prop in self.og_properties and prop not in self.og:
+                self.og[prop] = attrs.get('content') or ''
+        elif tag in self.img_tags:
+            if tag not in self.img_srcs:
+                self.img_srcs[tag] = dict(attrs).get('src') or ''
+        elif tag in self.text_tags:
+            # only the first element of each tag is used, a second opening
+            # tag closes an unterminated first one like <p>a<p>b does
+            if tag in self._capturing:
+                self._finish_capture(tag)
+            elif tag not in self.texts:
+                self._capturing[tag] = []
+
+        if self._is_complete():
+            raise _StopParsing
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in self._capturing:
+            self._finish_capture(tag)
+
+            if self._is_complete():
+                raise _StopParsing
+
+    def handle_data(self, data):
+        for parts in self._capturing.values():
+            parts.append(data)
+
+    def parse(self, markup):
+        try:
+            self.feed(markup)
+            self.close()
+        except _StopParsing:
+            pass
+
+        for tag in list(self._capturing):
+            self._finish_capture(tag)
+
+        return self
+
+
+class SinglePassPreviewMixin:
+
+    def build_document(self, content):
+        markup = UnicodeDammit(content, is_html=True).unicode_markup or ''
+
+        parser = PreviewMetaParser(
+            text_tags=list(self.title_tags) + list(self.description_tags),
+            img_tags=self.img_tags)
+        return parser.parse(markup)
+
+    def _og_get_title(self, document):
+        return document.og.get('og:title', '')
+
+    def _og_get_description(self, document):
+        return document.og.get('og:description', '')
+
+    def _og_get_url(self, document):
+        return document.og.get('og:url', '')
+
+    def _og_get_img(self, document):
+        return document.og.get('og:image', '')
+
+    def _fallback_by_tags(self, document, tags):
+        for tag in tags:
+            text = document.texts.get(tag)
+            if text:
+                return text
+
+        return ''
+
+    def _fallback_img_by_tags(self, document, tags):
+        for tag in tags:
+            src = document.img_srcs.get(tag)
+            if src:
+                return src
+
+        return ''
+
+
+class SinglePassUrlPreview(SinglePassPreviewMixin, UrlPreview):
+    pass
+
+
+URL_PREVIEW_CLASSES = {
+    'soup': UrlPreview,
+    'single_pass': SinglePassUrlPreview,
+}
+
+
+def get_url_preview_class(extractor=URL_PREVIEW_EXTRACTOR):
+    return URL_PREVIEW_CLASSES[extractor]
+
+
+class HostConcurrencyLimiter:
+
+    def __init__(self, max_per_host):
+        self.max_per_host = max_per_host
+
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    @contextmanager
+    def limit(self, host):
+        with self._lock:
+            entry = self._semaphores.get(host)
+            if entry is None:
+                entry = self._semaphores[host] = [
+                    threading.BoundedSemaphore(self.max_per_host), 0]
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                yield
+        finally:
+            # drop idle hosts so a large catalog does not pile up semaphores
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._semaphores[host]
+
+
+class UrlPreviewFetcher:
+
+    def __init__(self, max_workers=PREVIEW_FETCH_MAX_WORKERS,
+                 max_per_host=PREVIEW_FETCH_MAX_PER_HOST,
+                 max_hosts=PREVIEW_FETCH_MAX_HOSTS,
+                 timeout=CRAWL_URL_PREVIEW_TIMEOUT, headers=None,
+                 preview_class=None):
+        self.timeout = timeout
+        self.headers = headers
+        self.preview_class = preview_class or get_url_preview_class()
+
+        # one keep-alive pool per host, the least recently used host pools
+        # are closed once more than max_hosts are open
+        adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=max_per_host)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.host_limiter = HostConcurrencyLimiter(max_per_host)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+    def fetch_preview(self, url):
+        # any error stays with its url, one bad page must not fail the
+        # others of fetch_previews
+        try:
+            preview = self.preview_class(
+                url, timeout=self.timeout, headers=self.headers, session=self.session)
+
+            with self.host_limiter.limit(urlsplit(url).hostname or ''):
+                with timed(COMPONENT_CRAWL):
+                    preview.fire()
+
+            if preview.success:
+                return preview.as_dict()
+        except Exception:
+            logger.exception('Failed to fetch the preview of %s', url)
+
+        return {}
+
+    def fetch_previews(self, urls):
+        return list(self.executor.map(self.fetch_preview, urls))
+
+
+def fetch_previews(urls, **kwargs):
+    with UrlPreviewFetcher(**kwargs) as fetcher:
+        return fetcher.fetch_previews(urls)
@@ -1,11 +1,39 @@
+from functools import partial
+
 from django.conf import settings
-from django.core.cache import cache
-from django.http import HttpResponseNotFound, HttpResponseRedirect
-from django.views.generic import RedirectView, TemplateView
+from django.core.cache import cache as default_cache
+from django.http import (HttpResponse, HttpResponseNotFound,
+                         HttpResponseRedirect)
+from django.views.generic import RedirectView, TemplateView, View
+
+from .async_utils import AsyncCache, AsyncViewMixin, run_in_thread
+from .clicks import click_buffer
+from .configs import (REDIRECT_CACHE_TIMEOUT, REDIRECT_ID_RANGE_FILTER_ENABLED,
+                      REDIRECT_ID_RANGE_FILTER_MARGIN,
+                      REDIRECT_ID_RANGE_FILTER_REFRESH_INTERVAL,
+                      REDIRECT_LOCAL_CACHE_MAX_SIZE,
+                      REDIRECT_LOCAL_CACHE_TIMEOUT,
+                      REDIRECT_NOT_FOUND_CACHE_TIMEOUT,
+                      REDIRECT_NOT_FOUND_CACHE_VALUE,
+                      REDIRECT_URL_REDIS_PREFIX)
+from .local_cache import LRUCache
+from .logics import (ShortUrlIdRangeFilter, decode_short_url,
+                     get_short_url_object_for_read)
+from .metrics import TimedCache, registry
+from .single_flight import async_get_or_refresh, get_or_refresh
+from .snapshot import RedirectSnapshotReader
+
+cache = TimedCache(default_cache)
+async_cache = AsyncCache()
+
+redirect_local_cache = LRUCache(
+    REDIRECT_LOCAL_CACHE_MAX_SIZE, timeout=REDIRECT_LOCAL_CACHE_TIMEOUT)
+
+redirect_snapshot = RedirectSnapshotReader()
 
-from .configs import REDIRECT_URL_REDIS_PREFIX
-from .logics import decode_short_url
-from .models import ShortUrl
+redirect_id_range_filter = ShortUrlIdRangeFilter(
+    REDIRECT_ID_RANGE_FILTER_REFRESH_INTERVAL,
+    margin=REDIRECT_ID_RANGE_FILTER_MARGIN)
 
 
 class IndexView(TemplateView):
@@ -13,33 +41,138 @@ class IndexView(TemplateView):
     template_name = 'shorten_urls/index.html'
 
 
+def lookup_original_url(short_url):
+    """
+    Return the original url of a short url from the database, or
+    REDIRECT_NOT_FOUND_CACHE_VALUE if it does not exist. Returns None for
+    codes rejected before the lookup, which are not worth caching.
+    """
+    try:
+        url_id = decode_short_url(short_url)
+    except (KeyError, ValueError):
+        return None
+
+    if REDIRECT_ID_RANGE_FILTER_ENABLED and not redirect_id_range_filter.might_exist(url_id):
+        return None
+
+    short_url_object = get_short_url_object_for_read(short_url, url_id=url_id)
+    if short_url_object is None:
+        return REDIRECT_NOT_FOUND_CACHE_VALUE
+
+    return short_url_object.original_url
+
+
+def _set_local_cache(cache_key, url):
+    # not found stays in Redis only, where creating the code drops it; the
+    # local tiers of the other processes could not be told
+    if url != REDIRECT_NOT_FOUND_CACHE_VALUE:
+        redirect_local_cache.set(cache_key, url)
+
+
+def _lookup_redirect(short_url):
+    original_url = lookup_original_url(short_url)
+    if original_url == REDIRECT_NOT_FOUND_CACHE_VALUE:
+        return original_url, REDIRECT_NOT_FOUND_CACHE_TIMEOUT
+
+    return original_url, REDIRECT_CACHE_TIMEOUT
+
+
+def get_original_url(short_url):
+    """
+    Resolve a short url through the local cache, the redirect snapshot,
+    Redis and the database, filling the cache tiers on the way back.
+    Returns the same values as lookup_original_url.
+
+    Redis misses go through single_flight.get_or_refresh, so a hot key
+    running out is looked up once instead of by every request at once.
+    """
+    cache_key = REDIRECT_URL_REDIS_PREFIX + short_url
+
+    if settings.ENABLE_CACHE:
+        cached_url = redirect_local_cache.get(cache_key)
+        if cached_url:
+            return cached_url
+
+    original_url = redirect_snapshot.get(short_url)
+    if original_url is not None:
+        return original_url
+
+    if not settings.ENABLE_CACHE:
+        return lookup_original_url(short_url)
+
+    original_url = get_or_refresh(cache, cache_key, partial(_lookup_redirect, short_url))
+    if original_url is not None:
+        _set_local_cache(cache_key, original_url)
+
+    return original_url
+
+
+async def async_get_original_url(short_url):
+    """
+    get_original_url for async code: Redis is awaited on the event loop and
+    only the database lookup runs in a worker thread.
+    """
+    cache_key = REDIRECT_URL_REDIS_PREFIX + short_url
+
+    if settings.ENABLE_CACHE:
+        cached_url = redirect_local_cache.get(cache_key)
+        if cached_url:
+            return cached_url
+
+    original_url = redirect_snapshot.get(short_url)
+    if original_url is not None:
+        return original_url
+
+    if not settings.ENABLE_CACHE:
+        return await run_in_thread(lookup_original_url, short_url)
+
+    original_url = await async_get_or_refresh(
+        async_cache, cache_key, partial(run_in_thread, _lookup_redirect, short_url))
+    if original_url is not None:
+        _set_local_cache(cache_key, original_url)
+
+    return original_url
+
+
 class ShortUrlRedirectView(RedirectView):
     http_method_names = ['get']
+    not_found_message = '<h1>404 Not Found</h1>'
+
+    def get_redirect_response(self, short_url, url):
+        if url is None or url == REDIRECT_NOT_FOUND_CACHE_VALUE:
+            return HttpResponseNotFound(self.not_found_message)
+
+        if settings.ENABLE_CLICK_TRACKING:
+            click_buffer.record(short_url)
+
+        return HttpResponseRedirect(url)
 
     def get(self, request, *args, **kwargs):
         short_url = kwargs.get('short_url')
-        not_found_message = '<h1>404 Not Found</h1>'
 
-        cache_key = REDIRECT_URL_REDIS_PREFIX + short_url
+        return self.get_redirect_response(short_url, get_original_url(short_url))
 
-        if settings.ENABLE_CACHE:
-            cached_url = cache.get(cache_key)
-            if  cached_url:
-                return HttpResponseRedirect(cached_url)
 
-        try:
-            url_id = decode_short_url(short_url)
-        except (KeyError, ValueError):
-            return HttpResponseNotFound(not_found_message)
+class AsyncShortUrlRedirectView(AsyncViewMixin, ShortUrlRedirectView):
+    """
+    ShortUrlRedirectView for the ASGI entry point, see async_get_original_url.
+    """
 
-        try:
-            short_url_object = ShortUrl.objects.get(id=url_id)
-        except ShortUrl.DoesNotExist:
-            return HttpResponseNotFound(not_found_message)
+    async def get(self, request, *args, **kwargs):
+        short_url = kwargs.get('short_url')
 
-        original_url = short_url_object.original_url
+        return self.get_redirect_response(short_url, await async_get_original_url(short_url))
 
-        if settings.ENABLE_CACHE:
-            cache.set(cache_key, original_url)
 
-        return HttpResponseRedirect(original_url)
+class MetricsView(View):
+    http_method_names = ['get']
+
+    def get(self, request, *args, **kwargs):
+        # behind a proxy this is the proxy's address, which then has to
+        # keep /metrics from being forwarded
+        if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+            return HttpResponseNotFound()
+
+        return HttpResponse(
+            registry.render_prometheus(),
+            content_type='text/plain; version=0.0.4; charset=utf-8')